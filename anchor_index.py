@@ -0,0 +1,111 @@
+"""
+SmartAlly - Anchor Index
+Per-document interval index over the anchors of an HTML filing, built once at
+parse time from the id -> (start, end) text offsets produced by html_ingest.
+The text is cut into segments at every anchor boundary, each owned by the
+innermost element enclosing it, so resolving a character offset to the id to
+link to is one binary search. HTML answers get a #anchor deep link the same way
+PDF answers get a page number, without re-parsing at query time.
+"""
+
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Optional, Tuple
+
+from position_index import Span
+
+
+class AnchorIndex:
+    """Character offset -> enclosing element id lookup for one HTML document."""
+
+    def __init__(self, boundaries: List[int], owners: List[Optional[str]], starts: List[int],
+                 ids: List[str], passage_starts: Dict[int, int]):
+        # Segment i covers [boundaries[i], boundaries[i + 1]) and lies in owners[i]
+        self.boundaries = boundaries
+        self.owners = owners
+        # Top-level anchors (sections and empty <a name> markers) by start offset
+        self.starts = starts
+        self.ids = ids
+        # Passage number -> offset of the passage in the document text
+        self.passage_starts = passage_starts
+
+    @classmethod
+    def build(cls, anchors: Dict[str, Tuple[int, int]], passages: Dict[int, str]) -> "AnchorIndex":
+        """
+        Index the anchors of a document.
+
+        Args:
+            anchors: Element id -> (start, end) offsets into the document text;
+                element intervals are nested, as in the HTML tree
+            passages: Numbered passages the text was split into (contiguous)
+        """
+        # Outer elements first; ids with identical extents are in closing
+        # order (innermost first) in anchors, so the innermost is pushed last
+        order = {element_id: n for n, element_id in enumerate(anchors)}
+        intervals = sorted(((start, end, element_id) for element_id, (start, end) in anchors.items()
+                            if end > start),
+                           key=lambda t: (t[0], -t[1], -order[t[2]]))
+        boundaries: List[int] = [0]
+        owners: List[Optional[str]] = [None]
+        stack: List[Tuple[int, str]] = []
+        markers: List[Tuple[int, str]] = []
+
+        def close_until(offset: float) -> None:
+            while stack and stack[-1][0] <= offset:
+                end, _ = stack.pop()
+                boundaries.append(end)
+                owners.append(stack[-1][1] if stack else None)
+
+        for start, end, element_id in intervals:
+            close_until(start)
+            if not stack:
+                markers.append((start, element_id))
+            stack.append((end, element_id))
+            boundaries.append(start)
+            owners.append(element_id)
+        close_until(float('inf'))
+
+        # Empty elements (<a name> markers) outside every other element
+        for element_id, (start, end) in anchors.items():
+            if end <= start and owners[bisect_left(boundaries, start) - 1] is None:
+                markers.append((start, element_id))
+        markers.sort(key=lambda marker: marker[0])
+
+        passage_starts = {}
+        offset = 0
+        for number, text in passages.items():
+            passage_starts[number] = offset
+            offset += len(text)
+        return cls(boundaries, owners, [start for start, _ in markers],
+                   [element_id for _, element_id in markers], passage_starts)
+
+    def to_state(self) -> Dict[str, Any]:
+        """Plain-data form of the index, suitable for the parse cache."""
+        return {'boundaries': self.boundaries, 'owners': self.owners, 'starts': self.starts,
+                'ids': self.ids, 'passage_starts': self.passage_starts}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "AnchorIndex":
+        return cls(state['boundaries'], state['owners'], state['starts'], state['ids'],
+                   state['passage_starts'])
+
+    def element_at(self, offset: int) -> Optional[str]:
+        """
+        Id to link to for a character offset of the document text.
+
+        Returns:
+            The innermost element id enclosing the offset; outside every
+            element, the nearest top-level anchor (section or <a name> marker)
+            starting before it; None if there is none
+        """
+        segment = bisect_right(self.boundaries, offset) - 1
+        if segment >= 0 and self.owners[segment] is not None:
+            return self.owners[segment]
+        marker = bisect_right(self.starts, offset) - 1
+        return self.ids[marker] if marker >= 0 else None
+
+    def element_for(self, span: Span) -> Optional[str]:
+        """Id to link to for a passage span located by the positional index."""
+        passage_start = self.passage_starts.get(span.page)
+        if passage_start is None:
+            return None
+        return self.element_at(passage_start + span.start)
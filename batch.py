@@ -0,0 +1,415 @@
+"""
+SmartAlly - Batch Extraction
+Headless extraction of every datapoint in the datapoint mapping, for every
+share class, over a directory or manifest of PDF/HTML filings. Documents are
+parsed and extracted in a process pool; every finished document is appended to
+a JSONL checkpoint, so a restarted run skips the documents already done.
+Results are written as CSV, Parquet or XLSX together with a per-document status.
+
+This module (and everything it imports) must not import Streamlit.
+"""
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+import extraction
+import rule_patterns
+from llm_scheduler import LLM_RPM, LLM_TPM, LLMScheduler
+from pdf_ingest import mp_context
+
+# Worker processes for a batch run (0 = one per CPU)
+BATCH_WORKERS = int(os.getenv("SMARTALLY_BATCH_WORKERS", "0"))
+
+SUPPORTED_SUFFIXES = ('.pdf', '.html', '.htm')
+OUTPUT_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.xlsx': 'xlsx'}
+
+RESULT_COLUMNS = ['document', 'path', 'datapoint', 'class', 'value', 'location', 'page', 'method']
+STATUS_COLUMNS = ['document', 'path', 'sha256', 'status', 'error', 'classes', 'values_found', 'seconds']
+
+DEFAULT_MAPPING = Path(__file__).resolve().parent / 'datapoint_mapping.csv'
+
+
+# ============================================================================
+# Inputs
+# ============================================================================
+
+def discover_inputs(source: str) -> List[Path]:
+    """
+    List the documents of a batch run.
+
+    Args:
+        source: Directory (searched recursively for PDF/HTML files) or manifest
+            file with one document path per line; blank lines and lines starting
+            with "#" are ignored, relative paths are resolved against the
+            manifest's directory
+
+    Returns:
+        Document paths in a stable order (sorted for directories, manifest order
+        otherwise), without duplicates
+    """
+    root = Path(source)
+    if root.is_dir():
+        paths = sorted(p for p in root.rglob('*') if p.is_file() and p.suffix.lower() in SUPPORTED_SUFFIXES)
+    else:
+        paths = []
+        for line in root.read_text(encoding='utf-8').splitlines():
+            line = line.strip()
+            if line and not line.startswith('#'):
+                path = Path(line)
+                paths.append(path if path.is_absolute() else root.parent / path)
+    return list(dict.fromkeys(p.resolve() for p in paths))
+
+
+def _fingerprint(path: Path) -> List[int]:
+    """Size and modification time, so a changed file is extracted again on resume."""
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def discover_share_classes(doc_data: Dict[str, Any]) -> List[str]:
+    """
+    Share classes offered by a document: class columns of its tables plus
+    "Class X" mentions in its text.
+
+    Documents parsed with a share class index (see class_index) are answered
+    from it without scanning the text again.
+
+    Returns:
+        Sorted class names ("Class A", "Class C", ...)
+    """
+    if doc_data.get('class_index') is not None:
+        return extraction.document_classes(doc_data)
+    codes = set()
+    table_index = doc_data.get('table_index')
+    if table_index is not None:
+        for entry in table_index.entries:
+            codes.update(entry['classes'])
+    all_text, _, _ = extraction.document_inputs(doc_data)
+    for match in rule_patterns.CLASS_MENTION.finditer(all_text):
+        codes.add(match.group(0)[-1].upper())
+    return [f"Class {code}" for code in sorted(codes)]
+
+
+# ============================================================================
+# Per-Document Worker
+# ============================================================================
+
+Answer = Tuple[Optional[str], Optional[str], Optional[int]]
+
+
+def _extract_grid(doc_data: Dict[str, Any], mapping_df: pd.DataFrame) -> Optional[Dict[str, Any]]:
+    """The document's datapoint x class grid from one LLM call (None if it failed)."""
+    all_text, tables, page_texts = extraction.document_inputs(doc_data)
+    return extraction.extract_all_datapoints_with_llm(
+        all_text, tables, mapping_df, page_texts, doc_hash=extraction.document_llm_key(doc_data),
+        page_index=doc_data.get('page_index'), table_index=doc_data.get('table_index'),
+        position_index=doc_data.get('position_index'),
+        share_classes=extraction.document_classes(doc_data),
+        unit_label=extraction.document_unit_label(doc_data))
+
+
+def _extract_cell_with_llm(doc_data: Dict[str, Any], grid: Optional[Dict[str, Any]], datapoint_name: str,
+                           class_name: str, output_rule: str) -> Answer:
+    """Answer one cell from the grid, or with a single extraction call if the grid left it open."""
+    answer = extraction.lookup_extraction_grid(grid, datapoint_name, class_name)
+    if answer is not None:
+        return answer
+    if not extraction.document_offers_class_in_any_table(doc_data, class_name):
+        # A requested class the document does not offer: no call needed
+        return "0", None, None
+    all_text, tables, page_texts = extraction.document_inputs(doc_data)
+    return extraction.extract_datapoint_with_llm(
+        all_text, tables, datapoint_name, class_name, output_rule, page_texts,
+        doc_hash=extraction.document_llm_key(doc_data), page_index=doc_data.get('page_index'),
+        table_index=doc_data.get('table_index'), position_index=doc_data.get('position_index'),
+        unit_label=extraction.document_unit_label(doc_data))
+
+
+def extract_document_answers(doc_data: Dict[str, Any], mapping_df: pd.DataFrame,
+                             classes: Optional[List[str]] = None, use_llm: bool = False,
+                             on_classes: Optional[Callable[[List[str]], None]] = None,
+                             on_answer: Optional[Callable[[str, str, Answer], None]] = None
+                             ) -> Tuple[List[str], Dict[Tuple[str, str], Answer]]:
+    """
+    Extract every datapoint of the mapping for every share class of a parsed document.
+
+    In LLM mode the whole datapoint x class grid is requested in one call and
+    only the cells it leaves open get a single extraction call. A fee datapoint
+    found in none of the tables loaded up front loads the remaining tables and
+    requests the grid again, once.
+
+    Args:
+        doc_data: Parsed document (see extraction.ingest_document)
+        mapping_df: Datapoint mapping (datapoints and output rules)
+        classes: Share classes to extract (default: the classes found in the document)
+        use_llm: Extract with the LLM instead of rules
+        on_classes: Called with the share classes once they are known
+        on_answer: Called with (datapoint, class, answer) as each answer is ready
+
+    Returns:
+        Tuple of (share classes, (datapoint, class) -> (value, location, page number))
+    """
+    grid = _extract_grid(doc_data, mapping_df) if use_llm else None
+
+    doc_classes = classes
+    if not doc_classes:
+        doc_classes = sorted(set(discover_share_classes(doc_data)) | set((grid or {}).get('classes') or []))
+    if on_classes is not None:
+        on_classes(doc_classes)
+
+    answers = {}
+    for _, mapping in mapping_df.drop_duplicates('Datapoint').iterrows():
+        datapoint_name, output_rule = mapping['Datapoint'], mapping['OutputRule']
+        for class_name in doc_classes:
+            if use_llm:
+                answer = _extract_cell_with_llm(doc_data, grid, datapoint_name, class_name, output_rule)
+                if (extraction.is_missing_answer(answer) and datapoint_name in extraction.LAZY_TABLE_DATAPOINTS
+                        and extraction.ensure_all_tables(doc_data)):
+                    # Not in the tables loaded up front: ask again with the tables of every page
+                    grid = _extract_grid(doc_data, mapping_df)
+                    answer = _extract_cell_with_llm(doc_data, grid, datapoint_name, class_name, output_rule)
+            else:
+                answer = extraction.extract_document_datapoint(doc_data, datapoint_name,
+                                                               class_name, output_rule)
+            answers[(datapoint_name, class_name)] = answer
+            if on_answer is not None:
+                on_answer(datapoint_name, class_name, answer)
+    return doc_classes, answers
+
+
+def _init_worker(worker_count: int) -> None:
+    """
+    Pool initializer: each worker process gets its share of the LLM rate
+    limits, so the workers together stay under the account limits.
+    """
+    extraction.llm_scheduler = LLMScheduler(rpm=LLM_RPM / worker_count, tpm=LLM_TPM / worker_count)
+
+
+def worker_pool(worker_count: int) -> ProcessPoolExecutor:
+    """Process pool for batch documents, splitting the LLM rate limits between the workers."""
+    return ProcessPoolExecutor(max_workers=worker_count, mp_context=mp_context(),
+                               initializer=_init_worker, initargs=(worker_count,))
+
+
+def _new_record(path: Path, status: str = 'ok', error: Optional[str] = None) -> Dict[str, Any]:
+    return {'document': path.name, 'path': str(path), 'sha256': None, 'status': status, 'error': error,
+            'classes': None, 'values_found': 0, 'seconds': None, 'rows': []}
+
+
+def process_document(path: str, mapping_path: str, classes: Optional[List[str]] = None,
+                     use_llm: bool = False) -> Dict[str, Any]:
+    """
+    Parse one document and extract every datapoint for every share class.
+
+    Runs in a worker process. Errors never propagate: they are recorded in the
+    returned status.
+
+    Args:
+        path: Document path
+        mapping_path: Datapoint mapping CSV
+        classes: Share classes to extract (default: the classes found in the document)
+        use_llm: Extract with the LLM (one grid call per document) instead of rules
+
+    Returns:
+        Checkpoint record with the document 'status' and its result 'rows'
+    """
+    started = time.perf_counter()
+    doc_path = Path(path)
+    record = _new_record(doc_path)
+
+    # Messages the engine would show in the app become part of the status
+    errors: List[str] = []
+    previous_reporter = extraction.set_error_reporter(errors.append)
+    try:
+        record['fingerprint'] = _fingerprint(doc_path)
+        mapping_df = pd.read_csv(mapping_path)
+        # Documents already run in parallel: parse each one (and load its
+        # pending tables) in its own process only. Each document is read
+        # once, so it is not kept in the shared document store
+        with extraction.parsing_with_workers(1):
+            doc_data = extraction.ingest_document(doc_path.name, doc_path.read_bytes(), shared=False)
+            if doc_data is None:
+                raise ValueError(f"unsupported file type: {doc_path.suffix}")
+            record['sha256'] = doc_data['sha256']
+
+            doc_classes, answers = extract_document_answers(doc_data, mapping_df, classes, use_llm)
+        record['classes'] = ', '.join(doc_classes)
+
+        for (datapoint_name, class_name), (value, location, page_num) in answers.items():
+            found = bool(value) and value != "0"
+            record['values_found'] += int(found)
+            record['rows'].append({
+                'document': doc_path.name, 'path': str(doc_path), 'datapoint': datapoint_name,
+                'class': class_name, 'value': value if found else None,
+                'location': location if found else None, 'page': page_num if found else None,
+                'method': 'llm' if use_llm else 'rules',
+            })
+
+        if errors:
+            record['status'] = 'partial' if record['values_found'] else 'error'
+            record['error'] = '; '.join(errors)
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = '; '.join(errors + [f"{type(e).__name__}: {e}"])
+        record['rows'] = []
+    finally:
+        extraction.set_error_reporter(previous_reporter)
+    record['seconds'] = round(time.perf_counter() - started, 3)
+    return record
+
+
+# ============================================================================
+# Checkpoint
+# ============================================================================
+
+def load_checkpoint(checkpoint: Path) -> Dict[str, Dict[str, Any]]:
+    """
+    Read the records of earlier runs.
+
+    Returns:
+        Document path -> latest record; a torn last line (interrupted write) is ignored
+    """
+    records = {}
+    if checkpoint.exists():
+        with open(checkpoint, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[record['path']] = record
+    return records
+
+
+def _is_done(record: Optional[Dict[str, Any]], path: Path) -> bool:
+    """Only successful extractions of the unchanged file are skipped on resume."""
+    if record is None or record['status'] != 'ok':
+        return False
+    try:
+        return record.get('fingerprint') == _fingerprint(path)
+    except OSError:
+        return False
+
+
+# ============================================================================
+# Output
+# ============================================================================
+
+def write_results(results_df: pd.DataFrame, status_df: pd.DataFrame, output: Path) -> List[Path]:
+    """
+    Write extracted values and document statuses.
+
+    XLSX gets a "results" and a "status" sheet; CSV and Parquet write the status
+    next to the results as <name>_status.<ext>.
+
+    Returns:
+        Paths written
+    """
+    fmt = OUTPUT_FORMATS[output.suffix.lower()]
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == 'xlsx':
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            results_df.to_excel(writer, sheet_name='results', index=False)
+            status_df.to_excel(writer, sheet_name='status', index=False)
+        return [output]
+
+    status_path = output.with_name(f"{output.stem}_status{output.suffix}")
+    if fmt == 'parquet':
+        results_df.to_parquet(output, index=False)
+        status_df.to_parquet(status_path, index=False)
+    else:
+        results_df.to_csv(output, index=False)
+        status_df.to_csv(status_path, index=False)
+    return [output, status_path]
+
+
+# ============================================================================
+# Batch Run
+# ============================================================================
+
+def run_batch(inputs: Iterable[Path], output: Path, mapping_path: Path = DEFAULT_MAPPING,
+              classes: Optional[List[str]] = None, use_llm: Optional[bool] = None,
+              workers: Optional[int] = None, checkpoint: Optional[Path] = None, resume: bool = True,
+              on_progress: Optional[Callable[[int, int, Dict[str, Any]], None]] = None) -> pd.DataFrame:
+    """
+    Extract every datapoint for every share class from a set of documents.
+
+    Args:
+        inputs: Document paths
+        output: Results file (.csv, .parquet or .xlsx)
+        mapping_path: Datapoint mapping CSV
+        classes: Share classes to extract (default: the classes found per document)
+        use_llm: Use the LLM (default: when OPENAI_API_KEY is configured)
+        workers: Worker processes (default: SMARTALLY_BATCH_WORKERS, else one per CPU);
+            1 runs in this process
+        checkpoint: JSONL checkpoint (default: <output>.checkpoint.jsonl)
+        resume: Skip documents the checkpoint records as done; False starts over
+        on_progress: Called with (documents finished, documents total, record)
+            after each document of this run
+
+    Returns:
+        Status DataFrame, one row per document, in input order
+    """
+    output = Path(output)
+    if output.suffix.lower() not in OUTPUT_FORMATS:
+        raise ValueError(f"unsupported output format {output.suffix!r} (use .csv, .parquet or .xlsx)")
+    checkpoint = Path(checkpoint) if checkpoint else output.with_name(output.name + '.checkpoint.jsonl')
+    if use_llm is None:
+        use_llm = extraction.client is not None
+    workers = workers or BATCH_WORKERS or os.cpu_count() or 1
+
+    paths = [Path(p).resolve() for p in inputs]
+    if not resume and checkpoint.exists():
+        checkpoint.unlink()
+    records = load_checkpoint(checkpoint)
+    pending = [p for p in paths if not _is_done(records.get(str(p)), p)]
+
+    checkpoint.parent.mkdir(parents=True, exist_ok=True)
+    done = len(paths) - len(pending)
+    with open(checkpoint, 'a', encoding='utf-8') as log:
+        def finish(record: Dict[str, Any]) -> None:
+            nonlocal done
+            done += 1
+            records[record['path']] = record
+            log.write(json.dumps(record) + '\n')
+            log.flush()
+            os.fsync(log.fileno())
+            if on_progress:
+                on_progress(done, len(paths), record)
+
+        args = (str(mapping_path), classes, use_llm)
+        if workers <= 1 or len(pending) <= 1:
+            for path in pending:
+                finish(process_document(str(path), *args))
+        else:
+            with worker_pool(min(workers, len(pending))) as pool:
+                futures = {pool.submit(process_document, str(path), *args): path for path in pending}
+                for future in as_completed(futures):
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        # The worker died (e.g. the parser crashed the process)
+                        record = _new_record(futures[future], 'error', f"{type(e).__name__}: {e}")
+                    finish(record)
+
+    ordered = [records[str(p)] for p in paths]
+    results_df = pd.DataFrame([row for record in ordered for row in record['rows']], columns=RESULT_COLUMNS)
+    results_df['page'] = results_df['page'].astype('Int64')
+    status_df = pd.DataFrame([{column: record.get(column) for column in STATUS_COLUMNS} for record in ordered],
+                             columns=STATUS_COLUMNS)
+    write_results(results_df, status_df, output)
+    return status_df
+
+
+def print_progress(done: int, total: int, record: Dict[str, Any]) -> None:
+    """Progress line on stderr for each finished document."""
+    detail = record['error'] if record['status'] == 'error' else f"{record['values_found']} values"
+    print(f"[{done}/{total}] {record['document']}: {record['status']} ({detail}, {record['seconds']}s)",
+          file=sys.stderr, flush=True)
@@ -0,0 +1,307 @@
+"""
+SmartAlly - Parse and Extraction Benchmark
+Measures how parsing and rule-based extraction scale on synthetic prospectuses
+(see synthetic_prospectus.py): pages/sec and peak Python heap per parse stage,
+latency percentiles and accuracy of the extractors. Results are written as JSON
+so runs on different commits can be compared:
+
+    python benchmark.py --pages 20,200 --classes 4 -o bench_new.json
+    python benchmark.py --pages 20,200 --classes 4 -o bench_new.json --compare bench_old.json
+
+Runs without Streamlit. Set SMARTALLY_PARSE_WORKERS=1 to measure serial parsing.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+import extraction
+from parse_cache import ParseCache
+from shared_store import DocumentStore
+from pdf_ingest import ingest_pdf, read_document_metadata, resolve_worker_count
+from synthetic_prospectus import generate_prospectus
+
+# Median slowdown (new / baseline) above which --compare reports a regression
+REGRESSION_THRESHOLD = 1.2
+
+DEFAULT_MAPPING = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datapoint_mapping.csv')
+
+
+# ============================================================================
+# Measurement
+# ============================================================================
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def measure(fn: Callable[[], Any], repeat: int, pages: int) -> Dict[str, Any]:
+    """
+    Time a stage and measure its peak Python heap.
+
+    The stage runs `repeat` times untraced for timing, then once more under
+    tracemalloc (which slows allocation down) for the memory peak. Memory held
+    by native libraries (MuPDF) and by parser worker processes is not included.
+
+    Returns:
+        Dictionary with the run 'seconds', their 'median_s', 'pages_per_sec'
+        and 'peak_kib'
+    """
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(seconds)
+    return {
+        'seconds': [round(s, 6) for s in seconds],
+        'median_s': round(median, 6),
+        'pages_per_sec': round(pages / median, 2) if median > 0 else None,
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+@contextlib.contextmanager
+def isolated_parse_cache(max_bytes: Optional[int] = None) -> Iterator[ParseCache]:
+    """
+    Point the extraction engine at an empty, temporary parse cache.
+
+    With max_bytes=0 every entry is evicted as soon as it is written, so each
+    ingest parses from scratch and still pays for the cache write. The shared
+    in-memory document store is disabled meanwhile, so ingests are measured
+    against the parse cache.
+    """
+    saved = extraction.parse_cache, extraction.document_store
+    with tempfile.TemporaryDirectory(prefix='smartally-bench-') as directory:
+        extraction.parse_cache = ParseCache(directory) if max_bytes is None else ParseCache(directory, max_bytes)
+        extraction.document_store = DocumentStore(max_bytes=0)
+        try:
+            yield extraction.parse_cache
+        finally:
+            extraction.parse_cache, extraction.document_store = saved
+
+
+def _normalize(value: str) -> str:
+    return ''.join(value.lower().replace('$', '').replace(',', '').split())
+
+
+def is_correct(value: Optional[str], truth: Optional[str]) -> bool:
+    """A planted value must be found (formatting aside); a missing one must not be."""
+    found = bool(value) and value != "0"
+    if truth is None:
+        return not found
+    return found and _normalize(truth) in _normalize(value)
+
+
+def benchmark_extraction(doc_data: Dict[str, Any], truth: Dict[tuple, Optional[str]],
+                         output_rules: Dict[str, str], repeat: int) -> Dict[str, Any]:
+    """Latency percentiles and accuracy of rule-based extraction over every (datapoint, class)."""
+    latencies = []
+    correct = 0
+    for (datapoint_name, class_name), expected in truth.items():
+        output_rule = output_rules.get(datapoint_name, 'text')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            value, _, _ = extraction.extract_document_datapoint(doc_data, datapoint_name, class_name, output_rule)
+            latencies.append((time.perf_counter() - started) * 1000)
+        correct += is_correct(value, expected)
+
+    return {
+        'queries': len(truth),
+        'accuracy': round(correct / len(truth), 3) if truth else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 3),
+            'p90': round(percentile(latencies, 90), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(max(latencies), 3),
+        },
+    }
+
+
+# ============================================================================
+# Benchmark Run
+# ============================================================================
+
+def benchmark_document(doc_type: str, pages: int, classes: int, table_density: float,
+                       repeat: int, output_rules: Dict[str, str], seed: int = 0) -> Dict[str, Any]:
+    """Benchmark every parse stage and the extractors on one synthetic prospectus."""
+    prospectus = generate_prospectus(pages, classes, table_density, doc_type, seed)
+    data = prospectus.data
+    stages = {}
+
+    if doc_type == 'pdf':
+        stages['parse_pdf'] = measure(lambda: extraction.parse_pdf(io.BytesIO(data)), repeat, pages)
+        stages['parse_pdf_tables'] = measure(lambda: extraction.parse_pdf_tables(io.BytesIO(data)), repeat, pages)
+        stages['ingest_pdf'] = measure(lambda: ingest_pdf(data), repeat, pages)
+        parsed = ingest_pdf(data)
+    else:
+        stages['parse_html'] = measure(lambda: extraction.parse_html(data), repeat, pages)
+        text, anchors = extraction.parse_html(data)
+        parsed = {'type': 'html', 'text': text, 'anchors': anchors}
+    stages['build_indexes'] = measure(lambda: extraction.build_document_indexes(dict(parsed)), repeat, pages)
+
+    file_name = f'synthetic.{doc_type}'
+    # Cold: parse and index from scratch; warm: parse cache hit
+    with isolated_parse_cache(max_bytes=0):
+        stages['ingest_document_cold'] = measure(lambda: extraction.ingest_document(file_name, data),
+                                                 repeat, pages)
+    with isolated_parse_cache():
+        doc_data = extraction.ingest_document(file_name, data)
+        stages['ingest_document_warm'] = measure(lambda: extraction.ingest_document(file_name, data),
+                                                 repeat, pages)
+
+    return {
+        'doc_type': doc_type,
+        'pages': prospectus.page_count,
+        'classes': classes,
+        'table_density': table_density,
+        'bytes': len(data),
+        'parse_workers': resolve_worker_count(read_document_metadata(data)[0]) if doc_type == 'pdf' else 1,
+        'stages': stages,
+        'extraction': benchmark_extraction(doc_data, prospectus.truth, output_rules, repeat),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(pages: List[int], classes: int = 4, table_density: float = 0.25,
+                  doc_types: List[str] = ('pdf', 'html'), repeat: int = 3,
+                  mapping_path: str = DEFAULT_MAPPING, seed: int = 0) -> Dict[str, Any]:
+    """
+    Benchmark parsing and extraction for every document type and page count.
+
+    Returns:
+        JSON-serializable report with run metadata and one entry per document
+    """
+    mapping_df = pd.read_csv(mapping_path)
+    output_rules = dict(zip(mapping_df['Datapoint'], mapping_df['OutputRule']))
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'runs': [benchmark_document(doc_type, page_count, classes, table_density, repeat, output_rules, seed)
+                 for doc_type in doc_types for page_count in pages],
+    }
+
+
+# ============================================================================
+# Comparison
+# ============================================================================
+
+def compare_reports(new: Dict[str, Any], old: Dict[str, Any],
+                    threshold: float = REGRESSION_THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    Compare the median time of every stage present in both reports.
+
+    Returns:
+        One row per stage with 'ratio' (new / old median) and 'regression'
+        (ratio above threshold); extraction latency is compared on its p50
+    """
+    def medians(report):
+        result = {}
+        for run in report['runs']:
+            key = (run['doc_type'], run['pages'], run['classes'])
+            for stage, stats in run['stages'].items():
+                result[key + (stage,)] = stats['median_s']
+            result[key + ('extraction_p50',)] = run['extraction']['latency_ms']['p50'] / 1000
+        return result
+
+    new_medians, old_medians = medians(new), medians(old)
+    rows = []
+    for key, new_median in new_medians.items():
+        old_median = old_medians.get(key)
+        if not old_median:
+            continue
+        ratio = new_median / old_median
+        rows.append({'doc_type': key[0], 'pages': key[1], 'classes': key[2], 'stage': key[3],
+                     'old_s': old_median, 'new_s': new_median, 'ratio': round(ratio, 3),
+                     'regression': ratio > threshold})
+    return rows
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Human-readable summary of a benchmark report."""
+    lines = []
+    for run in report['runs']:
+        ext = run['extraction']
+        lines.append(f"{run['doc_type']} {run['pages']} pages, {run['classes']} classes "
+                     f"({run['bytes'] / 1024:.0f} KiB, {run['parse_workers']} parse workers)")
+        for stage, stats in run['stages'].items():
+            lines.append(f"  {stage:<22} {stats['median_s'] * 1000:>10.2f} ms  "
+                         f"{stats['pages_per_sec'] or 0:>10.1f} pages/s  {stats['peak_kib']:>10.1f} KiB peak")
+        lat = ext['latency_ms']
+        lines.append(f"  {'extraction':<22} p50 {lat['p50']:.3f} ms  p90 {lat['p90']:.3f} ms  "
+                     f"p99 {lat['p99']:.3f} ms  accuracy {ext['accuracy']:.0%} of {ext['queries']}")
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark SmartAlly parsing and extraction')
+    parser.add_argument('--pages', default='20,100', help='comma-separated page counts')
+    parser.add_argument('--classes', type=int, default=4, help='share classes per prospectus')
+    parser.add_argument('--table-density', type=float, default=0.25, help='fraction of pages with a table')
+    parser.add_argument('--formats', default='pdf,html', help='comma-separated document types')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='benchmark.json', help='JSON report path')
+    parser.add_argument('--compare', help='baseline JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='slowdown ratio reported as a regression')
+    args = parser.parse_args(argv)
+
+    report = run_benchmark([int(p) for p in args.pages.split(',')], args.classes, args.table_density,
+                           args.formats.split(','), args.repeat, seed=args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(format_report(report))
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            rows = compare_reports(report, json.load(f), args.threshold)
+        regressions = [row for row in rows if row['regression']]
+        for row in rows:
+            flag = '  REGRESSION' if row['regression'] else ''
+            print(f"{row['doc_type']} {row['pages']}p {row['stage']:<22} x{row['ratio']:.2f}{flag}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+SmartAlly - Document Blob Store
+Process-wide, content-addressed store of uploaded document bytes. Each document
+is held once, however many sessions, answers or links refer to it, so chat
+answers carry a short link keyed by the content hash instead of the document.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from parse_cache import content_hash
+
+BLOB_STORE_MAX_MB = int(os.getenv("SMARTALLY_BLOB_STORE_MAX_MB", "1024"))
+
+MIME_TYPES = {
+    'pdf': 'application/pdf',
+    'html': 'text/html',
+}
+
+
+class Blob(NamedTuple):
+    data: bytes
+    name: str
+    mime: str
+
+
+class BlobStore:
+    """Size-bounded, LRU-evicted map of content hash -> document bytes."""
+
+    def __init__(self, max_bytes: int = BLOB_STORE_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._blobs: "OrderedDict[str, Blob]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, data: bytes, name: str, mime: str, key: Optional[str] = None) -> str:
+        """
+        Store a document unless identical bytes are already stored.
+
+        Args:
+            data: Document bytes (kept by reference, not copied)
+            name: File name offered when the document is opened
+            mime: MIME type the document is served with
+            key: Content hash of data, if already computed
+
+        Returns:
+            The content hash identifying the blob
+        """
+        key = key or content_hash(data)
+        with self._lock:
+            if key in self._blobs:
+                self._blobs.move_to_end(key)
+                return key
+            self._blobs[key] = Blob(data, name, mime)
+            self._size += len(data)
+            # Evict least recently used blobs, always keeping the newest one
+            while self._size > self.max_bytes and len(self._blobs) > 1:
+                _, evicted = self._blobs.popitem(last=False)
+                self._size -= len(evicted.data)
+        return key
+
+    def get(self, key: str) -> Optional[Blob]:
+        """Return a stored blob, or None if it was never stored or has been evicted."""
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is not None:
+                self._blobs.move_to_end(key)
+            return blob
+
+    def __len__(self) -> int:
+        return len(self._blobs)
+
+    @property
+    def size(self) -> int:
+        """Total bytes held."""
+        return self._size
+
+
+# Process-wide store shared by every session (Streamlit re-executes the app
+# script on each interaction, so the instance must live in this module)
+_shared_store: Optional[BlobStore] = None
+_shared_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """Return the process-wide blob store, creating it on first use."""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = BlobStore()
+        return _shared_store
@@ -0,0 +1,107 @@
+"""
+SmartAlly - Share Class Index
+Per-document index of the share classes a filing offers and where they appear,
+built once at parse time from three kinds of evidence:
+
+- class columns (or row labels) of the document's tables, with ticker /
+  symbol tables told apart; a bare letter only counts in a row headed by
+  "Class" / "Share Class", never as a footnote marker or Y/N flag
+- "Class X Shares" headings
+- "Class X" mentions in the text
+
+A question about a class the document does not offer is answered "not found"
+without running any extraction, and batch extraction covers only the classes
+that exist. A document without any class evidence (e.g. a single-class fund)
+is treated as offering every class.
+"""
+
+import re
+from typing import Any, Dict, List, Mapping, Optional
+
+from table_index import TableIndex, class_key
+
+# "Class A Shares", "Class R6 Shares" (class letter in capitals)
+HEADING = re.compile(r'\b[Cc]lass\s+([A-Z]\d{0,2})\s+[Ss]hares\b')
+# "Class A", "class c", "Class R6"
+MENTION = re.compile(r'\bclass\s+([a-z]\d{0,2})\b', re.IGNORECASE)
+
+# Table words marking a ticker / symbol table
+_TICKER_TERMS = frozenset(('ticker', 'symbol', 'symbols', 'tickers'))
+
+# Evidence kinds, strongest first
+SOURCES = ('table', 'ticker', 'heading', 'mention')
+
+
+class ShareClassIndex:
+    """Share class code -> pages it appears on, per kind of evidence."""
+
+    def __init__(self, classes: Dict[str, Dict[str, List[int]]]):
+        # {"A": {"table": [7], "mention": [1, 3, 7]}, ...}; page 0 = unknown page
+        self.classes = classes
+
+    @classmethod
+    def build(cls, pages: Mapping[int, str], table_index: Optional[TableIndex] = None) -> "ShareClassIndex":
+        """
+        Discover the share classes of a document.
+
+        Args:
+            pages: Retrieval units of the document (pages for PDFs, passages for HTML)
+            table_index: Index of the document's tables, if any
+        """
+        found: Dict[str, Dict[str, set]] = {}
+
+        def record(code: Optional[str], source: str, page: Optional[int]) -> None:
+            if code:
+                found.setdefault(code, {}).setdefault(source, set()).add(page or 0)
+
+        if table_index is not None:
+            for entry in table_index.entries:
+                source = 'ticker' if _TICKER_TERMS.intersection(entry.get('terms', ())) else 'table'
+                for code in entry['classes']:
+                    record(code, source, entry['page'])
+
+        for page_num, page_text in pages.items():
+            for match in HEADING.finditer(page_text):
+                record(match.group(1).upper(), 'heading', page_num)
+            for match in MENTION.finditer(page_text):
+                record(match.group(1).upper(), 'mention', page_num)
+
+        return cls({code: {source: sorted(found[code][source]) for source in SOURCES if source in found[code]}
+                    for code in sorted(found)})
+
+    def to_state(self) -> Dict[str, Dict[str, List[int]]]:
+        """Plain-data form of the index, suitable for the parse cache."""
+        return self.classes
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Dict[str, List[int]]]) -> "ShareClassIndex":
+        return cls(state)
+
+    @property
+    def class_names(self) -> List[str]:
+        """Classes offered, as "Class X" names in code order."""
+        return [f"Class {code}" for code in self.classes]
+
+    def offers(self, class_name: str) -> bool:
+        """
+        Whether the document may offer a class.
+
+        False only when the document names share classes and this is not one of
+        them; unrecognized class names and documents without class evidence
+        give True, so they are never short-circuited.
+        """
+        code = class_key(class_name)
+        if code is None or not self.classes:
+            return True
+        return code in self.classes
+
+    def pages(self, class_name: str) -> List[int]:
+        """Pages (or passages) where a class appears, in order."""
+        code = class_key(class_name)
+        evidence = self.classes.get(code, {}) if code else {}
+        return sorted({page for pages in evidence.values() for page in pages if page})
+
+    def describe(self) -> Dict[str, Any]:
+        """Class name -> evidence kinds and pages, for display."""
+        return {f"Class {code}": {source: pages for source, pages in evidence.items()}
+                for code, evidence in self.classes.items()}
@@ -0,0 +1,134 @@
+"""
+SmartAlly - Compact Document Layout
+Memory-lean representation of a parsed document, so one server process can
+hold many more documents across concurrent sessions:
+
+- page (or passage) texts live in one contiguous string with a flat array of
+  page offsets; the full text used by every query is that string, built once
+- table rows are tuples of interned cells, so the labels and values repeated
+  across fee tables are stored once
+- raw document bytes above a size threshold are moved to a memory-mapped
+  temporary file, whose pages the OS can drop and re-read instead of keeping
+  them on the heap
+"""
+
+import mmap
+import os
+import sys
+import tempfile
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+# Raw documents at least this large are spilled to a memory-mapped temp file (-1 = never)
+SPILL_MIN_KB = int(os.getenv("SMARTALLY_SPILL_MIN_KB", "1024"))
+
+# Directory of the spill files (default: the system temp directory)
+SPILL_DIR = os.getenv("SMARTALLY_SPILL_DIR") or None
+
+DocumentBytes = Union[bytes, mmap.mmap]
+
+
+class PageText(Mapping):
+    """
+    Read-only page number -> text mapping over one contiguous text buffer.
+
+    Pages are sliced out of the buffer on access; ``text`` is the whole
+    document text (pages joined with the separator the mapping was built with).
+    """
+
+    __slots__ = ('text', '_numbers', '_offsets', '_positions')
+
+    def __init__(self, text: str, numbers: List[int], offsets: List[int]):
+        self.text = text
+        # Page numbers in order, and flat [start, end, start, end, ...] offsets
+        self._numbers = numbers
+        self._offsets = offsets
+        self._positions = {number: i for i, number in enumerate(numbers)}
+
+    @classmethod
+    def from_pages(cls, pages: Dict[int, str], separator: str = '\n') -> "PageText":
+        """Join separately extracted pages (PDF) into one buffer."""
+        offsets = []
+        position = 0
+        for page_text in pages.values():
+            offsets.extend((position, position + len(page_text)))
+            position += len(page_text) + len(separator)
+        return cls(separator.join(pages.values()), list(pages), offsets)
+
+    @classmethod
+    def from_slices(cls, text: str, pages: Dict[int, str]) -> "PageText":
+        """Index consecutive slices of an existing text (HTML passages) without copying them."""
+        offsets = []
+        position = 0
+        for page_text in pages.values():
+            offsets.extend((position, position + len(page_text)))
+            position += len(page_text)
+        return cls(text, list(pages), offsets)
+
+    def __getitem__(self, number: int) -> str:
+        i = self._positions[number]
+        return self.text[self._offsets[2 * i]:self._offsets[2 * i + 1]]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._numbers)
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+    def __repr__(self) -> str:
+        return f"PageText({len(self._numbers)} pages, {len(self.text)} chars)"
+
+    def to_state(self) -> Dict[str, Any]:
+        """Plain-data form, suitable for the parse cache."""
+        return {'text': self.text, 'numbers': self._numbers, 'offsets': self._offsets}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "PageText":
+        return cls(state['text'], state['numbers'], state['offsets'])
+
+
+def compact_tables(tables_by_page: Dict[int, list]) -> Dict[int, list]:
+    """
+    Store every table row as a tuple of interned cells.
+
+    Tuples carry no spare capacity (pdfplumber builds rows by appending), and
+    interning shares the cells repeated across tables ("", "Class A", "0.25%").
+    Empty (None) cells are kept as None.
+    """
+    intern = sys.intern
+    return {
+        page_num: [tuple(tuple(intern(cell) if isinstance(cell, str) else cell for cell in row)
+                         for row in table)
+                   for table in page_tables]
+        for page_num, page_tables in tables_by_page.items()
+    }
+
+
+def spill_bytes(data: DocumentBytes, min_kb: int = SPILL_MIN_KB,
+                directory: Optional[str] = SPILL_DIR) -> DocumentBytes:
+    """
+    Move large document bytes to a read-only memory-mapped temporary file.
+
+    The file is anonymous (deleted as soon as it is created or closed), so it
+    disappears with the last reference to the mapping.
+
+    Args:
+        data: Raw document bytes
+        min_kb: Size from which documents are spilled (-1 = never)
+        directory: Directory of the temporary file
+
+    Returns:
+        The mapping, or data unchanged when it is small, already spilled or
+        cannot be written
+    """
+    if not isinstance(data, bytes) or min_kb < 0 or len(data) < min_kb * 1024 or not data:
+        return data
+    try:
+        with tempfile.TemporaryFile(prefix='smartally-doc-', dir=directory) as f:
+            f.write(data)
+            f.flush()
+            # The mapping keeps its own handle to the file after it is closed
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return data
+
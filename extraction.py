@@ -0,0 +1,1693 @@
+"""
+SmartAlly - Extraction Engine
+Document ingestion, LLM and rule-based datapoint extraction, independent of the
+Streamlit UI. Used by the chat app (smartally.py) and the headless batch CLI
+(smartally_cli.py); errors go through a pluggable reporter so the app can show
+them with st.error while batch runs log them.
+"""
+
+import pandas as pd
+import re
+import json
+import asyncio
+import contextvars
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, Optional, Any
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# SmartAlly engine modules read their settings from the environment on import
+from pdf_ingest import (parse_pdf_bytes, read_upload, ingest_pdf, load_pending_tables,
+                        LAZY_TABLES, TABLE_TRIGGER_PHRASES)
+from html_ingest import parse_html_bytes
+from parse_cache import ParseCache, content_hash
+from llm_cache import get_shared_cache, make_cache_key
+from llm_streaming import StreamingFieldParser, FieldCallback, consume_stream, consume_stream_async
+import rule_patterns
+from table_index import TableIndex
+from position_index import PositionIndex
+from anchor_index import AnchorIndex
+from class_index import ShareClassIndex
+from document_layout import PageText, compact_tables, spill_bytes
+from prompt_packing import TABLE_TOKEN_BUDGET, count_tokens, pack_tables
+from shared_store import SingleFlight, get_document_store
+from llm_scheduler import LLMScheduler, LLM_CALL_TIMEOUT, openai_client, async_openai_client
+from retrieval import PageIndex, build_context, query_terms_for, split_passages, CONTEXT_TOKEN_BUDGET
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Receives user-facing error messages; the Streamlit app installs st.error
+_error_reporter: Callable[[str], None] = logger.error
+
+
+def set_error_reporter(reporter: Callable[[str], None]) -> Callable[[str], None]:
+    """Route extraction error messages to a different sink (e.g. st.error); returns the previous one."""
+    global _error_reporter
+    previous, _error_reporter = _error_reporter, reporter
+    return previous
+
+
+def report_error(message: str) -> None:
+    """Report a recoverable extraction error through the installed reporter."""
+    (_context_error_reporter.get() or _error_reporter)(message)
+
+
+# Reporter for the current thread / asyncio task only (background work has no
+# Streamlit session to show st.error in)
+_context_error_reporter: contextvars.ContextVar[Optional[Callable[[str], None]]] = \
+    contextvars.ContextVar('smartally_error_reporter', default=None)
+
+
+@contextmanager
+def reporting_errors_to(reporter: Callable[[str], None]) -> Iterator[None]:
+    """Route the error messages of the code run in this context to reporter."""
+    token = _context_error_reporter.set(reporter)
+    try:
+        yield
+    finally:
+        _context_error_reporter.reset(token)
+
+
+# Initialize OpenAI client (only if API key is available)
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
+
+if OPENAI_API_KEY:
+    # Pooled connections; retries are done by the request scheduler
+    client = openai_client(OPENAI_API_KEY)
+else:
+    client = None
+
+# Persistent, content-addressed cache of parsed documents shared by all sessions
+parse_cache = ParseCache()
+
+# Parsed documents in memory, shared by all sessions (in front of the parse cache)
+document_store = get_document_store()
+
+# Bump whenever an extraction prompt changes so cached LLM answers are invalidated
+EXTRACTION_PROMPT_VERSION = "6"
+
+# Concurrency limit for multi-document LLM fan-out (the per-call timeout,
+# SMARTALLY_LLM_TIMEOUT, is the scheduler's request deadline)
+LLM_MAX_CONCURRENCY = int(os.getenv("SMARTALLY_LLM_CONCURRENCY", "8"))
+
+# Rate limits, retries and deadlines of every LLM call, shared by all sessions
+llm_scheduler = LLMScheduler()
+
+# Memoized LLM extraction results (memory LRU + SQLite), shared by all sessions
+llm_cache = get_shared_cache(OPENAI_MODEL, EXTRACTION_PROMPT_VERSION)
+
+# Identical LLM extractions in flight (same cache key) are made once
+llm_flights = SingleFlight()
+
+
+# ============================================================================
+# Document Parsing Functions
+# ============================================================================
+
+def parse_pdf(file) -> Dict[int, str]:
+    """
+    Extract raw text from PDF file, organized by page number.
+    
+    Large documents are parsed in parallel across a process pool
+    (see pdf_ingest.parse_pdf_bytes).
+    
+    Args:
+        file: Uploaded PDF file object
+        
+    Returns:
+        Dictionary mapping page number to text content
+    """
+    pages_text = {}
+    
+    try:
+        # Use PyMuPDF for text extraction
+        pdf_bytes = read_upload(file)
+        
+        pages_text, _ = parse_pdf_bytes(pdf_bytes, include_tables=False)
+        
+    except Exception as e:
+        report_error(f"Error parsing PDF with PyMuPDF: {e}")
+        
+    return pages_text
+
+
+def parse_pdf_tables(file) -> Dict[int, List[List[str]]]:
+    """
+    Extract tables from PDF using pdfplumber.
+    
+    Large documents are parsed in parallel across a process pool
+    (see pdf_ingest.parse_pdf_bytes).
+    
+    Args:
+        file: Uploaded PDF file object
+        
+    Returns:
+        Dictionary mapping page number to list of tables
+    """
+    tables_by_page = {}
+    
+    try:
+        pdf_bytes = read_upload(file)
+        
+        _, tables_by_page = parse_pdf_bytes(pdf_bytes, include_text=False)
+        
+    except Exception as e:
+        report_error(f"Error extracting tables from PDF: {e}")
+        
+    return tables_by_page
+
+
+def parse_html(file) -> Tuple[str, Dict[str, Tuple[int, int]]]:
+    """
+    Extract raw text and anchor points from HTML file.
+    
+    Args:
+        file: Uploaded HTML file object, or its raw bytes
+        
+    Returns:
+        Tuple of (full text, dictionary mapping element IDs to the (start, end)
+        character offsets of their text in the full text)
+    """
+    try:
+        html_content = file if isinstance(file, (bytes, str)) else file.read()
+        return parse_html_bytes(html_content)
+        
+    except Exception as e:
+        report_error(f"Error parsing HTML: {e}")
+        return "", {}
+
+
+def document_pages(doc_data: Dict[str, Any]) -> Dict[int, str]:
+    """Return the retrieval units of a document: pages for PDFs, passages for HTML."""
+    if doc_data['type'] == 'pdf':
+        return doc_data.get('pages', {})
+    return doc_data.get('passages', {})
+
+
+def document_offers_class(doc_data: Dict[str, Any], class_name: str) -> bool:
+    """Whether a document may offer a share class (False only if its class index rules it out)."""
+    class_index = doc_data.get('class_index')
+    return class_index is None or class_index.offers(class_name)
+
+
+def document_offers_class_in_any_table(doc_data: Dict[str, Any], class_name: str) -> bool:
+    """
+    document_offers_class, loading the tables a keyword-gated ingest skipped
+    before ruling a class out (a class may be named only in those tables).
+    """
+    if document_offers_class(doc_data, class_name):
+        return True
+    ensure_all_tables(doc_data)
+    return document_offers_class(doc_data, class_name)
+
+
+def document_classes(doc_data: Dict[str, Any]) -> List[str]:
+    """Share classes a document offers ("Class A", ...), empty if it names none."""
+    class_index = doc_data.get('class_index')
+    return class_index.class_names if class_index is not None else []
+
+
+def document_llm_key(doc_data: Dict[str, Any]) -> Optional[str]:
+    """
+    Document part of the LLM cache keys: the content hash, marked once the
+    tables a keyword-gated ingest skipped are loaded (prompts then hold
+    every table, so earlier answers are not reused).
+    """
+    doc_hash = doc_data.get('sha256')
+    if doc_hash and doc_data.get('tables_loaded'):
+        return f"{doc_hash}+tables"
+    return doc_hash
+
+
+def is_missing_answer(answer: Tuple[Optional[str], Optional[str], Optional[int]]) -> bool:
+    """Whether an extraction found nothing."""
+    return not answer[0] or answer[0] == "0"
+
+
+def document_unit_label(doc_data: Dict[str, Any]) -> str:
+    """What a document's retrieval units are called in prompts: PDF pages, HTML passages."""
+    return 'Passage' if doc_data['type'] == 'html' else 'Page'
+
+
+def compact_document(doc_data: Dict[str, Any]) -> None:
+    """Switch a freshly parsed PDF to the compact layout (see document_layout)."""
+    if doc_data['type'] == 'pdf':
+        doc_data['pages'] = PageText.from_pages(doc_data.get('pages', {}))
+        doc_data['tables'] = compact_tables(doc_data.get('tables', {}))
+
+
+def build_document_indexes(doc_data: Dict[str, Any]) -> None:
+    """Build the parse-time search indexes of a freshly parsed document."""
+    if doc_data['type'] == 'html':
+        # Passages are slices of the document text, not copies of it
+        text = doc_data.get('text', '')
+        doc_data['passages'] = PageText.from_slices(text, split_passages(text))
+    doc_data['page_index'] = PageIndex.build(document_pages(doc_data))
+    doc_data['table_index'] = TableIndex.from_document_tables(doc_data.get('tables', {}))
+    doc_data['position_index'] = PositionIndex.build(document_pages(doc_data))
+    if doc_data['type'] == 'html':
+        doc_data['anchor_index'] = AnchorIndex.build(doc_data.get('anchors', {}), doc_data['passages'])
+    doc_data['class_index'] = ShareClassIndex.build(document_pages(doc_data), doc_data['table_index'])
+
+
+def _cacheable_document(doc_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert index and layout objects to plain data for the parse cache."""
+    payload = dict(doc_data)
+    for key in ('pages', 'passages'):
+        if isinstance(doc_data.get(key), PageText):
+            payload[key] = doc_data[key].to_state()
+    payload['page_index'] = doc_data['page_index'].to_state()
+    payload['table_index'] = doc_data['table_index'].to_state()
+    payload['position_index'] = doc_data['position_index'].to_state()
+    payload['class_index'] = doc_data['class_index'].to_state()
+    if 'anchor_index' in doc_data:
+        payload['anchor_index'] = doc_data['anchor_index'].to_state()
+    return payload
+
+
+def _restore_document_indexes(doc_data: Dict[str, Any]) -> None:
+    """Rebuild index and layout objects from the plain data stored in the parse cache."""
+    for key in ('pages', 'passages'):
+        if key in doc_data:
+            doc_data[key] = PageText.from_state(doc_data[key])
+    doc_data['page_index'] = PageIndex.from_state(doc_data['page_index'])
+    doc_data['table_index'] = TableIndex.from_state(doc_data['table_index'])
+    doc_data['position_index'] = PositionIndex.from_state(doc_data['position_index'])
+    doc_data['class_index'] = ShareClassIndex.from_state(doc_data['class_index'])
+    if 'anchor_index' in doc_data:
+        doc_data['anchor_index'] = AnchorIndex.from_state(doc_data['anchor_index'])
+
+
+# Serializes on-demand table loading (documents can be shared across sessions)
+_pending_tables_lock = threading.Lock()
+
+# PDF parser processes for the current thread / asyncio task only (work that
+# already runs in parallel parses serially instead of nesting process pools)
+_context_parse_workers: contextvars.ContextVar[Optional[int]] = \
+    contextvars.ContextVar('smartally_parse_workers', default=None)
+
+
+@contextmanager
+def parsing_with_workers(workers: int) -> Iterator[None]:
+    """Parse (and load pending tables) with this many processes in this context."""
+    token = _context_parse_workers.set(workers)
+    try:
+        yield
+    finally:
+        _context_parse_workers.reset(token)
+
+
+def _parse_workers(workers: Optional[int] = None) -> Optional[int]:
+    """
+    PDF parser process count for a parse started here.
+    
+    An explicit count wins, then the one set with parsing_with_workers; worker
+    processes parse serially. None means SMARTALLY_PARSE_WORKERS.
+    """
+    if workers is None:
+        workers = _context_parse_workers.get()
+    if workers is None and multiprocessing.parent_process() is not None:
+        workers = 1
+    return workers
+
+
+def ingest_document(file_name: str, file_bytes: bytes,
+                    parse_workers: Optional[int] = None, spill: bool = True,
+                    shared: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Parse an uploaded document from bytes that were read exactly once.
+    
+    The same bytes object is stored in the parsed document and reused by every
+    consumer (parsers, the blob store behind answer links), so no copies are
+    made. Documents already parsed by any session are served from the shared
+    document store (concurrent uploads of the same bytes are parsed once);
+    otherwise parse results, including the search indexes, are looked up in the
+    persistent parse cache by content hash first.
+    
+    Args:
+        file_name: Name of the uploaded file (used to detect the type)
+        file_bytes: Raw document bytes
+        parse_workers: PDF parser processes (default: as set with
+            parsing_with_workers, serial in worker processes, else
+            SMARTALLY_PARSE_WORKERS)
+        spill: Move the bytes of a large PDF to a memory-mapped file (see
+            document_layout.spill_bytes); callers keeping the bytes in memory
+            anyway pass False
+        shared: Serve and keep the document in the shared document store;
+            one-off parses that are never read again (batch) pass False
+        
+    Returns:
+        Parsed document dictionary, or None for unsupported file types
+    """
+    if file_name.lower().endswith('.pdf'):
+        doc_type = 'pdf'
+    elif file_name.lower().endswith(('.html', '.htm')):
+        doc_type = 'html'
+    else:
+        return None
+    
+    doc_hash = content_hash(file_bytes)
+    cache_key = parse_cache.make_key(doc_hash, doc_type)
+    def load() -> Dict[str, Any]:
+        return _load_document(file_name, file_bytes, doc_type, doc_hash, cache_key, parse_workers, spill)
+    
+    if not shared:
+        return load()
+    return document_store.get_or_load(cache_key, load)
+
+
+def _load_document(file_name: str, file_bytes: bytes, doc_type: str, doc_hash: str,
+                   cache_key: str, parse_workers: Optional[int], spill: bool) -> Dict[str, Any]:
+    """Read a document from the parse cache, or parse and index it."""
+    with tracing.span('parse_cache_lookup') as lookup:
+        doc_data = parse_cache.get(cache_key)
+        lookup.set(hit=doc_data is not None)
+    
+    if doc_data is not None:
+        _restore_document_indexes(doc_data)
+    else:
+        with tracing.span('parse', memory=True, doc=file_name, bytes=len(file_bytes)):
+            if doc_type == 'pdf':
+                try:
+                    doc_data = ingest_pdf(file_bytes, workers=_parse_workers(parse_workers),
+                                          table_triggers=TABLE_TRIGGER_PHRASES if LAZY_TABLES else None)
+                except Exception as e:
+                    report_error(f"Error parsing PDF: {e}")
+                    doc_data = {'type': 'pdf', 'pages': {}, 'tables': {}, 'tables_pending': [],
+                                'page_meta': {}, 'metadata': {}, 'page_count': 0}
+            else:
+                text, anchors = parse_html(file_bytes)
+                doc_data = {
+                    'type': 'html',
+                    'text': text,
+                    'anchors': anchors
+                }
+        
+        with tracing.span('build_indexes'):
+            compact_document(doc_data)
+            build_document_indexes(doc_data)
+        
+        # Only successful parses are worth keeping across restarts
+        if doc_data.get('pages') or doc_data.get('text'):
+            parse_cache.put(cache_key, _cacheable_document(doc_data))
+    
+    # Large PDFs keep their raw bytes (read again for lazy tables) in a
+    # memory-mapped spill file; HTML bytes are never read again
+    doc_data['file_bytes'] = spill_bytes(file_bytes) if spill and doc_type == 'pdf' else file_bytes
+    doc_data['sha256'] = doc_hash
+    return doc_data
+
+
+def ensure_all_tables(doc_data: Dict[str, Any], workers: Optional[int] = None) -> bool:
+    """
+    Extract the tables a keyword-gated ingest skipped, once per document.
+    
+    The table index and the parse cache entry are updated, so later lookups
+    and sessions see every table.
+    
+    Args:
+        doc_data: Parsed PDF document
+        workers: Parser processes (default: as set with parsing_with_workers,
+            serial in worker processes, else SMARTALLY_PARSE_WORKERS)
+    
+    Returns:
+        True if tables were loaded, False if there was nothing pending
+    """
+    if not doc_data.get('tables_pending'):
+        return False
+    with _pending_tables_lock:
+        if not doc_data.get('tables_pending'):
+            return False
+        with tracing.span('lazy_tables', pages=len(doc_data['tables_pending'])):
+            try:
+                load_pending_tables(doc_data, workers=_parse_workers(workers))
+            except Exception as e:
+                report_error(f"Error extracting tables from PDF: {e}")
+                doc_data['tables_pending'] = []
+                return False
+            doc_data['tables'] = compact_tables(doc_data['tables'])
+            doc_data['table_index'] = TableIndex.from_document_tables(doc_data['tables'])
+            doc_data['class_index'] = ShareClassIndex.build(doc_data['pages'], doc_data['table_index'])
+            # LLM answers given without these tables are not reused (see document_llm_key)
+            doc_data['tables_loaded'] = True
+            doc_data.pop('extraction_grid', None)
+        parse_cache.put(parse_cache.make_key(doc_data['sha256'], doc_data['type']),
+                        _cacheable_document(doc_data))
+    return True
+
+
+# ============================================================================
+# LLM-Based Data Extraction Functions
+# ============================================================================
+
+DATAPOINT_DESCRIPTIONS = """- TOTAL_ANNUAL_FUND_OPERATING_EXPENSES: The total annual operating expenses percentage
+- NET_EXPENSES: Net expenses after fee waivers/reimbursements
+- MINIMUM_SUBSEQUENT_INVESTMENT_AIP: Minimum subsequent investment for Automatic Investment Plans
+- INITIAL_INVESTMENT: Initial investment amount required
+- CDSC: Contingent Deferred Sales Charge information
+- REDEMPTION_FEE: Redemption fee details"""
+
+OUTPUT_RULE_DESCRIPTIONS = """- percentage: Return as "X.XX%" (e.g., "1.19%")
+- currency: Return as "$X" or "$X,XXX" (e.g., "$50", "$2,500")
+- currency_or_text: Return dollar amount or text like "No minimum"
+- text: Return as descriptive text
+- cdsc_special: Return in format "X year, Y% then Z%\""""
+
+
+def _format_tables_for_prompt(tables: List[List[str]], table_index: Optional[TableIndex] = None,
+                              datapoint_names: Sequence[str] = (), class_name: Optional[str] = None,
+                              token_budget: int = TABLE_TOKEN_BUDGET) -> str:
+    """
+    Serialize the tables relevant to a datapoint query as tab-separated text for a prompt.
+    
+    Tables are ranked against the datapoints and share class, cut down to the
+    label and class columns, and added best first until the token budget is
+    spent (see prompt_packing). Without datapoints, fee tables (share class
+    columns plus datapoint rows) come first.
+    """
+    if not tables:
+        return ""
+    if table_index is None:
+        table_index = TableIndex.build(tables)
+    blocks = pack_tables(tables, table_index, datapoint_names, class_name, token_budget)
+    if not blocks:
+        return ""
+    return "\n\nTABLES IN DOCUMENT (tab-separated):\n\n" + "\n\n".join(blocks) + "\n"
+
+
+def _parse_llm_json(response_text: str) -> Dict[str, Any]:
+    """Parse the JSON object in an LLM response, handling markdown code blocks."""
+    response_text = response_text.strip()
+    if "```json" in response_text:
+        response_text = response_text.split("```json")[1].split("```")[0].strip()
+    elif "```" in response_text:
+        response_text = response_text.split("```")[1].split("```")[0].strip()
+    return json.loads(response_text)
+
+
+def _select_document_text(text: str, page_texts: Optional[Dict[int, str]],
+                          page_index: Optional[PageIndex], query_terms: List[str],
+                          token_budget: int = CONTEXT_TOKEN_BUDGET, unit_label: str = "Page") -> str:
+    """Pick the document text for a prompt: BM25-selected pages, or the start of the text."""
+    if not page_texts:
+        return text[:token_budget * 4]
+    with tracing.span('retrieval', units=len(page_texts)):
+        if page_index is None:
+            page_index = PageIndex.build(page_texts)
+        return build_context(page_texts, page_index, query_terms, token_budget, label=unit_label)
+
+
+def _attribute_page(value: str, context: str, page_texts: Optional[Dict[int, str]],
+                    position_index: Optional[PositionIndex] = None) -> Optional[int]:
+    """
+    Find the page on which an extracted value appears next to its context phrase.
+    
+    Uses the positional index built at parse time (built on the fly if omitted),
+    so the lookup only visits occurrences of the value and context words.
+    """
+    if not page_texts or not value or value == "0":
+        return None
+    with tracing.span('attribution'):
+        if position_index is None:
+            position_index = PositionIndex.build(page_texts)
+        span = position_index.locate(value, context)
+        return span.page if span else None
+
+
+def attribute_element(doc_data: Dict[str, Any], value: Optional[str], context: str = '') -> Optional[str]:
+    """
+    Find the HTML element id to link to for an extracted value.
+    
+    The value is located in the passages with the positional index, and the
+    offset is resolved to its enclosing element with the anchor index; both
+    are built at parse time.
+    
+    Args:
+        doc_data: Parsed HTML document (see ingest_document)
+        value: Extracted value
+        context: Phrase the value was found in (rule location or LLM context)
+        
+    Returns:
+        Element id, or None for PDFs, documents without anchors, or values
+        that cannot be located
+    """
+    anchor_index = doc_data.get('anchor_index')
+    if anchor_index is None or not value or value == "0":
+        return None
+    with tracing.span('attribution', anchors=True):
+        position_index = doc_data.get('position_index') or PositionIndex.build(document_pages(doc_data))
+        span = position_index.locate(value, context)
+        return anchor_index.element_for(span) if span else None
+
+
+def _llm_cache_get(cache_key: str) -> Optional[Any]:
+    """Look up a memoized LLM result, recording the lookup in the active trace."""
+    with tracing.span('llm_cache_lookup') as lookup:
+        cached = llm_cache.get(cache_key)
+        lookup.set(hit=cached is not None)
+    return cached
+
+
+def _estimate_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    """Tokens a chat request counts against the rate limit: prompt plus completion limit."""
+    return sum(count_tokens(message['content']) for message in messages) + max_tokens
+
+
+def _create_completion(messages: List[Dict[str, str]], **kwargs: Any):
+    """Chat completion through the request scheduler (rate limits, retries, deadline)."""
+    return llm_scheduler.call(
+        lambda timeout: client.chat.completions.create(model=OPENAI_MODEL, messages=messages,
+                                                       timeout=timeout, **kwargs),
+        tokens=_estimate_tokens(messages, kwargs.get('max_tokens', 0))
+    )
+
+
+async def _create_completion_async(async_client, messages: List[Dict[str, str]], **kwargs: Any):
+    """Async chat completion through the request scheduler."""
+    return await llm_scheduler.acall(
+        lambda timeout: async_client.chat.completions.create(model=OPENAI_MODEL, messages=messages,
+                                                             timeout=timeout, **kwargs),
+        tokens=_estimate_tokens(messages, kwargs.get('max_tokens', 0))
+    )
+
+
+def _build_extraction_messages(text: str, tables: List[List[str]], datapoint_name: str,
+                               class_name: str, output_rule: str,
+                               page_texts: Optional[Dict[int, str]],
+                               page_index: Optional[PageIndex],
+                               table_index: Optional[TableIndex] = None,
+                               unit_label: str = "Page") -> List[Dict[str, str]]:
+    """Build the chat messages for a single (datapoint, class) extraction."""
+    
+    # Only the tables (and class column) relevant to this datapoint, within the token budget
+    tables_text = _format_tables_for_prompt(tables, table_index, [datapoint_name], class_name)
+    
+    # Select the most relevant pages within the token budget
+    document_text = _select_document_text(text, page_texts, page_index,
+                                          query_terms_for(datapoint_name, class_name),
+                                          unit_label=unit_label)
+    
+    # Create a comprehensive prompt for the LLM
+    prompt = f"""You are a financial document data extraction assistant. Your task is to extract specific data points from fund prospectus documents.
+
+TASK: Extract the {datapoint_name} for {class_name}.
+
+DOCUMENT TEXT:
+{document_text}  
+
+{tables_text}
+
+INSTRUCTIONS:
+1. Find the {datapoint_name} value for {class_name} in the document
+2. Return ONLY the value in the format specified by the output rule: {output_rule}
+3. Also identify the specific location/section where this value was found
+4. Include relevant context words or phrases that appear near the value
+
+OUTPUT FORMAT (respond in exactly this JSON format):
+{{
+    "value": "the extracted value (or '0' if not found)",
+    "location": "specific section/context where found",
+    "context": "2-3 words or phrases that appear near the value in the document"
+}}
+
+DATAPOINT DESCRIPTIONS:
+{DATAPOINT_DESCRIPTIONS}
+
+OUTPUT RULES:
+{OUTPUT_RULE_DESCRIPTIONS}
+
+Remember: Return "0" if the value is not found. Be precise and extract only the requested information."""
+
+    return [
+        {"role": "system", "content": "You are a precise financial data extraction assistant. Always respond with valid JSON."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def _finish_extraction(cache_key: str, response_text: str, page_texts: Optional[Dict[int, str]],
+                       position_index: Optional[PositionIndex] = None) -> Tuple[str, Optional[str], Optional[int]]:
+    """Parse a single-extraction response, attribute it to a page and cache it."""
+    # Parse response (handles markdown code blocks)
+    result = _parse_llm_json(response_text)
+    
+    value = result.get("value", "0")
+    location = result.get("location", "document")
+    context = result.get("context", "")
+    
+    # Find the page where the value appears in its context
+    page_num = _attribute_page(value, context, page_texts, position_index)
+    
+    llm_cache.put(cache_key, {'value': value, 'location': location, 'page': page_num},
+                  OPENAI_MODEL, EXTRACTION_PROMPT_VERSION)
+    
+    return value, location, page_num
+
+
+def extract_datapoint_with_llm(text: str, tables: List[List[str]], datapoint_name: str, 
+                               class_name: str, output_rule: str, 
+                               page_texts: Optional[Dict[int, str]] = None,
+                               doc_hash: Optional[str] = None,
+                               page_index: Optional[PageIndex] = None,
+                               table_index: Optional[TableIndex] = None,
+                               position_index: Optional[PositionIndex] = None,
+                               unit_label: str = "Page") -> Tuple[Optional[str], Optional[str], Optional[int]]:
+    """
+    Extract a specific datapoint from text using LLM (GPT-3.5 Turbo).
+    
+    When page texts are available, the prompt contains the pages that best
+    match the datapoint and class (BM25 over the page index) within the
+    context token budget, rather than the start of the document.
+    
+    Results are memoized in the LLM cache, keyed by document content hash,
+    datapoint, class, model and prompt template version; concurrent identical
+    requests (e.g. from several sessions) share one call.
+    
+    Args:
+        text: Raw text to search
+        tables: List of tables from the document
+        datapoint_name: Name of the datapoint to extract
+        class_name: Share class (e.g., "Class A", "Class I")
+        output_rule: Formatting rule for output
+        page_texts: Optional dictionary of page texts for retrieval and location tracking
+        doc_hash: Content hash of the source document (defaults to a hash of the text)
+        page_index: BM25 index over page_texts (built on the fly if omitted)
+        table_index: Table index of the document (puts fee tables first in the prompt)
+        position_index: Positional index over page_texts, used to attribute the
+            value to a page (built on the fly if omitted)
+        unit_label: What the page_texts units are called in the prompt ("Page"
+            for PDFs, "Passage" for HTML; see document_unit_label)
+        
+    Returns:
+        Tuple of (extracted value, location description, page number)
+    """
+    
+    if not client:
+        return "0", None, None
+    
+    cache_key = make_cache_key(doc_hash or content_hash(text.encode('utf-8')),
+                               datapoint_name, class_name, OPENAI_MODEL,
+                               EXTRACTION_PROMPT_VERSION)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        return cached['value'], cached['location'], cached['page']
+    
+    messages = _build_extraction_messages(text, tables, datapoint_name, class_name,
+                                          output_rule, page_texts, page_index, table_index, unit_label)
+    
+    def call() -> Tuple[str, Optional[str], Optional[int]]:
+        # Call OpenAI API
+        with tracing.span('llm_call', datapoint=datapoint_name, share_class=class_name):
+            response = _create_completion(
+                messages,
+                temperature=0.1,  # Low temperature for consistent extraction
+                max_tokens=500
+            )
+        return _finish_extraction(cache_key, response.choices[0].message.content, page_texts, position_index)
+    
+    try:
+        # Identical requests from other sessions wait for this call instead of repeating it
+        return llm_flights.do(cache_key, call)
+        
+    except Exception as e:
+        report_error(f"LLM extraction error: {str(e)}")
+        return "0", None, None
+
+
+async def extract_datapoint_with_llm_async(async_client, text: str, tables: List[List[str]],
+                                           datapoint_name: str, class_name: str, output_rule: str,
+                                           page_texts: Optional[Dict[int, str]] = None,
+                                           doc_hash: Optional[str] = None,
+                                           page_index: Optional[PageIndex] = None,
+                                           table_index: Optional[TableIndex] = None,
+                                           position_index: Optional[PositionIndex] = None,
+                                           on_update: Optional[FieldCallback] = None,
+                                           unit_label: str = "Page") -> Tuple[Optional[str], Optional[str], Optional[int]]:
+    """
+    Async variant of extract_datapoint_with_llm using an AsyncOpenAI client.
+    
+    If on_update is given, the completion is streamed and on_update is called
+    with the partial "value"/"location" fields as they arrive. Exceptions
+    (including timeouts) propagate to the caller, which reports them per
+    document.
+    """
+    cache_key = make_cache_key(doc_hash or content_hash(text.encode('utf-8')),
+                               datapoint_name, class_name, OPENAI_MODEL,
+                               EXTRACTION_PROMPT_VERSION)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        return cached['value'], cached['location'], cached['page']
+    
+    messages = _build_extraction_messages(text, tables, datapoint_name, class_name,
+                                          output_rule, page_texts, page_index, table_index, unit_label)
+    
+    async def call() -> Tuple[str, Optional[str], Optional[int]]:
+        with tracing.span('llm_call', datapoint=datapoint_name, share_class=class_name,
+                          streamed=on_update is not None):
+            response = await _create_completion_async(
+                async_client,
+                messages,
+                temperature=0.1,
+                max_tokens=500,
+                stream=on_update is not None
+            )
+            if on_update is not None:
+                response_text = await consume_stream_async(
+                    response, StreamingFieldParser(('value', 'location')), on_update
+                )
+            else:
+                response_text = response.choices[0].message.content
+        return _finish_extraction(cache_key, response_text, page_texts, position_index)
+    
+    # Callers waiting on an identical in-flight request get its answer (not streamed)
+    return await llm_flights.ado(cache_key, call)
+
+
+def _build_grid_messages(text: str, tables: List[List[str]], mapping_df: pd.DataFrame,
+                         page_texts: Optional[Dict[int, str]],
+                         page_index: Optional[PageIndex],
+                         table_index: Optional[TableIndex] = None,
+                         share_classes: Optional[Sequence[str]] = None,
+                         unit_label: str = "Page") -> List[Dict[str, str]]:
+    """Build the chat messages for a whole-document datapoint x class extraction."""
+    
+    datapoint_rules = mapping_df.drop_duplicates('Datapoint')[['Datapoint', 'OutputRule']]
+    datapoint_lines = "\n".join(f"- {row.Datapoint} (output rule: {row.OutputRule})"
+                                for row in datapoint_rules.itertuples())
+    # Tables relevant to any of the datapoints, every class column, with a larger budget
+    tables_text = _format_tables_for_prompt(tables, table_index, list(datapoint_rules['Datapoint']),
+                                            token_budget=TABLE_TOKEN_BUDGET * 2)
+    
+    # Retrieve pages relevant to any of the datapoints, with a larger budget
+    query_terms = []
+    for datapoint in datapoint_rules['Datapoint']:
+        query_terms.extend(query_terms_for(datapoint))
+    document_text = _select_document_text(text, page_texts, page_index, query_terms,
+                                          token_budget=CONTEXT_TOKEN_BUDGET * 2, unit_label=unit_label)
+    
+    if share_classes:
+        # Classes known from the class index: the model need not find them
+        task = (f"Extract ALL of the datapoints below for EACH of the share classes offered in the "
+                f"document: {', '.join(share_classes)}.")
+    else:
+        task = ("Identify every share class offered in the document, then extract ALL of the "
+                "datapoints below for EACH share class.")
+    
+    prompt = f"""You are a financial document data extraction assistant. Your task is to extract specific data points from fund prospectus documents.
+
+TASK: {task}
+
+DOCUMENT TEXT:
+{document_text}
+
+{tables_text}
+
+DATAPOINTS TO EXTRACT:
+{datapoint_lines}
+
+DATAPOINT DESCRIPTIONS:
+{DATAPOINT_DESCRIPTIONS}
+
+OUTPUT RULES:
+{OUTPUT_RULE_DESCRIPTIONS}
+
+OUTPUT FORMAT (respond in exactly this JSON format):
+{{
+    "classes": ["Class A", "Class C"],
+    "datapoints": {{
+        "DATAPOINT_NAME": {{
+            "Class A": {{
+                "value": "the extracted value (or '0' if not found)",
+                "location": "specific section/context where found",
+                "context": "2-3 words or phrases that appear near the value in the document"
+            }}
+        }}
+    }}
+}}
+
+Remember: Name share classes in the format 'Class X'. Include every datapoint for every class, using "0" when a value is not found."""
+
+    return [
+        {"role": "system", "content": "You are a precise financial data extraction assistant. Always respond with valid JSON."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def _finish_grid(cache_key: str, response_text: str, page_texts: Optional[Dict[int, str]],
+                 position_index: Optional[PositionIndex] = None) -> Dict[str, Any]:
+    """Parse a grid-extraction response, attribute each cell to a page and cache it."""
+    result = _parse_llm_json(response_text)
+    
+    grid = {'classes': [str(c) for c in result.get('classes') or []], 'datapoints': {}}
+    for datapoint, by_class in (result.get('datapoints') or {}).items():
+        if not isinstance(by_class, dict):
+            continue
+        grid['datapoints'][datapoint] = {}
+        for class_name, cell in by_class.items():
+            if not isinstance(cell, dict):
+                continue
+            value = str(cell.get('value', '0'))
+            grid['datapoints'][datapoint][class_name] = {
+                'value': value,
+                'location': cell.get('location', 'document'),
+                'page': _attribute_page(value, cell.get('context', ''), page_texts, position_index),
+            }
+    
+    llm_cache.put(cache_key, grid, OPENAI_MODEL, EXTRACTION_PROMPT_VERSION)
+    return grid
+
+
+def _grid_cache_key(text: str, doc_hash: Optional[str], share_classes: Optional[Sequence[str]]) -> str:
+    """LLM cache key of a document's grid; the share classes named in the prompt are part of it."""
+    classes = '*'
+    if share_classes:
+        # The class list grows when lazily loaded tables reveal more classes
+        classes = content_hash(','.join(sorted(share_classes)).encode('utf-8'))
+    return make_cache_key(doc_hash or content_hash(text.encode('utf-8')),
+                          '*', classes, OPENAI_MODEL, EXTRACTION_PROMPT_VERSION)
+
+
+def extract_all_datapoints_with_llm(text: str, tables: List[List[str]], mapping_df: pd.DataFrame,
+                                    page_texts: Optional[Dict[int, str]] = None,
+                                    doc_hash: Optional[str] = None,
+                                    page_index: Optional[PageIndex] = None,
+                                    table_index: Optional[TableIndex] = None,
+                                    position_index: Optional[PositionIndex] = None,
+                                    share_classes: Optional[Sequence[str]] = None,
+                                    unit_label: str = "Page") -> Optional[Dict[str, Any]]:
+    """
+    Extract every datapoint for every share class of a document in one LLM call.
+    
+    The model returns the full datapoint x class matrix as structured JSON, so
+    later questions about the same document are answered from the grid without
+    further round trips. The grid is memoized in the LLM cache like single
+    extractions.
+    
+    Args:
+        text: Raw text to search
+        tables: List of tables from the document
+        mapping_df: DataFrame with datapoint mappings (datapoints and output rules)
+        page_texts: Optional dictionary of page texts for retrieval and location tracking
+        doc_hash: Content hash of the source document (defaults to a hash of the text)
+        page_index: BM25 index over page_texts (built on the fly if omitted)
+        table_index: Table index of the document (puts fee tables first in the prompt)
+        position_index: Positional index over page_texts, used to attribute
+            values to pages (built on the fly if omitted)
+        share_classes: Share classes of the document, if known from its class
+            index (the model identifies them otherwise)
+        unit_label: What the page_texts units are called in the prompt ("Page"
+            for PDFs, "Passage" for HTML; see document_unit_label)
+        
+    Returns:
+        Grid dictionary with 'classes' (share classes found in the document) and
+        'datapoints' (datapoint -> class -> {'value', 'location', 'page'}),
+        or None if the extraction failed
+    """
+    
+    if not client:
+        return None
+    
+    cache_key = _grid_cache_key(text, doc_hash, share_classes)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        return cached
+    
+    messages = _build_grid_messages(text, tables, mapping_df, page_texts, page_index, table_index,
+                                    share_classes, unit_label)
+    
+    def call() -> Dict[str, Any]:
+        with tracing.span('llm_call', datapoint='*', share_class='*'):
+            response = _create_completion(
+                messages,
+                temperature=0.1,
+                max_tokens=3000
+            )
+        return _finish_grid(cache_key, response.choices[0].message.content, page_texts, position_index)
+    
+    try:
+        return llm_flights.do(cache_key, call)
+        
+    except Exception as e:
+        report_error(f"LLM batch extraction error: {str(e)}")
+        return None
+
+
+async def extract_all_datapoints_with_llm_async(async_client, text: str, tables: List[List[str]],
+                                                mapping_df: pd.DataFrame,
+                                                page_texts: Optional[Dict[int, str]] = None,
+                                                doc_hash: Optional[str] = None,
+                                                page_index: Optional[PageIndex] = None,
+                                                table_index: Optional[TableIndex] = None,
+                                                position_index: Optional[PositionIndex] = None,
+                                                share_classes: Optional[Sequence[str]] = None,
+                                                unit_label: str = "Page") -> Dict[str, Any]:
+    """
+    Async variant of extract_all_datapoints_with_llm using an AsyncOpenAI client.
+    
+    Exceptions (including timeouts) propagate to the caller.
+    """
+    cache_key = _grid_cache_key(text, doc_hash, share_classes)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        return cached
+    
+    messages = _build_grid_messages(text, tables, mapping_df, page_texts, page_index, table_index,
+                                    share_classes, unit_label)
+    
+    async def call() -> Dict[str, Any]:
+        with tracing.span('llm_call', datapoint='*', share_class='*'):
+            response = await _create_completion_async(
+                async_client,
+                messages,
+                temperature=0.1,
+                max_tokens=3000
+            )
+        return _finish_grid(cache_key, response.choices[0].message.content, page_texts, position_index)
+    
+    return await llm_flights.ado(cache_key, call)
+
+
+def lookup_extraction_grid(grid: Optional[Dict[str, Any]], datapoint_name: str,
+                           class_name: str) -> Optional[Tuple[str, Optional[str], Optional[int]]]:
+    """
+    Answer a (datapoint, class) question from a batch extraction grid.
+    
+    Returns:
+        Tuple of (value, location, page number); ("0", None, None) if the class is
+        not offered by the document; None if the grid cannot answer and a
+        single extraction call is needed
+    """
+    if not grid:
+        return None
+    
+    cell = grid['datapoints'].get(datapoint_name, {}).get(class_name)
+    if cell is not None:
+        return cell['value'], cell['location'], cell['page']
+    
+    if grid['classes'] and class_name not in grid['classes']:
+        return "0", None, None
+    
+    return None
+
+
+def parse_user_prompt_with_llm(prompt: str, mapping_df: pd.DataFrame,
+                               on_update: Optional[FieldCallback] = None,
+                               share_classes: Optional[Sequence[str]] = None) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Parse user prompt using LLM to identify datapoint and class.
+    
+    Args:
+        prompt: User's natural language prompt
+        mapping_df: DataFrame with datapoint mappings
+        on_update: If given, the completion is streamed and this is called with
+            the partial "datapoint"/"class" fields as they arrive
+        share_classes: Share classes offered by the uploaded documents (see
+            document_classes); a list of common classes is given otherwise
+        
+    Returns:
+        Tuple of (datapoint_name, class_name)
+    """
+    
+    if not client:
+        return parse_user_prompt_fallback(prompt, mapping_df)
+    
+    # Get list of available datapoints
+    available_datapoints = mapping_df['Datapoint'].unique().tolist()
+    
+    if share_classes:
+        classes_section = f"SHARE CLASSES IN THE DOCUMENTS:\n{', '.join(share_classes)}"
+    else:
+        classes_section = "COMMON SHARE CLASSES:\nClass A, Class B, Class C, Class F, Class I, Class R, Class Z"
+    
+    llm_prompt = f"""You are a financial document query parser. Analyze the user's question and identify:
+1. Which datapoint they are asking about
+2. Which share class they are interested in
+
+USER QUERY: {prompt}
+
+AVAILABLE DATAPOINTS:
+{', '.join(available_datapoints)}
+
+{classes_section}
+
+OUTPUT FORMAT (respond in exactly this JSON format):
+{{
+    "datapoint": "the exact datapoint name from the available list (or null if unclear)",
+    "class": "the share class in format 'Class X' (or null if not specified)"
+}}
+
+Example responses:
+- For "What is the total annual fund operating expenses for Class A?": {{"datapoint": "TOTAL_ANNUAL_FUND_OPERATING_EXPENSES", "class": "Class A"}}
+- For "Initial investment Class C": {{"datapoint": "INITIAL_INVESTMENT", "class": "Class C"}}
+- For "CDSC Class I": {{"datapoint": "CDSC", "class": "Class I"}}
+"""
+
+    try:
+        with tracing.span('llm_prompt_parse', streamed=on_update is not None):
+            response = _create_completion(
+                [
+                    {"role": "system", "content": "You are a query parsing assistant. Always respond with valid JSON."},
+                    {"role": "user", "content": llm_prompt}
+                ],
+                temperature=0.1,
+                max_tokens=200,
+                stream=on_update is not None
+            )
+            
+            if on_update is not None:
+                response_text = consume_stream(response, StreamingFieldParser(('datapoint', 'class')), on_update)
+            else:
+                response_text = response.choices[0].message.content
+        
+        # Extract JSON
+        result = _parse_llm_json(response_text)
+        
+        datapoint = result.get("datapoint")
+        class_name = result.get("class")
+        
+        return datapoint, class_name
+        
+    except Exception as e:
+        report_error(f"Prompt parsing error: {str(e)}")
+        # Fallback to simple pattern matching
+        return parse_user_prompt_fallback(prompt, mapping_df)
+
+
+def parse_user_prompt_fallback(prompt: str, mapping_df: pd.DataFrame) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Fallback parser using rule-based matching when LLM fails.
+    """
+    prompt_lower = prompt.lower()
+    
+    # Extract class name
+    class_name = None
+    class_patterns = [
+        r'class\s+([a-z])\b',
+        r'class\s+([a-z])\s+shares',
+        r'for\s+class\s+([a-z])',
+        r'\(class\s+([a-z])\)'
+    ]
+    
+    for pattern in class_patterns:
+        match = re.search(pattern, prompt_lower)
+        if match:
+            class_name = f"Class {match.group(1).upper()}"
+            break
+    
+    # Match against instruction patterns
+    for _, row in mapping_df.iterrows():
+        instruction_pattern = row['Instruction'].lower().replace('{class}', '.*?')
+        if re.search(instruction_pattern, prompt_lower, re.IGNORECASE):
+            return row['Datapoint'], class_name or row['Class']
+    
+    # Fallback: keyword matching
+    if 'total annual fund operating expenses' in prompt_lower or 'total_annual_fund_operating_expenses' in prompt_lower:
+        return 'TOTAL_ANNUAL_FUND_OPERATING_EXPENSES', class_name
+    elif 'net expenses' in prompt_lower or 'net_expenses' in prompt_lower:
+        return 'NET_EXPENSES', class_name
+    elif 'automatic investment plan' in prompt_lower and 'subsequent' in prompt_lower:
+        return 'MINIMUM_SUBSEQUENT_INVESTMENT_AIP', class_name
+    elif 'initial investment' in prompt_lower:
+        return 'INITIAL_INVESTMENT', class_name
+    elif 'cdsc' in prompt_lower:
+        return 'CDSC', class_name
+    elif 'redemption fee' in prompt_lower:
+        return 'REDEMPTION_FEE', class_name
+    
+    return None, class_name
+
+
+# ============================================================================
+# Concurrent Multi-Document Extraction
+# ============================================================================
+
+def document_inputs(doc_data: Dict[str, Any]) -> Tuple[str, List[List[str]], Dict[int, str]]:
+    """
+    Return the extraction inputs of a parsed document.
+    
+    Returns:
+        Tuple of (full text, flat list of tables, retrieval units: pages for PDFs,
+        passages for HTML)
+    """
+    if doc_data['type'] == 'pdf':
+        # The compact layout holds the pages joined already
+        pages = doc_data['pages']
+        all_text = pages.text if isinstance(pages, PageText) else '\n'.join(pages.values())
+        tables = []
+        for page_tables in doc_data.get('tables', {}).values():
+            tables.extend(page_tables)
+        return all_text, tables, doc_data['pages']
+    return doc_data['text'], [], doc_data.get('passages', {})
+
+
+def _make_async_client():
+    """Create an AsyncOpenAI client bound to the current event loop."""
+    return async_openai_client(OPENAI_API_KEY)
+
+
+# Every async fan-out runs on one long-lived event loop, so its AsyncOpenAI
+# client (and the client's keep-alive connection pool) is reused by every
+# question of every session instead of being rebuilt per question
+_llm_loop: Optional[asyncio.AbstractEventLoop] = None
+_llm_loop_lock = threading.Lock()
+_async_client = None
+
+
+def _get_llm_loop() -> asyncio.AbstractEventLoop:
+    """The background event loop of the LLM fan-outs, started on first use."""
+    global _llm_loop
+    with _llm_loop_lock:
+        if _llm_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='smartally-llm-loop', daemon=True).start()
+            _llm_loop = loop
+        return _llm_loop
+
+
+def _get_async_client():
+    """The AsyncOpenAI client of the LLM loop, created once (call on that loop only)."""
+    global _async_client
+    if _async_client is None:
+        _async_client = _make_async_client()
+    return _async_client
+
+
+def _run_on_llm_loop(make_coro: Callable[[Callable[[Callable], Callable]], Any]) -> Any:
+    """
+    Run a coroutine on the LLM loop and wait for its result.
+    
+    Streamlit calls only work on the session's script thread, so error reports
+    and the callbacks the coroutine is given (wrapped with the function passed
+    to make_coro) are handed back and run on the calling thread while it waits.
+    
+    Args:
+        make_coro: Called with a wrapper for callbacks; returns the coroutine
+    """
+    calls: "queue.SimpleQueue" = queue.SimpleQueue()
+    
+    def in_caller(callback: Callable) -> Callable:
+        return lambda *args: calls.put((callback, args))
+    
+    # Spans reach the active trace; errors are reported through this thread's reporter
+    context = contextvars.copy_context()
+    reporter = _context_error_reporter.get() or _error_reporter
+    context.run(_context_error_reporter.set, in_caller(reporter))
+    coro = make_coro(in_caller)
+    
+    done: Future = Future()
+    
+    def finish(task: asyncio.Task) -> None:
+        if task.cancelled():
+            done.cancel()
+        elif task.exception() is not None:
+            done.set_exception(task.exception())
+        else:
+            done.set_result(task.result())
+        calls.put(None)
+    
+    def start() -> None:
+        # The task runs in the copied context
+        _get_llm_loop().create_task(coro).add_done_callback(finish)
+    
+    _get_llm_loop().call_soon_threadsafe(start, context=context)
+    while True:
+        call = calls.get()
+        if call is None:
+            return done.result()
+        callback, args = call
+        callback(*args)
+
+
+async def _extract_document_async(async_client, semaphore: asyncio.Semaphore, doc_name: str,
+                                  doc_data: Dict[str, Any], datapoint_name: str, class_name: str,
+                                  output_rule: str, mapping_df: pd.DataFrame, batch_mode: bool,
+                                  on_partial: Optional[Callable[[str, Dict[str, str]], None]] = None
+                                  ) -> Tuple[Optional[str], Optional[str], Optional[int]]:
+    """Run the LLM extraction for one document, holding a concurrency slot per call."""
+    loop = asyncio.get_running_loop()
+    if not document_offers_class(doc_data, class_name) and not (
+            doc_data.get('tables_pending') and await loop.run_in_executor(
+                None, contextvars.copy_context().run, document_offers_class_in_any_table, doc_data, class_name)):
+        # The class index rules the class out: no call needed
+        return "0", None, None
+    
+    answer = await _extract_document_once(async_client, semaphore, doc_name, doc_data, datapoint_name,
+                                          class_name, output_rule, mapping_df, batch_mode, on_partial)
+    if is_missing_answer(answer) and datapoint_name in LAZY_TABLE_DATAPOINTS and doc_data.get('tables_pending'):
+        # Not in the tables loaded up front: ask again with the tables of every page
+        if await loop.run_in_executor(None, contextvars.copy_context().run, ensure_all_tables, doc_data):
+            answer = await _extract_document_once(async_client, semaphore, doc_name, doc_data,
+                                                  datapoint_name, class_name, output_rule, mapping_df,
+                                                  batch_mode, on_partial)
+    return answer
+
+
+async def _extract_document_once(async_client, semaphore: asyncio.Semaphore, doc_name: str,
+                                 doc_data: Dict[str, Any], datapoint_name: str, class_name: str,
+                                 output_rule: str, mapping_df: pd.DataFrame, batch_mode: bool,
+                                 on_partial: Optional[Callable[[str, Dict[str, str]], None]] = None
+                                 ) -> Tuple[Optional[str], Optional[str], Optional[int]]:
+    """One LLM extraction attempt (grid lookup, then a single call) with the tables loaded so far."""
+    all_text, tables, page_texts = document_inputs(doc_data)
+    doc_hash = document_llm_key(doc_data)
+    page_index = doc_data.get('page_index')
+    table_index = doc_data.get('table_index')
+    position_index = doc_data.get('position_index')
+    
+    if batch_mode:
+        # One call per document for the whole grid, reused by later questions.
+        # The document is shared by every session: only a successful grid is
+        # kept on it, so a failed call is retried by the next question
+        grid = doc_data.get('extraction_grid')
+        if grid is None:
+            try:
+                async with semaphore:
+                    grid = await asyncio.wait_for(
+                        extract_all_datapoints_with_llm_async(
+                            async_client, all_text, tables, mapping_df, page_texts,
+                            doc_hash=doc_hash, page_index=page_index, table_index=table_index,
+                            position_index=position_index, share_classes=document_classes(doc_data),
+                            unit_label=document_unit_label(doc_data)
+                        ),
+                        LLM_CALL_TIMEOUT
+                    )
+                doc_data['extraction_grid'] = grid
+            except asyncio.TimeoutError:
+                report_error(f"LLM batch extraction timed out for {doc_name}")
+            except Exception as e:
+                report_error(f"LLM batch extraction error for {doc_name}: {str(e)}")
+        answer = lookup_extraction_grid(grid, datapoint_name, class_name)
+        if answer is not None:
+            return answer
+    
+    try:
+        async with semaphore:
+            return await asyncio.wait_for(
+                extract_datapoint_with_llm_async(
+                    async_client, all_text, tables, datapoint_name, class_name, output_rule,
+                    page_texts, doc_hash=doc_hash, page_index=page_index, table_index=table_index,
+                    position_index=position_index, on_update=(lambda fields: on_partial(doc_name, fields)) if on_partial else None,
+                    unit_label=document_unit_label(doc_data)
+                ),
+                LLM_CALL_TIMEOUT
+            )
+    except asyncio.TimeoutError:
+        report_error(f"LLM extraction timed out for {doc_name}")
+    except Exception as e:
+        report_error(f"LLM extraction error for {doc_name}: {str(e)}")
+    return "0", None, None
+
+
+async def _extract_documents_async(parsed_docs: Dict[str, Any], datapoint_name: str,
+                                   class_name: str, output_rule: str, mapping_df: pd.DataFrame,
+                                   batch_mode: bool,
+                                   on_partial: Optional[Callable[[str, Dict[str, str]], None]] = None
+                                   ) -> List[Tuple[Optional[str], Optional[str], Optional[int]]]:
+    """Fan out one extraction per document and gather the results in document order."""
+    semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    # Shared by every question; never closed
+    async_client = _get_async_client()
+    return await asyncio.gather(*[
+        _extract_document_async(async_client, semaphore, doc_name, doc_data, datapoint_name,
+                                class_name, output_rule, mapping_df, batch_mode, on_partial)
+        for doc_name, doc_data in parsed_docs.items()
+    ])
+
+
+def extract_documents_with_llm(parsed_docs: Dict[str, Any], datapoint_name: str, class_name: str,
+                               output_rule: str, mapping_df: pd.DataFrame,
+                               batch_mode: bool = False,
+                               on_partial: Optional[Callable[[str, Dict[str, str]], None]] = None
+                               ) -> Dict[str, Tuple[Optional[str], Optional[str], Optional[int]]]:
+    """
+    Extract a datapoint from every document concurrently with the async OpenAI client.
+    
+    At most SMARTALLY_LLM_CONCURRENCY calls are in flight at once, each call is
+    bounded by SMARTALLY_LLM_TIMEOUT seconds, and results are returned in
+    document order. A multi-document query therefore takes roughly the latency
+    of the slowest single call. The calls run on the shared LLM event loop
+    (one pooled async client for every session); the calling thread waits and
+    runs the on_partial callbacks and error reports.
+    
+    Args:
+        parsed_docs: Dictionary containing parsed document data
+        datapoint_name: Name of the datapoint to extract
+        class_name: Share class (e.g., "Class A")
+        output_rule: Formatting rule for output
+        mapping_df: DataFrame with datapoint mappings (used by batch mode)
+        batch_mode: Answer from the per-document datapoint x class grid
+        on_partial: If given, single extractions are streamed and this is called
+            with (document name, partial fields) as tokens arrive
+        
+    Returns:
+        Dictionary mapping document name to (value, location, page number)
+    """
+    if not client or not parsed_docs:
+        return {doc_name: ("0", None, None) for doc_name in parsed_docs}
+    
+    results = _run_on_llm_loop(lambda in_caller: _extract_documents_async(
+        parsed_docs, datapoint_name, class_name, output_rule, mapping_df, batch_mode,
+        in_caller(on_partial) if on_partial else None
+    ))
+    return dict(zip(parsed_docs.keys(), results))
+
+
+# ============================================================================
+# Legacy Rule-Based Data Extraction Functions (Kept as Fallback)
+# ============================================================================
+
+# Datapoints found in fee tables, which every fund has: a miss on the candidate
+# pages loads the remaining tables (a missing CDSC is usually a real absence)
+LAZY_TABLE_DATAPOINTS = ('TOTAL_ANNUAL_FUND_OPERATING_EXPENSES', 'NET_EXPENSES')
+
+
+@lru_cache(maxsize=64)
+def class_name_variations(class_name: str) -> Tuple[str, ...]:
+    """Return the spellings of a share class searched for in documents (built once per class)."""
+    return (
+        class_name,
+        class_name.replace("Class ", ""),
+        f"Class {class_name.replace('Class ', '')}",
+        f"Shares {class_name.replace('Class ', '')}",
+        f"{class_name.replace('Class ', '')} Shares"
+    )
+
+
+def extract_datapoint(text: str, tables: List[List[str]], datapoint_name: str, 
+                      class_name: str, output_rule: str,
+                      table_index: Optional[TableIndex] = None) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Extract a specific datapoint from text using rule-based pattern matching.
+    
+    Args:
+        text: Raw text to search
+        tables: List of tables from the document
+        datapoint_name: Name of the datapoint to extract
+        class_name: Share class (e.g., "Class A", "Class I")
+        output_rule: Formatting rule for output
+        table_index: Parse-time index of the tables (built on the fly if omitted)
+        
+    Returns:
+        Tuple of (extracted value, location description)
+    """
+    
+    # Normalize class name variations
+    class_variations = class_name_variations(class_name)
+    
+    if datapoint_name == "TOTAL_ANNUAL_FUND_OPERATING_EXPENSES":
+        return extract_annual_expenses(text, tables, class_variations, output_rule, table_index)
+    
+    elif datapoint_name == "NET_EXPENSES":
+        return extract_net_expenses(text, tables, class_variations, output_rule, table_index)
+    
+    elif datapoint_name == "MINIMUM_SUBSEQUENT_INVESTMENT_AIP":
+        return extract_minimum_investment_aip(text, class_variations, output_rule)
+    
+    elif datapoint_name == "INITIAL_INVESTMENT":
+        return extract_initial_investment(text, class_variations, output_rule)
+    
+    elif datapoint_name == "CDSC":
+        return extract_cdsc(text, tables, class_variations, output_rule)
+    
+    elif datapoint_name == "REDEMPTION_FEE":
+        return extract_redemption_fee(text, class_variations, output_rule)
+    
+    return "0", None
+
+
+def extract_document_datapoint(doc_data: Dict[str, Any], datapoint_name: str, class_name: str,
+                               output_rule: str) -> Tuple[Optional[str], Optional[str], Optional[int]]:
+    """
+    Rule-based extraction of one datapoint from a parsed document.
+    
+    Args:
+        doc_data: Parsed document (see ingest_document)
+        datapoint_name: Name of the datapoint to extract
+        class_name: Share class (e.g., "Class A", "Class I")
+        output_rule: Formatting rule for output
+        
+    Returns:
+        Tuple of (extracted value, location description, page number); the page
+        is None for HTML documents or when the value cannot be attributed;
+        ("0", None, None) at once for a class the document does not offer
+    """
+    if not document_offers_class_in_any_table(doc_data, class_name):
+        return "0", None, None
+    
+    all_text, tables, _ = document_inputs(doc_data)
+    
+    if doc_data['type'] != 'pdf':
+        value, location = extract_datapoint(all_text, [], datapoint_name, class_name, output_rule)
+        return value, location, None
+    
+    table_index = doc_data.get('table_index')
+    value, location = extract_datapoint(all_text, tables, datapoint_name, class_name, output_rule,
+                                        table_index)
+    if (not value or value == "0") and datapoint_name in LAZY_TABLE_DATAPOINTS and ensure_all_tables(doc_data):
+        # Not on the candidate pages: retry with the tables of every page
+        _, tables, _ = document_inputs(doc_data)
+        table_index = doc_data['table_index']
+        value, location = extract_datapoint(all_text, tables, datapoint_name, class_name, output_rule,
+                                            table_index)
+    page_num = None
+    if location and location.endswith('table') and table_index is not None:
+        # Tables know the page they came from
+        page_num = next((page for cell, page in table_index.cells(
+            tables, datapoint_name, class_name_variations(class_name))
+            if rule_patterns.PERCENT.search(cell)), None)
+    if page_num is None:
+        # Find where the value appears near its section name
+        page_num = _attribute_page(value, location or '', doc_data['pages'],
+                                   doc_data.get('position_index'))
+    return value, location, page_num
+
+
+def _table_percentage(tables: List[List[str]], table_index: Optional[TableIndex],
+                      row_key: str, class_variations: Sequence[str]) -> Optional[str]:
+    """Return the first percentage in a datapoint row under the class column, if any."""
+    if not tables:
+        return None
+    if table_index is None:
+        table_index = TableIndex.build(tables)
+    for cell, _ in table_index.cells(tables, row_key, class_variations):
+        match = rule_patterns.PERCENT.search(cell)
+        if match:
+            return f"{match.group(1)}%"
+    return None
+
+
+def extract_annual_expenses(text: str, tables: List[List[str]], 
+                           class_variations: Sequence[str], output_rule: str,
+                           table_index: Optional[TableIndex] = None) -> Tuple[str, Optional[str]]:
+    """Extract total annual fund operating expenses."""
+    
+    # Search in tables first (class column and row label from the table index)
+    value = _table_percentage(tables, table_index, 'TOTAL_ANNUAL_FUND_OPERATING_EXPENSES', class_variations)
+    if value:
+        return value, "expenses table"
+    
+    hits = rule_patterns.anchor_hits(text, 'annual_expenses')
+    
+    # Search in text - look for the specific line with Total Annual
+    for hit_start, hit_end in hits:
+        line_start, line_end = rule_patterns.line_bounds(text, hit_start)
+        if 'expenses' in text[line_start:line_end].lower():
+            # Found the row, now look for class and value in nearby lines
+            search_text = rule_patterns.surrounding_lines(text, hit_start, 2, 2)
+            for class_var in class_variations:
+                match = rule_patterns.class_regex('line_percent', class_var).search(search_text)
+                if match:
+                    return f"{match.group(1)}%", "expenses section"
+    
+    return "0", None
+
+
+def extract_net_expenses(text: str, tables: List[List[str]], 
+                        class_variations: Sequence[str], output_rule: str,
+                        table_index: Optional[TableIndex] = None) -> Tuple[str, Optional[str]]:
+    """Extract net expenses after fee waiver/expense reimbursement."""
+    
+    # Search in tables
+    value = _table_percentage(tables, table_index, 'NET_EXPENSES', class_variations)
+    if value:
+        return value, "net expenses table"
+    
+    hits = rule_patterns.anchor_hits(text, 'net_expenses')
+    
+    # Search in text
+    for hit_start, hit_end in hits:
+        line_start, line_end = rule_patterns.line_bounds(text, hit_start)
+        if 'expense' in text[line_start:line_end].lower():
+            search_text = rule_patterns.surrounding_lines(text, hit_start, 2, 2)
+            for class_var in class_variations:
+                match = rule_patterns.class_regex('line_percent', class_var).search(search_text)
+                if match:
+                    return f"{match.group(1)}%", "net expenses section"
+    
+    return "0", None
+
+
+def extract_minimum_investment_aip(text: str, class_variations: Sequence[str], 
+                                   output_rule: str) -> Tuple[str, Optional[str]]:
+    """Extract minimum subsequent investment for Automatic Investment Plans."""
+    
+    hits = rule_patterns.anchor_hits(text, 'aip')
+    
+    # Look for Minimum Investment section with AIP: an AIP mention inside the
+    # class block, after its "Subsequent investment" line, followed by an amount
+    for class_var in class_variations:
+        for hit_start, hit_end in hits:
+            block = rule_patterns.nearest_class_mention(text, [class_var], hit_start)
+            if block is None or not rule_patterns.SUBSEQUENT.search(text, block.end(), hit_start):
+                continue
+            match = rule_patterns.DOLLAR.search(text, hit_end, hit_end + rule_patterns.WINDOW_AFTER)
+            if match:
+                amount = match.group(1).replace(',', '')
+                return f"${amount}", "minimum investment section"
+    
+    # Try alternate pattern: AIP, then "subsequent", then an amount
+    for hit_start, hit_end in hits:
+        window_end = hit_end + rule_patterns.WINDOW_AFTER
+        subsequent = rule_patterns.SUBSEQUENT.search(text, hit_end, window_end)
+        if subsequent:
+            match = rule_patterns.DOLLAR.search(text, subsequent.end(), window_end)
+            if match:
+                amount = match.group(1).replace(',', '')
+                return f"${amount}", "minimum investment section"
+    
+    return "0", None
+
+
+def extract_initial_investment(text: str, class_variations: Sequence[str], 
+                               output_rule: str) -> Tuple[str, Optional[str]]:
+    """Extract initial investment amount."""
+    
+    hits = rule_patterns.anchor_hits(text, 'initial_investment')
+    
+    # "Initial Investment:" line inside the class block
+    for class_var in class_variations:
+        for hit_start, hit_end in hits:
+            init_match = rule_patterns.INITIAL_VALUE.match(text, hit_start)
+            if not init_match or rule_patterns.nearest_class_mention(text, [class_var], hit_start) is None:
+                continue
+            
+            value = init_match.group(1).strip()
+            if 'no minimum' in value.lower():
+                return "No minimum", "minimum investment section"
+            # Extract dollar amount
+            dollar_match = rule_patterns.DOLLAR.search(value)
+            if dollar_match:
+                amount = dollar_match.group(1).replace(',', '')
+                return f"${amount}", "minimum investment section"
+    
+    # Fallback: class mentioned shortly before an "initial investment" hit
+    for class_var in class_variations:
+        mention = rule_patterns.class_regex('mention', class_var)
+        class_hits = [(hit_start, hit_end) for hit_start, hit_end in hits
+                      if mention.search(text, max(0, hit_start - rule_patterns.WINDOW_BEFORE), hit_start)]
+        
+        # Look for "no minimum" first
+        for hit_start, hit_end in class_hits:
+            if rule_patterns.NO_MINIMUM.search(text, hit_end, hit_end + rule_patterns.WINDOW_AFTER):
+                return "No minimum", "minimum investment section"
+        
+        # Look for dollar amount
+        for hit_start, hit_end in class_hits:
+            match = rule_patterns.DOLLAR.search(text, hit_end, hit_end + rule_patterns.WINDOW_AFTER)
+            if match:
+                amount = match.group(1).replace(',', '')
+                return f"${amount}", "minimum investment section"
+    
+    return "0", None
+
+
+def extract_cdsc(text: str, tables: List[List[str]], class_variations: Sequence[str], 
+                output_rule: str) -> Tuple[str, Optional[str]]:
+    """Extract CDSC (Contingent Deferred Sales Charge) information."""
+    
+    hits = rule_patterns.anchor_hits(text, 'cdsc')
+    
+    # CDSC typically shows years and percentages
+    for class_var in class_variations:
+        schedule = rule_patterns.class_regex('cdsc_schedule', class_var)
+        years_only = rule_patterns.class_regex('cdsc_years', class_var)
+        
+        # Look for CDSC section with years and percentages
+        for hit_start, hit_end in hits:
+            match = schedule.search(text, hit_end, hit_end + rule_patterns.WINDOW_AFTER)
+            if match:
+                years = match.group(1)
+                first_pct = match.group(2)
+                after_pct = match.group(3)
+                return f"{years} year, {first_pct}% then {after_pct}%", "CDSC section"
+        
+        # Simpler pattern for "1 year" and "0% after first year"
+        for hit_start, hit_end in hits:
+            match = years_only.search(text, hit_end, hit_end + rule_patterns.WINDOW_AFTER)
+            if match:
+                years = match.group(1)
+                # Look for "0% after" nearby
+                after_match = rule_patterns.PERCENT_AFTER.search(text, match.end(), match.end() + 100)
+                if after_match:
+                    return f"{years} year, {after_match.group(1)}% after first year", "CDSC section"
+                return f"{years} year", "CDSC section"
+    
+    return "0", None
+
+
+def extract_redemption_fee(text: str, class_variations: Sequence[str], 
+                          output_rule: str) -> Tuple[str, Optional[str]]:
+    """Extract redemption fee information."""
+    
+    hits = rule_patterns.anchor_hits(text, 'redemption_fee')
+    
+    for class_var in class_variations:
+        labelled = rule_patterns.class_regex('labelled', class_var)
+        mention = rule_patterns.class_regex('mention', class_var)
+        field_value = rule_patterns.class_regex('field_value', class_var)
+        
+        # Look for class-specific redemption fee ("Class Z: 2% redemption fee ...")
+        for hit_start, hit_end in hits:
+            line_start, line_end = rule_patterns.line_bounds(text, hit_start)
+            match = labelled.search(text, line_start, hit_start)
+            if not match:
+                continue
+            fee_text = text[match.end():hit_start].strip()
+            # Extract percentage or "No" fee
+            if rule_patterns.PERCENT.search(fee_text):
+                # Return the full statement on that line
+                return text[match.end():line_end].strip(), "redemption fee section"
+            elif 'no' in fee_text.lower():
+                return "No redemption fee", "redemption fee section"
+        
+        # Alternative pattern: class mentioned shortly before "redemption fee: ..."
+        for hit_start, hit_end in hits:
+            if not mention.search(text, max(0, hit_start - rule_patterns.WINDOW_BEFORE), hit_start):
+                continue
+            separator = rule_patterns.FIELD_SEPARATOR.match(text, hit_end)
+            if not separator:
+                continue
+            _, line_end = rule_patterns.line_bounds(text, separator.end())
+            fee_info = text[separator.end():line_end].strip()
+            if fee_info:
+                return fee_info, "redemption fee section"
+        
+        # Try reverse: redemption fee first
+        for hit_start, hit_end in hits:
+            match = field_value.search(text, hit_end, hit_end + rule_patterns.WINDOW_AFTER)
+            if match:
+                fee_info = match.group(1).strip()
+                if fee_info:
+                    return fee_info, "redemption fee section"
+    
+    return "0", None
@@ -0,0 +1,143 @@
+"""
+SmartAlly - HTML Ingest
+Parses an uploaded HTML filing with lxml (libxml2) in a single pass. The
+character encoding is detected once from the byte order mark or the <meta>
+charset declaration, and one walk over the element tree produces both the
+document text and, for every element with an id (or <a name>), the (start,
+end) character offsets of its text within that document text. Anchor text is never copied,
+so nested ids do not re-walk the same subtree.
+"""
+
+import codecs
+import re
+from typing import Dict, Optional, Tuple
+
+from lxml import etree
+
+# id -> (start, end) character offsets into the document text
+AnchorOffsets = Dict[str, Tuple[int, int]]
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Bytes searched for a <meta charset> declaration (the HTML spec uses 1024)
+_META_SCAN_BYTES = 4096
+_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([A-Za-z0-9._:-]+)', re.IGNORECASE)
+_XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+# Elements whose content is never document text
+_SKIPPED_TAGS = frozenset(('script', 'style', 'noscript', 'template'))
+
+
+def detect_encoding(data: bytes) -> Optional[str]:
+    """
+    Detect the declared encoding of an HTML document.
+
+    Args:
+        data: Raw document bytes
+
+    Returns:
+        Codec name from the byte order mark or <meta> charset, or None if the
+        document declares nothing usable
+    """
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return encoding
+    match = _META_CHARSET.search(data, 0, _META_SCAN_BYTES)
+    if match:
+        try:
+            return codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError:
+            pass
+    return None
+
+
+def decode_html(data: bytes) -> str:
+    """
+    Decode HTML bytes with exactly one successful decode.
+
+    The declared encoding is used when present; otherwise UTF-8, falling back
+    to Windows-1252 (a superset of Latin-1 used by most older EDGAR filings).
+    """
+    encoding = detect_encoding(data)
+    if encoding:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('windows-1252', errors='replace')
+
+
+def parse_html_bytes(data) -> Tuple[str, AnchorOffsets]:
+    """
+    Extract the document text and anchor offsets of an HTML document.
+
+    Text nodes are stripped and joined with single spaces, as
+    BeautifulSoup's get_text(separator=' ', strip=True) would.
+
+    Args:
+        data: Raw document bytes or already decoded text
+
+    Returns:
+        Tuple of (full text, dictionary mapping element IDs (and <a> names) to
+        the (start, end) offsets of their text in the full text)
+    """
+    html_text = decode_html(data) if isinstance(data, bytes) else data
+    # lxml rejects str input that carries an XML encoding declaration (XHTML, iXBRL)
+    html_text = _XML_DECLARATION.sub('', html_text, count=1)
+    if not html_text.strip():
+        return "", {}
+
+    parser = etree.HTMLParser(remove_comments=True, remove_pis=True, huge_tree=True)
+    root = etree.fromstring(html_text, parser)
+    if root is None:
+        return "", {}
+
+    pieces = []
+    length = 0
+    anchors: AnchorOffsets = {}
+    open_ids = []  # (element, id, start) of the enclosing elements with an id
+    skipping = 0   # depth inside <script>/<style>
+
+    def add(text: Optional[str]) -> None:
+        nonlocal length
+        if text and not skipping:
+            text = text.strip()
+            if text:
+                if pieces:
+                    pieces.append(' ')
+                    length += 1
+                pieces.append(text)
+                length += len(text)
+
+    for event, element in etree.iterwalk(root, events=('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            element_id = element.get('id')
+            if element_id is None and tag == 'a':
+                # Older EDGAR filings mark sections with <a name="...">
+                element_id = element.get('name')
+            if element_id is not None:
+                # The text starts after the separator of its first piece
+                open_ids.append((element, element_id, length + 1 if pieces else 0))
+            if tag in _SKIPPED_TAGS:
+                skipping += 1
+            add(element.text)
+        else:
+            if tag in _SKIPPED_TAGS:
+                skipping -= 1
+            if open_ids and open_ids[-1][0] is element:
+                _, element_id, start = open_ids.pop()
+                # Duplicate ids keep the element that closes first
+                anchors.setdefault(element_id, (min(start, length), length))
+            add(element.tail)
+
+    return ''.join(pieces), anchors
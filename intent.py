@@ -0,0 +1,181 @@
+"""
+SmartAlly - Local Intent Resolver
+Maps a chat question onto a datapoint and share class without a network call.
+Datapoints are scored with precompiled keyword patterns plus fuzzy matching
+against the Instruction column of datapoint_mapping.csv; the LLM prompt parser
+is only consulted when the resulting confidence is below a threshold.
+"""
+
+import os
+import re
+import threading
+from difflib import SequenceMatcher
+from typing import Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+import pandas as pd
+
+# Minimum confidence for the local result to be used without asking the LLM
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("SMARTALLY_INTENT_CONFIDENCE", "0.75"))
+
+# Two datapoints scoring within this margin of each other are ambiguous
+AMBIGUITY_MARGIN = 0.15
+
+# Confidence is scaled by this factor when the question names no share class
+NO_CLASS_PENALTY = 0.5
+
+_CLASS_PATTERNS = [re.compile(p) for p in (
+    r'class\s+([a-z])\b',
+    r'class\s+([a-z])\s+shares',
+    r'for\s+class\s+([a-z])',
+    r'\(class\s+([a-z])\)',
+)]
+
+# Phrases that identify a datapoint, with the confidence they carry on their own
+DATAPOINT_KEYWORDS: Dict[str, List[Tuple[str, float]]] = {
+    'TOTAL_ANNUAL_FUND_OPERATING_EXPENSES': [
+        (r'total\s+annual\s+(?:fund\s+)?operating\s+expenses?', 0.95),
+        (r'\b(?:gross|total)\s+expense\s+ratio', 0.85),
+        (r'\boperating\s+expenses?', 0.7),
+    ],
+    'NET_EXPENSES': [
+        (r'\bnet\s+expenses?', 0.95),
+        (r'\bnet\s+expense\s+ratio', 0.95),
+        (r'after\s+(?:fee\s+)?waivers?', 0.8),
+        (r'expense\s+reimbursement', 0.75),
+    ],
+    'MINIMUM_SUBSEQUENT_INVESTMENT_AIP': [
+        (r'subsequent\s+investments?.*automatic\s+investment|automatic\s+investment.*subsequent', 0.95),
+        (r'automatic\s+investment\s+plans?|\baip\b', 0.85),
+        (r'subsequent\s+investments?', 0.75),
+    ],
+    'INITIAL_INVESTMENT': [
+        (r'(?:minimum\s+)?initial\s+investments?', 0.95),
+        (r'minimum\s+(?:investment|purchase)', 0.75),
+    ],
+    'CDSC': [
+        (r'\bcdsc\b', 0.95),
+        (r'contingent\s+deferred\s+sales\s+charges?', 0.95),
+        (r'deferred\s+sales\s+(?:charge|load)', 0.85),
+    ],
+    'REDEMPTION_FEE': [
+        (r'redemption\s+fees?', 0.95),
+        (r'(?:short[-\s]term\s+)?trading\s+fees?', 0.7),
+    ],
+}
+
+
+class Intent(NamedTuple):
+    """Resolved datapoint and share class with a confidence in [0, 1]."""
+    datapoint: Optional[str]
+    class_name: Optional[str]
+    confidence: float
+
+
+def extract_share_class(prompt: str) -> Optional[str]:
+    """Return the share class named in a question as "Class X", or None."""
+    prompt_lower = prompt.lower()
+    for pattern in _CLASS_PATTERNS:
+        match = pattern.search(prompt_lower)
+        if match:
+            return f"Class {match.group(1).upper()}"
+    return None
+
+
+def _normalize(text: str) -> str:
+    text = text.lower().replace('{class}', ' ')
+    for pattern in _CLASS_PATTERNS:
+        text = pattern.sub(' ', text)
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+class IntentClassifier:
+    """Keyword and fuzzy scorer built once per datapoint mapping."""
+
+    def __init__(self, mapping_df: pd.DataFrame):
+        self.datapoints: List[str] = mapping_df['Datapoint'].unique().tolist()
+
+        self._name_patterns: Dict[str, Pattern] = {}
+        self._keywords: Dict[str, List[Tuple[Pattern, float]]] = {}
+        for datapoint in self.datapoints:
+            words = r'[\s_]+'.join(re.escape(w) for w in datapoint.lower().split('_'))
+            self._name_patterns[datapoint] = re.compile(rf'\b{words}\b')
+            self._keywords[datapoint] = [
+                (re.compile(pattern), weight) for pattern, weight in DATAPOINT_KEYWORDS.get(datapoint, [])
+            ]
+
+        self._instructions: List[Tuple[str, str]] = [
+            (row['Datapoint'], _normalize(row['Instruction'])) for _, row in mapping_df.iterrows()
+        ]
+
+    def score_datapoints(self, prompt: str) -> List[Tuple[str, float]]:
+        """
+        Score every datapoint against a question.
+
+        Returns:
+            List of (datapoint, score), best first
+        """
+        prompt_lower = prompt.lower()
+        normalized = _normalize(prompt)
+
+        scores = dict.fromkeys(self.datapoints, 0.0)
+        for datapoint in self.datapoints:
+            if self._name_patterns[datapoint].search(prompt_lower):
+                scores[datapoint] = 1.0
+                continue
+            for pattern, weight in self._keywords[datapoint]:
+                if weight > scores[datapoint] and pattern.search(prompt_lower):
+                    scores[datapoint] = weight
+
+        # Fuzzy similarity to the mapping instructions
+        if normalized:
+            for datapoint, instruction in self._instructions:
+                ratio = SequenceMatcher(None, normalized, instruction).ratio()
+                scores[datapoint] = max(scores[datapoint], ratio)
+
+        return sorted(scores.items(), key=lambda item: -item[1])
+
+    def classify(self, prompt: str) -> Intent:
+        """
+        Resolve a question to a datapoint and share class.
+
+        Args:
+            prompt: User's natural language prompt
+
+        Returns:
+            Intent; confidence is lowered when the best datapoint is ambiguous
+            or no share class is named
+        """
+        class_name = extract_share_class(prompt)
+        ranked = self.score_datapoints(prompt)
+        if not ranked or ranked[0][1] <= 0:
+            return Intent(None, class_name, 0.0)
+
+        datapoint, confidence = ranked[0]
+        if len(ranked) > 1:
+            gap = ranked[0][1] - ranked[1][1]
+            if gap < AMBIGUITY_MARGIN:
+                # Halve confidence for a tie, less as the runner-up falls behind
+                confidence *= 0.5 + gap / (2 * AMBIGUITY_MARGIN)
+        if class_name is None:
+            confidence *= NO_CLASS_PENALTY
+        return Intent(datapoint, class_name, round(confidence, 3))
+
+
+# Classifiers are cached per mapping (the app re-reads the CSV on every rerun)
+_classifiers: Dict[tuple, IntentClassifier] = {}
+_classifiers_lock = threading.Lock()
+
+
+def get_intent_classifier(mapping_df: pd.DataFrame) -> IntentClassifier:
+    """Return the classifier for a datapoint mapping, building it on first use."""
+    key = tuple(zip(mapping_df['Instruction'], mapping_df['Datapoint']))
+    with _classifiers_lock:
+        classifier = _classifiers.get(key)
+        if classifier is None:
+            classifier = _classifiers[key] = IntentClassifier(mapping_df)
+        return classifier
+
+
+def resolve_intent(prompt: str, mapping_df: pd.DataFrame) -> Intent:
+    """Classify a question with the cached classifier for its mapping."""
+    return get_intent_classifier(mapping_df).classify(prompt)
@@ -0,0 +1,201 @@
+"""
+SmartAlly - LLM Response Cache
+Two-tier cache for LLM extraction results: an in-memory LRU in front of a local
+SQLite database. Keys combine the document content hash, datapoint, share class,
+model and prompt template version, so changing OPENAI_MODEL or the prompt never
+serves stale answers; entries also expire after a TTL.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+LLM_CACHE_PATH = os.getenv("SMARTALLY_LLM_CACHE_PATH", os.path.join(".smartally_cache", "llm.sqlite3"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("SMARTALLY_LLM_CACHE_TTL_HOURS", "168"))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("SMARTALLY_LLM_CACHE_MEMORY_ENTRIES", "1024"))
+
+
+def make_cache_key(doc_hash: str, datapoint: str, class_name: str,
+                   model: str, prompt_version: str) -> str:
+    """Build a stable cache key for one extraction request."""
+    raw = json.dumps([doc_hash, datapoint, class_name, model, prompt_version])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """In-memory LRU tier backed by a SQLite tier, with TTL and hit/miss counters."""
+
+    def __init__(self, db_path: Optional[str] = LLM_CACHE_PATH,
+                 ttl_seconds: float = LLM_CACHE_TTL_HOURS * 3600,
+                 memory_entries: int = LLM_CACHE_MEMORY_ENTRIES):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        # key -> (created, JSON text): every hit gets its own copy to modify
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # ------------------------------------------------------------------
+    # SQLite tier
+    # ------------------------------------------------------------------
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """Open the SQLite tier lazily; None disables it (e.g. read-only disk)."""
+        if self._conn is None and self.db_path:
+            try:
+                directory = os.path.dirname(self.db_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    " key TEXT PRIMARY KEY,"
+                    " model TEXT NOT NULL,"
+                    " prompt_version TEXT NOT NULL,"
+                    " created REAL NOT NULL,"
+                    " value TEXT NOT NULL)"
+                )
+                conn.commit()
+                self._conn = conn
+            except (OSError, sqlite3.Error):
+                self.db_path = None
+        return self._conn
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached result.
+
+        Returns:
+            A fresh copy of the cached result dictionary (callers may modify
+            it), or None on a miss or expired entry
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, text = entry
+                if now - created <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return json.loads(text)
+                del self._memory[key]
+
+            conn = self._db()
+            if conn is not None:
+                try:
+                    row = conn.execute(
+                        "SELECT created, value FROM responses WHERE key = ?", (key,)
+                    ).fetchone()
+                except sqlite3.Error:
+                    row = None
+                if row is not None and now - row[0] <= self.ttl_seconds:
+                    self._remember(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return json.loads(row[1])
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Dict[str, Any], model: str, prompt_version: str) -> None:
+        """Store a result in both tiers."""
+        created = time.time()
+        text = json.dumps(value)
+        with self._lock:
+            self._remember(key, created, text)
+            conn = self._db()
+            if conn is not None:
+                try:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO responses (key, model, prompt_version, created, value)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        (key, model, prompt_version, created, text),
+                    )
+                    conn.commit()
+                except sqlite3.Error:
+                    pass
+
+    def invalidate_stale(self, model: str, prompt_version: str) -> int:
+        """
+        Delete entries produced by a different model or prompt template version,
+        plus anything past its TTL.
+
+        Returns:
+            Number of rows removed from the SQLite tier
+        """
+        with self._lock:
+            self._memory.clear()
+            conn = self._db()
+            if conn is None:
+                return 0
+            try:
+                cursor = conn.execute(
+                    "DELETE FROM responses WHERE model != ? OR prompt_version != ? OR created < ?",
+                    (model, prompt_version, time.time() - self.ttl_seconds),
+                )
+                conn.commit()
+                return cursor.rowcount
+            except sqlite3.Error:
+                return 0
+
+    def clear(self) -> None:
+        """Remove every cached result."""
+        with self._lock:
+            self._memory.clear()
+            conn = self._db()
+            if conn is not None:
+                try:
+                    conn.execute("DELETE FROM responses")
+                    conn.commit()
+                except sqlite3.Error:
+                    pass
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters since start-up."""
+        hits = self.memory_hits + self.disk_hits
+        return {
+            'hits': hits,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
+
+    def _remember(self, key: str, created: float, text: str) -> None:
+        self._memory[key] = (created, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+
+# Process-wide cache shared by every session (Streamlit re-executes the app
+# script on each interaction, so the instance must live in this module)
+_shared_cache: Optional[LLMCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_cache(model: str, prompt_version: str) -> LLMCache:
+    """
+    Return the process-wide LLM cache, creating it on first use.
+
+    Entries from other models or prompt template versions are purged when the
+    cache is first opened, so switching OPENAI_MODEL or editing the prompt
+    invalidates old answers.
+    """
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = LLMCache()
+            _shared_cache.invalidate_stale(model, prompt_version)
+        return _shared_cache
@@ -0,0 +1,284 @@
+"""
+SmartAlly - LLM Request Scheduler
+Central admission control for OpenAI calls, shared by every session of the
+server process:
+
+- token buckets for requests and tokens per minute, so bursts queue locally
+  instead of tripping the account's rate limit; a 429 with Retry-After pauses
+  every caller, not only the one that got it
+- retries with jittered exponential backoff for rate limits, server errors and
+  dropped connections (the OpenAI client's own retries are turned off)
+- a deadline per request covering queueing, every attempt and the backoff
+  sleeps in between
+- one pooled, keep-alive httpx connection pool for the synchronous client, and
+  the same tuned limits for the shared LLM event loop's async client
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+import httpx
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Account limits to stay under: requests and tokens per minute (0 = unlimited)
+LLM_RPM = float(os.getenv("SMARTALLY_LLM_RPM", "500"))
+LLM_TPM = float(os.getenv("SMARTALLY_LLM_TPM", "90000"))
+
+# Retries of a failed call, and the backoff between them (seconds)
+LLM_MAX_RETRIES = int(os.getenv("SMARTALLY_LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("SMARTALLY_LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("SMARTALLY_LLM_BACKOFF_MAX", "20"))
+
+# Deadline of one LLM request (seconds), including queueing and retries
+LLM_CALL_TIMEOUT = float(os.getenv("SMARTALLY_LLM_TIMEOUT", "60"))
+
+# Connection pool of the OpenAI clients
+LLM_MAX_CONNECTIONS = int(os.getenv("SMARTALLY_LLM_MAX_CONNECTIONS", "32"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("SMARTALLY_LLM_KEEPALIVE", "60"))
+LLM_CONNECT_TIMEOUT = 10.0
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+T = TypeVar('T')
+
+
+class DeadlineExceeded(TimeoutError):
+    """An LLM request could not complete (or be retried) before its deadline."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at a per-minute rate.
+
+    Callers reserve their amount up front and are told how long to wait; the
+    level may go negative, so later callers queue behind earlier ones.
+    """
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self._clock = clock
+        self._level = per_minute
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take amount from the bucket; returns the seconds to wait before using it."""
+        if self.capacity <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            # A request larger than the bucket waits for a full bucket, not forever
+            self._level -= min(amount, self.capacity)
+            return max(0.0, -self._level / self.rate)
+
+    def refund(self, amount: float) -> None:
+        """Return an unused reservation."""
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level + min(amount, self.capacity))
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for at least seconds (the server said to slow down)."""
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self._level = min(self._level, -seconds * self.rate)
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """HTTP status of an OpenAI or httpx error, if it has one."""
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed call may succeed when repeated."""
+    if error_status(error) in RETRYABLE_STATUS:
+        return True
+    if isinstance(error, httpx.TransportError):
+        return True
+    # openai wraps transport errors and timeouts in APIConnectionError
+    try:
+        from openai import APIConnectionError
+    except ImportError:
+        return False
+    return isinstance(error, APIConnectionError)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked to wait (Retry-After / retry-after-ms), if any."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after') is not None:
+            return float(headers['retry-after'])
+    except ValueError:
+        # HTTP-date form: fall back to our own backoff
+        pass
+    return None
+
+
+class LLMScheduler:
+    """Rate limiting, retries and deadlines for LLM calls (sync and async)."""
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM,
+                 max_retries: int = LLM_MAX_RETRIES, backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX, deadline: float = LLM_CALL_TIMEOUT,
+                 clock: Callable[[], float] = time.monotonic):
+        self.requests = TokenBucket(rpm, clock)
+        self.tokens = TokenBucket(tpm, clock)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self._clock = clock
+        self.calls = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+
+    def _deadline_at(self, deadline: Optional[float]) -> Optional[float]:
+        seconds = self.deadline if deadline is None else deadline
+        return self._clock() + seconds if seconds and seconds > 0 else None
+
+    def _remaining(self, deadline_at: Optional[float]) -> Optional[float]:
+        return None if deadline_at is None else max(0.0, deadline_at - self._clock())
+
+    def _admit(self, tokens: int, deadline_at: Optional[float]) -> float:
+        """Reserve one request and its tokens; returns the seconds to wait."""
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        if deadline_at is not None and self._clock() + wait >= deadline_at:
+            self.requests.refund(1)
+            self.tokens.refund(tokens)
+            raise DeadlineExceeded(f"LLM rate limit queue longer than the deadline ({wait:.1f}s)")
+        self.calls += 1
+        self.throttled_seconds += wait
+        return wait
+
+    def _retry_delay(self, attempt: int, error: Exception, deadline_at: Optional[float]) -> float:
+        """
+        Backoff before retrying a failed attempt.
+
+        Raises:
+            The error itself when it is not retryable or retries are used up;
+            DeadlineExceeded when the retry could not start before the deadline
+        """
+        if not is_retryable(error) or attempt >= self.max_retries:
+            raise error
+        # Full jitter spreads out the callers that failed together
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        server_wait = retry_after(error)
+        if server_wait is not None:
+            delay = max(delay, server_wait)
+            self.requests.pause(server_wait)
+        if deadline_at is not None and self._clock() + delay >= deadline_at:
+            raise DeadlineExceeded(f"LLM request deadline reached after {attempt + 1} attempts: {error}") from error
+        self.retries += 1
+        logger.warning("LLM call failed (%s), retry %d in %.2fs", error_status(error) or type(error).__name__,
+                       attempt + 1, delay)
+        return delay
+
+    def call(self, request: Callable[[Optional[float]], T], tokens: int = 0,
+             deadline: Optional[float] = None) -> T:
+        """
+        Run a synchronous LLM request under the rate limits, with retries.
+
+        Args:
+            request: Performs one attempt; receives the seconds left before the
+                deadline (None if unbounded), to use as its timeout
+            tokens: Estimated tokens of the request (prompt plus max completion)
+            deadline: Seconds the whole request may take (default: the
+                scheduler's deadline; 0 = unbounded)
+
+        Returns:
+            The request's result
+        """
+        deadline_at = self._deadline_at(deadline)
+        attempt = 0
+        while True:
+            wait = self._admit(tokens, deadline_at)
+            if wait:
+                with tracing.span('llm_throttle', seconds=round(wait, 3)):
+                    time.sleep(wait)
+            try:
+                return request(self._remaining(deadline_at))
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, deadline_at)
+                status = error_status(e)
+            with tracing.span('llm_retry', attempt=attempt + 1, status=status):
+                time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, request: Callable[[Optional[float]], Awaitable[T]], tokens: int = 0,
+                    deadline: Optional[float] = None) -> T:
+        """Async variant of call; waits with asyncio.sleep so the event loop keeps running."""
+        deadline_at = self._deadline_at(deadline)
+        attempt = 0
+        while True:
+            wait = self._admit(tokens, deadline_at)
+            if wait:
+                with tracing.span('llm_throttle', seconds=round(wait, 3)):
+                    await asyncio.sleep(wait)
+            try:
+                return await request(self._remaining(deadline_at))
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, deadline_at)
+                status = error_status(e)
+            with tracing.span('llm_retry', attempt=attempt + 1, status=status):
+                await asyncio.sleep(delay)
+            attempt += 1
+
+
+# ============================================================================
+# Pooled OpenAI clients
+# ============================================================================
+
+def http_limits() -> httpx.Limits:
+    """Connection pool limits of the OpenAI clients."""
+    return httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                        max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                        keepalive_expiry=LLM_KEEPALIVE_SECONDS)
+
+
+def http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(LLM_CALL_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def openai_client(api_key: Optional[str], **kwargs: Any):
+    """
+    Synchronous OpenAI client on its own pooled httpx connection pool, with
+    retries left to the scheduler. Create it once and share it: the pool is
+    thread-safe and keeps connections alive across sessions.
+    """
+    from openai import OpenAI
+    http_client = httpx.Client(limits=http_limits(), timeout=http_timeout())
+    return OpenAI(api_key=api_key, http_client=http_client, max_retries=0, **kwargs)
+
+
+def async_openai_client(api_key: Optional[str], **kwargs: Any):
+    """AsyncOpenAI client with the same pool limits, bound to the current event loop."""
+    from openai import AsyncOpenAI
+    http_client = httpx.AsyncClient(limits=http_limits(), timeout=http_timeout())
+    return AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=0, **kwargs)
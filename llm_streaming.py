@@ -0,0 +1,98 @@
+"""
+SmartAlly - Streaming LLM Response Handling
+Consumes chat completion streams and incrementally parses the flat JSON objects
+SmartAlly prompts ask for, so partial field values ("value", "location", ...)
+can be shown while the completion is still arriving.
+"""
+
+import json
+import re
+from typing import Callable, Dict, Iterable, Optional
+
+# Called with the current (possibly partial) field values whenever one changes
+FieldCallback = Callable[[Dict[str, str]], None]
+
+
+class StreamingFieldParser:
+    """Extract the current values of top-level JSON string fields from a growing buffer."""
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = tuple(fields)
+        self.text = ""
+        self.values: Dict[str, str] = {}
+        self._patterns = {
+            field: re.compile(rf'"{re.escape(field)}"\s*:\s*(?:"((?:[^"\\]|\\.)*)("?)|(null|-?\d[\d.]*))')
+            for field in self.fields
+        }
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Append streamed text and re-read the tracked fields.
+
+        Returns:
+            True if any field value changed
+        """
+        if not chunk:
+            return False
+        self.text += chunk
+
+        changed = False
+        for field, pattern in self._patterns.items():
+            match = pattern.search(self.text)
+            if not match:
+                continue
+            if match.group(3) is not None:
+                value = "" if match.group(3) == "null" else match.group(3)
+            else:
+                value = _decode_partial_string(match.group(1), complete=bool(match.group(2)))
+            if self.values.get(field) != value:
+                self.values[field] = value
+                changed = True
+        return changed
+
+
+def _decode_partial_string(raw: str, complete: bool) -> str:
+    """Decode JSON string escapes, tolerating a string cut off mid-escape."""
+    if not complete:
+        # Drop a dangling escape sequence at the end of the chunk
+        raw = re.sub(r'\\(u[0-9a-fA-F]{0,3})?$', '', raw)
+    try:
+        return json.loads(f'"{raw}"')
+    except ValueError:
+        return raw
+
+
+def delta_text(chunk) -> str:
+    """Return the text delta of a chat completion stream chunk (empty if none)."""
+    choices = getattr(chunk, 'choices', None)
+    if not choices:
+        return ""
+    return getattr(choices[0].delta, 'content', None) or ""
+
+
+def consume_stream(stream, parser: StreamingFieldParser,
+                   on_update: Optional[FieldCallback] = None) -> str:
+    """
+    Read a synchronous completion stream to the end.
+
+    Returns:
+        The complete response text
+    """
+    for chunk in stream:
+        if parser.feed(delta_text(chunk)) and on_update:
+            on_update(dict(parser.values))
+    return parser.text
+
+
+async def consume_stream_async(stream, parser: StreamingFieldParser,
+                               on_update: Optional[FieldCallback] = None) -> str:
+    """
+    Read an async completion stream to the end.
+
+    Returns:
+        The complete response text
+    """
+    async for chunk in stream:
+        if parser.feed(delta_text(chunk)) and on_update:
+            on_update(dict(parser.values))
+    return parser.text
@@ -0,0 +1,144 @@
+"""
+SmartAlly - Persistent Parse Cache
+Content-addressed on-disk cache of parsed documents. Entries are keyed by the
+SHA-256 of the document bytes plus the parser version, stored as compressed
+marshal payloads, and evicted least-recently-used once the cache directory
+grows past its size bound. The cache survives restarts and is shared by every
+session on the server.
+"""
+
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import zlib
+from typing import Any, Dict, Optional
+
+# Bump whenever the structure or content of parsed documents changes so that
+# stale cache entries are never served.
+PARSER_VERSION = "12"
+
+PARSE_CACHE_DIR = os.getenv("SMARTALLY_PARSE_CACHE_DIR", os.path.join(".smartally_cache", "parse"))
+PARSE_CACHE_MAX_MB = int(os.getenv("SMARTALLY_PARSE_CACHE_MAX_MB", "512"))
+
+# Entry header: magic, then the interpreter tag (marshal is interpreter-specific)
+_MAGIC = b"SAPC1"
+_HEADER = _MAGIC + sys.implementation.cache_tag.encode() + b"\n"
+
+# Keys that are never written to disk (the raw bytes are already in hand)
+_EXCLUDED_KEYS = ('file_bytes',)
+
+
+def content_hash(data: bytes) -> str:
+    """Return the SHA-256 hex digest of the document bytes."""
+    return hashlib.sha256(memoryview(data)).hexdigest()
+
+
+class ParseCache:
+    """Size-bounded, LRU-evicted directory of parsed documents."""
+
+    def __init__(self, directory: str = PARSE_CACHE_DIR,
+                 max_bytes: int = PARSE_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def make_key(self, doc_hash: str, doc_type: str) -> str:
+        """Build the cache key for a document hash, type and the current parser version."""
+        return f"{doc_hash}-{doc_type}-v{PARSER_VERSION}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.bin")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Load a parsed document from the cache.
+
+        Args:
+            key: Cache key from make_key()
+
+        Returns:
+            The parsed document dictionary (without 'file_bytes'), or None on a
+            miss or an unreadable entry
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+        except OSError:
+            return None
+
+        if not blob.startswith(_HEADER):
+            return None
+
+        try:
+            payload = marshal.loads(zlib.decompress(blob[len(_HEADER):]))
+        except (ValueError, EOFError, TypeError, zlib.error):
+            return None
+
+        # Mark as recently used for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return payload
+
+    def put(self, key: str, doc_data: Dict[str, Any]) -> None:
+        """
+        Store a parsed document and evict old entries if over the size bound.
+
+        Args:
+            key: Cache key from make_key()
+            doc_data: Parsed document dictionary
+        """
+        payload = {k: v for k, v in doc_data.items() if k not in _EXCLUDED_KEYS}
+        try:
+            blob = _HEADER + zlib.compress(marshal.dumps(payload), 6)
+        except ValueError:
+            # Payload holds a type marshal cannot encode; skip caching it
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temp file and rename so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the cache fits its size bound."""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.bin'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes:
+                break
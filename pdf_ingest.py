@@ -0,0 +1,358 @@
+"""
+SmartAlly - PDF Ingest and Parallel Parsing Engine
+Reads an uploaded PDF once and produces page text, tables and page metadata in
+a single pass. The page range is sharded across a process pool so that PyMuPDF
+text extraction and pdfplumber table extraction use every available core on
+large prospectuses, then the per-page results are merged back in page order.
+Table extraction, by far the slowest step, can be gated on trigger phrases in
+the page text; the skipped pages are extracted later, on demand.
+"""
+
+import io
+import multiprocessing
+import os
+import pickle
+import re
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF
+import pdfplumber
+
+# Number of worker processes used for parsing (0 = one per CPU core, 1 = serial)
+PARSE_WORKERS = int(os.getenv("SMARTALLY_PARSE_WORKERS", "0"))
+
+# Smallest page range handed to a single worker; documents shorter than two
+# shards are parsed serially because pool start-up would dominate.
+MIN_PAGES_PER_SHARD = int(os.getenv("SMARTALLY_MIN_PAGES_PER_SHARD", "8"))
+
+# Only extract tables on pages matching a trigger phrase (and the page after);
+# the remaining pages are extracted on demand
+LAZY_TABLES = os.getenv("SMARTALLY_LAZY_TABLES", "1") == "1"
+
+# Phrases (|-separated) marking pages with the tables the extractors use:
+# fee tables, minimum investment tables and CDSC schedules
+TABLE_TRIGGER_PHRASES = tuple(
+    phrase.strip() for phrase in os.getenv(
+        "SMARTALLY_TABLE_TRIGGERS",
+        "Annual Fund Operating Expenses|Fees and Expenses|Minimum Investment|Contingent Deferred"
+    ).split('|') if phrase.strip()
+)
+
+PageTexts = Dict[int, str]
+PageTables = Dict[int, List[List[List[str]]]]
+PageMeta = Dict[int, Dict[str, float]]
+
+# Document bytes for the current pool, installed once per worker process
+_worker_pdf_bytes: Optional[bytes] = None
+
+
+# ============================================================================
+# Worker Functions
+# ============================================================================
+
+def _init_worker(pdf_bytes: bytes) -> None:
+    """Store the shared document bytes in the worker process."""
+    global _worker_pdf_bytes
+    _worker_pdf_bytes = pdf_bytes
+
+
+@lru_cache(maxsize=8)
+def _trigger_pattern(phrases: Tuple[str, ...]) -> "re.Pattern":
+    """Case-insensitive pattern matching any phrase across line breaks."""
+    alternatives = [r'\s+'.join(re.escape(word) for word in phrase.split()) for phrase in phrases]
+    return re.compile('|'.join(alternatives), re.IGNORECASE)
+
+
+def _extract_page_tables(pdf: "pdfplumber.PDF", page_numbers, tables_by_page: PageTables) -> None:
+    """Extract the tables of the given 1-indexed pages into tables_by_page."""
+    for page_num in page_numbers:
+        page = pdf.pages[page_num - 1]
+        tables = page.extract_tables()
+        if tables:
+            tables_by_page[page_num] = tables
+        # Release the cached layout objects of pages we are done with
+        page.flush_cache()
+
+
+def _parse_page_range(start: int, end: int, include_text: bool = True,
+                      include_tables: bool = True, pdf_bytes: Optional[bytes] = None,
+                      table_triggers: Optional[Tuple[str, ...]] = None
+                      ) -> Tuple[PageTexts, PageTables, PageMeta, List[int]]:
+    """
+    Parse pages ``start`` (inclusive) to ``end`` (exclusive), 0-indexed.
+
+    Args:
+        start: First page index of the shard
+        end: Page index one past the last page of the shard
+        include_text: Whether to extract page text with PyMuPDF
+        include_tables: Whether to extract tables with pdfplumber
+        pdf_bytes: Document bytes; defaults to the bytes installed in the worker
+        table_triggers: If given, tables are only extracted on pages whose text
+            (or the previous page's, for tables continued over a page break)
+            contains one of these phrases
+
+    Returns:
+        Tuple of (page number -> text, page number -> tables,
+        page number -> page metadata, page numbers whose tables were skipped),
+        1-indexed
+    """
+    data = pdf_bytes if pdf_bytes is not None else _worker_pdf_bytes
+    pages_text: PageTexts = {}
+    tables_by_page: PageTables = {}
+    page_meta: PageMeta = {}
+    table_pages = list(range(start + 1, end + 1))
+    skipped: List[int] = []
+
+    gated = include_tables and bool(table_triggers)
+    if include_text or gated:
+        doc = fitz.open(stream=data, filetype="pdf")
+        try:
+            if gated:
+                pattern = _trigger_pattern(table_triggers)
+                previous_hit = start > 0 and bool(pattern.search(doc[start - 1].get_text()))
+                table_pages = []
+            for page_num in range(start, end):
+                page = doc[page_num]
+                text = page.get_text()
+                if include_text:
+                    pages_text[page_num + 1] = text
+                    page_meta[page_num + 1] = {
+                        'width': page.rect.width,
+                        'height': page.rect.height,
+                        'rotation': page.rotation,
+                    }
+                if gated:
+                    hit = bool(pattern.search(text))
+                    (table_pages if hit or previous_hit else skipped).append(page_num + 1)
+                    previous_hit = hit
+        finally:
+            doc.close()
+
+    if include_tables and table_pages:
+        with pdfplumber.open(io.BytesIO(data)) as pdf:
+            _extract_page_tables(pdf, table_pages, tables_by_page)
+
+    return pages_text, tables_by_page, page_meta, skipped
+
+
+def _parse_table_pages(page_numbers: Sequence[int], pdf_bytes: Optional[bytes] = None) -> PageTables:
+    """Extract the tables of a list of 1-indexed pages (lazy table loading)."""
+    data = pdf_bytes if pdf_bytes is not None else _worker_pdf_bytes
+    tables_by_page: PageTables = {}
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        _extract_page_tables(pdf, page_numbers, tables_by_page)
+    return tables_by_page
+
+
+# ============================================================================
+# Sharding and Scheduling
+# ============================================================================
+
+def read_document_metadata(pdf_bytes: bytes) -> Tuple[int, Dict[str, Any]]:
+    """Return the page count and document information dictionary of a PDF."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return len(doc), dict(doc.metadata or {})
+    finally:
+        doc.close()
+
+
+def resolve_worker_count(page_count: int, workers: Optional[int] = None) -> int:
+    """
+    Decide how many worker processes to use for a document.
+
+    Args:
+        page_count: Number of pages in the document
+        workers: Requested worker count (None uses SMARTALLY_PARSE_WORKERS,
+            0 means one per CPU core)
+
+    Returns:
+        Worker count; 1 means the document is parsed serially
+    """
+    if workers is None:
+        workers = PARSE_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+
+    max_useful = page_count // max(MIN_PAGES_PER_SHARD, 1)
+    return max(1, min(workers, max_useful))
+
+
+def shard_pages(page_count: int, workers: int) -> List[Tuple[int, int]]:
+    """
+    Split ``range(page_count)`` into contiguous ``(start, end)`` shards.
+
+    Uses a few shards per worker so that pages with heavy tables do not leave
+    the other workers idle at the end of the run.
+    """
+    if page_count <= 0:
+        return []
+
+    target_shards = max(workers * 4, 1)
+    shard_size = max(MIN_PAGES_PER_SHARD, -(-page_count // target_shards))
+    return [(start, min(start + shard_size, page_count))
+            for start in range(0, page_count, shard_size)]
+
+
+def mp_context():
+    """Use forkserver where available: forking the threaded Streamlit server directly is unsafe."""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _parse_all_pages(pdf_bytes: bytes, page_count: int, workers: Optional[int],
+                     include_text: bool, include_tables: bool,
+                     table_triggers: Optional[Tuple[str, ...]] = None
+                     ) -> Tuple[PageTexts, PageTables, PageMeta, List[int]]:
+    """Run the page parser over every page, in parallel when worthwhile."""
+    worker_count = resolve_worker_count(page_count, workers)
+
+    if worker_count <= 1:
+        return _parse_page_range(0, page_count, include_text, include_tables, pdf_bytes, table_triggers)
+
+    shards = shard_pages(page_count, worker_count)
+    try:
+        with ProcessPoolExecutor(max_workers=worker_count, mp_context=mp_context(),
+                                 initializer=_init_worker, initargs=(pdf_bytes,)) as pool:
+            futures = [pool.submit(_parse_page_range, start, end, include_text, include_tables,
+                                   None, table_triggers)
+                       for start, end in shards]
+            shard_results = [future.result() for future in futures]
+    except (BrokenProcessPool, OSError, pickle.PicklingError):
+        # Pool could not be started or a worker died: fall back to serial parsing
+        return _parse_page_range(0, page_count, include_text, include_tables, pdf_bytes, table_triggers)
+
+    # Shards are contiguous and submitted in order, so merging keeps page order
+    pages_text: PageTexts = {}
+    tables_by_page: PageTables = {}
+    page_meta: PageMeta = {}
+    skipped: List[int] = []
+    for shard_text, shard_tables, shard_meta, shard_skipped in shard_results:
+        pages_text.update(shard_text)
+        tables_by_page.update(shard_tables)
+        page_meta.update(shard_meta)
+        skipped.extend(shard_skipped)
+
+    return pages_text, tables_by_page, page_meta, skipped
+
+
+def parse_pdf_bytes(pdf_bytes: bytes, workers: Optional[int] = None,
+                    include_text: bool = True,
+                    include_tables: bool = True) -> Tuple[PageTexts, PageTables]:
+    """
+    Extract page text and tables from a PDF, in parallel when worthwhile.
+
+    Args:
+        pdf_bytes: Raw PDF bytes
+        workers: Worker process count (None = SMARTALLY_PARSE_WORKERS, 1 = serial)
+        include_text: Whether to extract page text
+        include_tables: Whether to extract tables
+
+    Returns:
+        Tuple of (page number -> text, page number -> tables), 1-indexed and
+        ordered by page
+    """
+    page_count, _ = read_document_metadata(pdf_bytes)
+    pages_text, tables_by_page, _, _ = _parse_all_pages(
+        pdf_bytes, page_count, workers, include_text, include_tables
+    )
+    return pages_text, tables_by_page
+
+
+def read_upload(file) -> bytes:
+    """
+    Read an uploaded file exactly once.
+
+    Streamlit uploads are BytesIO objects, whose ``getvalue()`` hands back the
+    underlying buffer without copying it and without moving the stream
+    position. The returned bytes object is then shared by every consumer.
+    """
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    data = file.read()
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return data
+
+
+def ingest_pdf(pdf_bytes: bytes, workers: Optional[int] = None,
+               table_triggers: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    Parse a PDF in a single pipeline pass.
+
+    Text, tables and page metadata for each page range are produced by the same
+    worker, so the document bytes are handed to the parser once and never
+    re-read from the upload.
+
+    Args:
+        pdf_bytes: Raw PDF bytes (shared, not copied)
+        workers: Worker process count (None = SMARTALLY_PARSE_WORKERS, 1 = serial)
+        table_triggers: Only extract tables on pages containing one of these
+            phrases (see TABLE_TRIGGER_PHRASES); None extracts every page
+
+    Returns:
+        Parsed document dictionary with 'type', 'pages', 'tables',
+        'tables_pending' (pages whose tables were skipped, see
+        load_pending_tables), 'page_meta', 'metadata', 'page_count' and
+        'file_bytes'
+    """
+    page_count, metadata = read_document_metadata(pdf_bytes)
+    pages_text, tables_by_page, page_meta, skipped = _parse_all_pages(
+        pdf_bytes, page_count, workers, include_text=True, include_tables=True,
+        table_triggers=tuple(table_triggers) if table_triggers else None
+    )
+
+    return {
+        'type': 'pdf',
+        'pages': pages_text,
+        'tables': tables_by_page,
+        'tables_pending': skipped,
+        'page_meta': page_meta,
+        'metadata': metadata,
+        'page_count': page_count,
+        'file_bytes': pdf_bytes,
+    }
+
+
+def load_pending_tables(doc_data: Dict[str, Any], workers: Optional[int] = None) -> PageTables:
+    """
+    Extract the tables skipped by a keyword-gated ingest (see ingest_pdf).
+
+    The document's 'tables' are replaced by the merged, page-ordered tables
+    and 'tables_pending' is emptied.
+
+    Args:
+        doc_data: Parsed PDF document with 'file_bytes'
+        workers: Worker process count (None = SMARTALLY_PARSE_WORKERS, 1 = serial)
+
+    Returns:
+        The newly extracted tables, by page number
+    """
+    pending = list(doc_data.get('tables_pending') or [])
+    if not pending:
+        return {}
+    # Spilled documents are read back from their mapping (fitz and pickling need bytes)
+    pdf_bytes = bytes(doc_data['file_bytes'])
+
+    worker_count = resolve_worker_count(len(pending), workers)
+    new_tables: PageTables = {}
+    if worker_count <= 1:
+        new_tables = _parse_table_pages(pending, pdf_bytes)
+    else:
+        chunks = [pending[start:end] for start, end in shard_pages(len(pending), worker_count)]
+        try:
+            with ProcessPoolExecutor(max_workers=worker_count, mp_context=mp_context(),
+                                     initializer=_init_worker, initargs=(pdf_bytes,)) as pool:
+                for shard_tables in pool.map(_parse_table_pages, chunks):
+                    new_tables.update(shard_tables)
+        except (BrokenProcessPool, OSError, pickle.PicklingError):
+            new_tables = _parse_table_pages(pending, pdf_bytes)
+
+    merged = dict(doc_data.get('tables', {}))
+    merged.update(new_tables)
+    doc_data['tables'] = dict(sorted(merged.items()))
+    doc_data['tables_pending'] = []
+    return new_tables
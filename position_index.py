@@ -0,0 +1,166 @@
+"""
+SmartAlly - Positional Token Index
+Per-document index of normalized tokens -> (page, token position) postings,
+with the character offsets of every token, built once at parse time. Used to
+attribute an extracted value to the page and character span where it appears
+next to its context phrase, in time proportional to the number of hits rather
+than the size of the document.
+"""
+
+import re
+import sys
+from array import array
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# Tokens on either side of a value hit that are checked for context words
+WINDOW_TOKENS = 40
+
+_TOKEN_RE = re.compile(r"[A-Za-z0-9$]+(?:[.,][0-9]+)*%?")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from in is it of on or that the this to with section table document".split()
+)
+
+
+class Span(NamedTuple):
+    """Location of an attributed value: page (or passage) number and character offsets."""
+    page: int
+    start: int
+    end: int
+
+
+def normalize_token(token: str) -> str:
+    """Lowercase a token and drop currency signs, thousands separators and percent signs."""
+    return token.lower().strip('$').replace(',', '').rstrip('%')
+
+
+def tokenize_with_offsets(text: str) -> List[Tuple[str, int, int]]:
+    """Return (normalized token, start, end) for every token of a text."""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        token = normalize_token(match.group())
+        if token:
+            tokens.append((sys.intern(token), match.start(), match.end()))
+    return tokens
+
+
+def _uint_array(data: bytes) -> array:
+    flat = array('I')
+    flat.frombytes(data)
+    return flat
+
+
+def _query_tokens(text: str) -> List[str]:
+    return [token for token, _, _ in tokenize_with_offsets(text or '')]
+
+
+class PositionIndex:
+    """Positional inverted index over the pages of one document."""
+
+    def __init__(self, postings: Dict[str, "array"], tokens: Dict[int, List[str]],
+                 offsets: Dict[int, "array"]):
+        # token -> flat [page, position, page, position, ...] (unsigned int arrays,
+        # 4 bytes per entry instead of a pointer plus an int object)
+        self.postings = postings
+        # page -> token sequence, and flat [start, end, ...] offsets per position
+        self.tokens = tokens
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, pages: Dict[int, str]) -> "PositionIndex":
+        """Index every token of every page."""
+        postings: Dict[str, array] = {}
+        tokens: Dict[int, List[str]] = {}
+        offsets: Dict[int, array] = {}
+        for page_num, text in pages.items():
+            page_tokens = []
+            page_offsets = array('I')
+            for position, (token, start, end) in enumerate(tokenize_with_offsets(text)):
+                page_tokens.append(token)
+                page_offsets.extend((start, end))
+                flat = postings.get(token)
+                if flat is None:
+                    flat = postings[token] = array('I')
+                flat.extend((page_num, position))
+            tokens[page_num] = page_tokens
+            offsets[page_num] = page_offsets
+        return cls(postings, tokens, offsets)
+
+    def to_state(self) -> Dict[str, Any]:
+        """Plain-data form of the index, suitable for the parse cache."""
+        return {'postings': {token: flat.tobytes() for token, flat in self.postings.items()},
+                'tokens': self.tokens,
+                'offsets': {page_num: flat.tobytes() for page_num, flat in self.offsets.items()}}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "PositionIndex":
+        return cls({token: _uint_array(data) for token, data in state['postings'].items()},
+                   state['tokens'],
+                   {page_num: _uint_array(data) for page_num, data in state['offsets'].items()})
+
+    def _phrase_hits(self, phrase: List[str]) -> List[Tuple[int, int]]:
+        """(page, position of first token) of every occurrence of a token sequence."""
+        anchor = min(range(len(phrase)), key=lambda i: len(self.postings.get(phrase[i], ())))
+        flat = self.postings.get(phrase[anchor], ())
+        hits = []
+        for i in range(0, len(flat), 2):
+            page_num, position = flat[i], flat[i + 1] - anchor
+            page_tokens = self.tokens[page_num]
+            if position >= 0 and page_tokens[position:position + len(phrase)] == phrase:
+                hits.append((page_num, position))
+        return hits
+
+    def _span(self, page_num: int, first: int, last: int) -> Span:
+        offsets = self.offsets[page_num]
+        return Span(page_num, offsets[2 * first], offsets[2 * last + 1])
+
+    def locate(self, value: str, context: str = '', window: int = WINDOW_TOKENS) -> Optional[Span]:
+        """
+        Find where an extracted value appears, preferring occurrences surrounded
+        by its context phrase.
+
+        Args:
+            value: Extracted value (e.g. "1.10%", "$2,500", "No minimum")
+            context: Phrase the value was found in (LLM context or rule location)
+            window: Tokens on either side of a hit searched for context words
+
+        Returns:
+            Span of the best occurrence of the value; if the value does not occur
+            verbatim, the span of the densest cluster of context words; None if
+            neither is found
+        """
+        value_tokens = _query_tokens(value)
+        context_tokens = {t for t in _query_tokens(context) if t not in _STOPWORDS} - set(value_tokens)
+
+        if value_tokens:
+            best = None
+            for page_num, position in self._phrase_hits(value_tokens):
+                page_tokens = self.tokens[page_num]
+                nearby = page_tokens[max(0, position - window):position + len(value_tokens) + window]
+                score = len(context_tokens.intersection(nearby))
+                if best is None or score > best[0]:
+                    best = (score, page_num, position)
+            if best is not None:
+                _, page_num, position = best
+                return self._span(page_num, position, position + len(value_tokens) - 1)
+
+        if not context_tokens:
+            return None
+
+        # Value not verbatim in the text: anchor on the rarest context word
+        anchor = min(context_tokens, key=lambda t: len(self.postings.get(t, ())))
+        flat = self.postings.get(anchor, ())
+        best = None
+        for i in range(0, len(flat), 2):
+            page_num, position = flat[i], flat[i + 1]
+            page_tokens = self.tokens[page_num]
+            lo = max(0, position - window)
+            matched = [lo + j for j, token in enumerate(page_tokens[lo:position + window + 1])
+                       if token in context_tokens]
+            score = len({page_tokens[p] for p in matched})
+            if best is None or score > best[0]:
+                best = (score, page_num, matched[0], matched[-1])
+        if best is None or best[0] < min(2, len(context_tokens)):
+            return None
+        _, page_num, first, last = best
+        return self._span(page_num, first, last)
@@ -0,0 +1,148 @@
+"""
+SmartAlly - Background Prefetch
+Optional precomputation of every answer a document can give. Right after a
+document is parsed, a background worker extracts every datapoint of the
+datapoint mapping for every share class found in the document (see
+batch.extract_document_answers). Chat questions are answered from these results
+as soon as they are ready, instead of paying the extraction latency.
+
+Jobs are process-wide and keyed by document content hash and extraction method,
+so a document opened by several sessions is precomputed once. This module must
+not import Streamlit.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import batch
+import extraction
+from batch import Answer
+
+logger = logging.getLogger(__name__)
+
+# Whether documents are precomputed after upload by default
+PREFETCH_DEFAULT = os.getenv("SMARTALLY_PREFETCH", "0") == "1"
+
+# Background worker threads shared by all sessions
+PREFETCH_WORKERS = int(os.getenv("SMARTALLY_PREFETCH_WORKERS", "2"))
+
+# Finished jobs kept (least recently used are dropped; each holds one small table)
+_MAX_JOBS = 256
+
+
+class PrefetchJob:
+    """Precomputed answers of one document, filled in by a background worker."""
+
+    def __init__(self, method: str):
+        self.method = method
+        # queued -> running -> done | failed
+        self.state = 'queued'
+        self.classes: List[str] = []
+        self.total = 0
+        self.answers: Dict[Tuple[str, str], Answer] = {}
+        self.errors: List[str] = []
+        self.future: Optional[Future] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in ('done', 'failed')
+
+    @property
+    def progress(self) -> float:
+        """Fraction of the answers computed (0.0 - 1.0)."""
+        if self.done:
+            return 1.0
+        return len(self.answers) / self.total if self.total else 0.0
+
+    def answer(self, datapoint_name: str, class_name: str) -> Optional[Answer]:
+        """The precomputed answer, or None if it is not (yet) available."""
+        return self.answers.get((datapoint_name, class_name))
+
+
+_jobs: "OrderedDict[Tuple[str, str], PrefetchJob]" = OrderedDict()
+_jobs_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _method(use_llm: bool) -> str:
+    return 'llm' if use_llm and extraction.client is not None else 'rules'
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, PREFETCH_WORKERS),
+                                       thread_name_prefix='smartally-prefetch')
+    return _executor
+
+
+def get_prefetch(doc_data: dict, use_llm: bool) -> Optional[PrefetchJob]:
+    """The prefetch job of a document for an extraction mode, if one was started."""
+    with _jobs_lock:
+        return _jobs.get((doc_data.get('sha256'), _method(use_llm)))
+
+
+def start_prefetch(doc_data: dict, mapping_df: pd.DataFrame, use_llm: bool) -> PrefetchJob:
+    """
+    Precompute every datapoint x share class answer of a document in the background.
+
+    Starting a document that is already queued, running or done returns its
+    existing job; a failed job is started again.
+
+    Args:
+        doc_data: Parsed document (see extraction.ingest_document)
+        mapping_df: Datapoint mapping (datapoints and output rules)
+        use_llm: Extract with the LLM (if a client is configured) instead of rules
+
+    Returns:
+        The document's job
+    """
+    key = (doc_data['sha256'], _method(use_llm))
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is not None and job.state != 'failed':
+            _jobs.move_to_end(key)
+            return job
+        job = _jobs[key] = PrefetchJob(key[1])
+        while len(_jobs) > _MAX_JOBS:
+            _jobs.popitem(last=False)
+        job.future = _get_executor().submit(_run, job, doc_data, mapping_df)
+    return job
+
+
+def _run(job: PrefetchJob, doc_data: dict, mapping_df: pd.DataFrame) -> None:
+    """Worker: fill a job's answers."""
+    job.state = 'running'
+    datapoint_count = mapping_df['Datapoint'].nunique()
+
+    def on_classes(classes: List[str]) -> None:
+        job.classes = classes
+        job.total = len(classes) * datapoint_count
+
+    def on_answer(datapoint_name: str, class_name: str, answer: Answer) -> None:
+        job.answers[(datapoint_name, class_name)] = answer
+
+    # No session to show errors in: they are kept on the job. Several jobs run
+    # at once, so tables loaded on demand are parsed serially
+    with extraction.reporting_errors_to(job.errors.append), extraction.parsing_with_workers(1):
+        try:
+            batch.extract_document_answers(doc_data, mapping_df, use_llm=job.method == 'llm',
+                                           on_classes=on_classes, on_answer=on_answer)
+            job.state = 'done'
+        except Exception as e:
+            logger.exception("Prefetch failed for document %s", doc_data.get('sha256'))
+            job.errors.append(f"{type(e).__name__}: {e}")
+            job.state = 'failed'
+
+
+def clear_prefetch() -> None:
+    """Forget every finished job (e.g. after the LLM cache was cleared)."""
+    with _jobs_lock:
+        for key in [key for key, job in _jobs.items() if job.done]:
+            del _jobs[key]
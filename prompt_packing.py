@@ -0,0 +1,171 @@
+"""
+SmartAlly - Prompt Table Packing
+Chooses and serializes the tables sent to the LLM. Every table is scored
+against the requested datapoints and share class using the parse-time table
+index; tables with a column for the class are cut down to their label column
+and that class column, and the relevant tables are written as tab-separated
+rows, best first, until a token budget is spent. Tokens are counted with the
+model's tokenizer when tiktoken is installed, or estimated from the length.
+"""
+
+import math
+import os
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from retrieval import CHARS_PER_TOKEN, query_terms_for
+from table_index import TableIndex, class_key
+
+# Prompt budget for tables (tokens), per datapoint
+TABLE_TOKEN_BUDGET = int(os.getenv("SMARTALLY_TABLE_TOKENS", "800"))
+
+# Score weights: datapoint row label, class column, any class column, query word
+_ROW_WEIGHT = 10
+_CLASS_COLUMN_WEIGHT = 5
+_ANY_CLASS_COLUMN_WEIGHT = 1
+
+# Tables scoring below this fraction of the best table are not sent (passing
+# mentions of "net" or "total" in performance tables do not make them relevant)
+RELEVANCE_CUTOFF = 0.25
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """tiktoken encoding of the configured model, or None if tiktoken is not installed."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(os.getenv("OPENAI_MODEL", "gpt-4"))
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    """Number of prompt tokens in a text (estimated without tiktoken)."""
+    encoding = _encoding()
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def score_tables(table_index: TableIndex, datapoint_names: Sequence[str],
+                 class_name: Optional[str] = None) -> List[Tuple[int, int]]:
+    """
+    Relevance of every table to a datapoint query.
+
+    Args:
+        table_index: Index of the document's tables
+        datapoint_names: Datapoints being extracted
+        class_name: Requested share class (None for whole-document extraction)
+
+    Returns:
+        (score, table position) of the relevant tables (above zero and at
+        least RELEVANCE_CUTOFF of the best score), best first and in
+        document order on ties
+    """
+    code = class_key(class_name) if class_name else None
+    terms = set()
+    for datapoint_name in datapoint_names:
+        terms.update(query_terms_for(datapoint_name))
+
+    scored = []
+    for position, entry in enumerate(table_index.entries):
+        score = len(terms.intersection(entry.get('terms', ())))
+        score += _ROW_WEIGHT * sum(1 for name in datapoint_names if name in entry['rows'])
+        if code and code in entry['columns']:
+            score += _CLASS_COLUMN_WEIGHT
+        elif entry['columns']:
+            score += _ANY_CLASS_COLUMN_WEIGHT
+        if score > 0:
+            scored.append((score, position))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    cutoff = scored[0][0] * RELEVANCE_CUTOFF if scored else 0
+    return [(score, position) for score, position in scored if score >= cutoff]
+
+
+def _cell(value: Any) -> str:
+    return ' '.join(str(value).split()) if value is not None else ''
+
+
+def table_rows(table: Sequence[Sequence[Any]], entry: Dict[str, Any],
+               class_name: Optional[str] = None) -> List[Tuple[int, List[str]]]:
+    """
+    Rows of a table worth sending, with their row numbers: the label and class
+    columns (from the class header row down) when the table has a column for
+    the class, otherwise all columns; empty rows are dropped.
+    """
+    code = class_key(class_name) if class_name else None
+    header = entry['columns'].get(code) if code else None
+    if header is not None:
+        header_row, col_idx = header
+        rows = [(row_idx, [_cell(row[0]) if row else '', _cell(row[col_idx]) if col_idx < len(row) else ''])
+                for row_idx, row in enumerate(table) if row_idx >= header_row]
+    else:
+        rows = [(row_idx, [_cell(cell) for cell in row]) for row_idx, row in enumerate(table)]
+    return [(row_idx, cells) for row_idx, cells in rows if any(cells)]
+
+
+def _key_rows(entry: Dict[str, Any], datapoint_names: Sequence[str], class_name: Optional[str]) -> set:
+    """Row numbers kept first when a table does not fit: the header and the datapoint rows."""
+    code = class_key(class_name) if class_name else None
+    header = entry['columns'].get(code) if code else None
+    if header is None and entry['columns']:
+        header = min(entry['columns'].values())
+    key_rows = {header[0] if header else 0}
+    for datapoint_name in datapoint_names:
+        key_rows.update(entry['rows'].get(datapoint_name, ()))
+    return key_rows
+
+
+def pack_tables(tables: Sequence[Sequence[Sequence[Any]]], table_index: TableIndex,
+                datapoint_names: Iterable[str] = (), class_name: Optional[str] = None,
+                token_budget: int = TABLE_TOKEN_BUDGET) -> List[str]:
+    """
+    Serialize the most relevant tables within a token budget.
+
+    Without datapoints every table is eligible, fee tables first (see
+    TableIndex.priority_order). A table that does not fit keeps its header
+    and datapoint rows first.
+
+    Args:
+        tables: The indexed tables, in the order they were indexed
+        table_index: Index of the tables
+        datapoint_names: Datapoints being extracted
+        class_name: Requested share class; None keeps every column
+        token_budget: Maximum tokens of serialized tables
+
+    Returns:
+        One tab-separated block per table, headed "Table N (page P):"
+    """
+    datapoint_names = list(datapoint_names)
+    if datapoint_names:
+        order = [position for _, position in score_tables(table_index, datapoint_names, class_name)]
+    else:
+        order = table_index.priority_order()
+
+    blocks = []
+    used = 0
+    for position in order:
+        entry = table_index.entries[position]
+        page = entry.get('page')
+        heading = f"Table {len(blocks) + 1} (page {page}):" if page else f"Table {len(blocks) + 1}:"
+        remaining = token_budget - used - count_tokens(heading + '\n')
+
+        rows = table_rows(tables[position], entry, class_name)
+        key_rows = _key_rows(entry, datapoint_names, class_name)
+        chosen = []
+        for row_idx, cells in sorted(rows, key=lambda row: row[0] not in key_rows):
+            line = '\t'.join(cells)
+            cost = count_tokens(line + '\n')
+            if cost > remaining:
+                break
+            chosen.append((row_idx, line))
+            remaining -= cost
+        if not chosen:
+            # Not even the first row fits: the budget is spent
+            break
+        blocks.append('\n'.join([heading] + [line for _, line in sorted(chosen)]))
+        used = token_budget - remaining
+    return blocks
@@ -0,0 +1,192 @@
+"""
+SmartAlly - BM25 Page Retrieval
+Per-document inverted index over pages (or passages for HTML) scored with
+Okapi BM25. Used to pick the pages most relevant to a datapoint and share class
+within a token budget, instead of sending only the start of the document to the
+LLM.
+"""
+
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Approximate prompt budget for retrieved document text (about 4 characters per token)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("SMARTALLY_CONTEXT_TOKENS", "2000"))
+CHARS_PER_TOKEN = 4
+
+# Passage size used to split HTML documents (which have no pages) for indexing
+PASSAGE_CHARS = 3000
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*%?")
+_CLASS_RE = re.compile(r"\bclass\s+([a-z0-9]{1,3})\b")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from in is it of on or that the this to with".split()
+)
+
+# Extra vocabulary that tends to appear around each datapoint in a prospectus
+DATAPOINT_QUERY_TERMS = {
+    'TOTAL_ANNUAL_FUND_OPERATING_EXPENSES': ['annual', 'fund', 'operating', 'expenses', 'total',
+                                             'management', 'fees', 'distribution', '12b'],
+    'NET_EXPENSES': ['net', 'expenses', 'fee', 'waiver', 'reimbursement', 'after', 'total', 'annual'],
+    'MINIMUM_SUBSEQUENT_INVESTMENT_AIP': ['minimum', 'subsequent', 'investment', 'automatic',
+                                          'investment', 'plans', 'plan'],
+    'INITIAL_INVESTMENT': ['minimum', 'initial', 'investment', 'purchase', 'account'],
+    'CDSC': ['cdsc', 'contingent', 'deferred', 'sales', 'charge', 'load', 'year'],
+    'REDEMPTION_FEE': ['redemption', 'fee', 'redeemed', 'exchanged', 'days'],
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens, without stopwords, plus one ``class_x`` token for
+    every "Class X" mention so share classes can be matched as a unit.
+    """
+    lowered = text.lower()
+    tokens = [t for t in _TOKEN_RE.findall(lowered) if t not in _STOPWORDS]
+    tokens.extend(f"class_{m}" for m in _CLASS_RE.findall(lowered))
+    return tokens
+
+
+def split_passages(text: str, passage_chars: int = PASSAGE_CHARS) -> Dict[int, str]:
+    """Split a long text into numbered passages, breaking on whitespace where possible."""
+    passages = {}
+    start = 0
+    number = 1
+    while start < len(text):
+        end = min(start + passage_chars, len(text))
+        if end < len(text):
+            space = text.rfind(' ', start + passage_chars // 2, end)
+            if space != -1:
+                end = space
+        passages[number] = text[start:end]
+        number += 1
+        start = end
+    return passages
+
+
+def query_terms_for(datapoint_name: str, class_name: Optional[str] = None) -> List[str]:
+    """Build the BM25 query for a datapoint and share class."""
+    terms = [t for t in datapoint_name.lower().split('_') if t and t not in _STOPWORDS]
+    terms.extend(DATAPOINT_QUERY_TERMS.get(datapoint_name, []))
+    if class_name:
+        terms.extend(tokenize(class_name if class_name.lower().startswith('class')
+                              else f"Class {class_name}"))
+    return terms
+
+
+class PageIndex:
+    """Inverted index over the pages of one document, scored with BM25."""
+
+    def __init__(self, postings: Dict[str, Dict[int, int]], lengths: Dict[int, int]):
+        self.postings = postings
+        self.lengths = lengths
+        self.avg_length = (sum(lengths.values()) / len(lengths)) if lengths else 0.0
+
+    @classmethod
+    def build(cls, pages: Dict[int, str]) -> "PageIndex":
+        """Index every page of a document."""
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths: Dict[int, int] = {}
+        for page_num, text in pages.items():
+            counts = Counter(tokenize(text))
+            lengths[page_num] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, {})[page_num] = tf
+        return cls(postings, lengths)
+
+    def to_state(self) -> Dict[str, Any]:
+        """Plain-data form of the index, suitable for the parse cache."""
+        return {'postings': self.postings, 'lengths': self.lengths}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "PageIndex":
+        return cls(state['postings'], state['lengths'])
+
+    def score(self, query_terms: Iterable[str]) -> List[Tuple[int, float]]:
+        """
+        Score pages against a query.
+
+        Returns:
+            List of (page number, BM25 score), best first; pages with no
+            matching term are omitted
+        """
+        page_count = len(self.lengths)
+        if not page_count:
+            return []
+
+        scores: Dict[int, float] = {}
+        for term, query_tf in Counter(query_terms).items():
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (page_count - df + 0.5) / (df + 0.5))
+            for page_num, tf in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[page_num] / (self.avg_length or 1))
+                scores[page_num] = scores.get(page_num, 0.0) + \
+                    query_tf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def select_pages(self, pages: Dict[int, str], query_terms: Iterable[str],
+                     token_budget: int = CONTEXT_TOKEN_BUDGET,
+                     top_k: int = 8) -> List[int]:
+        """
+        Choose the best-scoring pages that fit in the token budget.
+
+        Returns:
+            Selected page numbers in document order
+        """
+        budget_chars = token_budget * CHARS_PER_TOKEN
+        selected = []
+        used = 0
+        for page_num, _ in self.score(query_terms)[:top_k]:
+            size = len(pages.get(page_num, ''))
+            if selected and used + size > budget_chars:
+                continue
+            selected.append(page_num)
+            used += size
+            if used >= budget_chars:
+                break
+        return sorted(selected)
+
+
+def build_context(pages: Dict[int, str], index: Optional[PageIndex], query_terms: Iterable[str],
+                  token_budget: int = CONTEXT_TOKEN_BUDGET, label: str = "Page") -> str:
+    """
+    Assemble the document text for a prompt from the most relevant pages.
+
+    Each page is prefixed with a "[Page N]" marker. Falls back to the start of
+    the document when nothing matches the query.
+
+    Args:
+        pages: Page number -> text
+        index: PageIndex over the same pages
+        query_terms: BM25 query terms
+        token_budget: Approximate number of tokens of document text to include
+        label: Marker label ("Page" for PDFs, "Passage" for HTML)
+
+    Returns:
+        Prompt-ready document text within the budget
+    """
+    budget_chars = token_budget * CHARS_PER_TOKEN
+    page_nums = index.select_pages(pages, query_terms, token_budget) if index else []
+    if not page_nums:
+        page_nums = sorted(pages)
+
+    parts = []
+    used = 0
+    for page_num in page_nums:
+        remaining = budget_chars - used
+        if remaining <= 0:
+            break
+        text = pages[page_num][:remaining]
+        parts.append(f"[{label} {page_num}]\n{text}")
+        used += len(text)
+    return "\n\n".join(parts)
@@ -0,0 +1,147 @@
+"""
+SmartAlly - Rule-Based Pattern Registry
+Regular expressions for the rule-based extractors, compiled once. Extractors
+find keyword anchors with one linear scan of the document and run the detailed
+patterns only inside bounded windows around each hit, so a lookup never
+backtracks across the whole filing, even when the value is missing.
+"""
+
+import itertools
+import re
+from functools import lru_cache
+from typing import List, Optional, Pattern, Sequence, Tuple
+
+# Characters searched before / after an anchor hit
+WINDOW_BEFORE = 1500
+WINDOW_AFTER = 1500
+
+# Upper bound on the gap a class-specific pattern may span inside a window
+MAX_GAP = 300
+
+# Runaway guard: anchor hits examined per scan
+MAX_ANCHOR_HITS = 200
+
+# Keyword anchors, one per datapoint section. Every alternative starts with a
+# literal and is matched against the lowercased text, which lets the regex
+# engine use its fast literal-prefix search instead of trying every position.
+ANCHORS = {
+    'annual_expenses': (r'total\s+annual\s+fund\s+operating',),
+    'net_expenses': (r'net\s+expense', r'after\s+fee\s+waiver'),
+    'aip': (r'automatic\s+investment\s+plans?', r'aip\b'),
+    'initial_investment': (r'initial\s+investment',),
+    'cdsc': (r'cdsc\b', r'contingent\s+deferred\s+sales\s+charge'),
+    'redemption_fee': (r'redemption\s+fee',),
+}
+_ANCHOR_REGEXES = {name: [re.compile(alt) for alt in alts] for name, alts in ANCHORS.items()}
+# Used when lowercasing changes the text length (offsets would not line up)
+_ANCHOR_FALLBACK = {name: re.compile(r'\b(?:' + '|'.join(alts) + ')', re.IGNORECASE)
+                    for name, alts in ANCHORS.items()}
+
+# Class-independent patterns
+PERCENT = re.compile(r'(\d+\.?\d*)%')
+DOLLAR = re.compile(r'\$\s*([\d,]+)')
+SUBSEQUENT = re.compile(r'subsequent', re.IGNORECASE)
+NO_MINIMUM = re.compile(r'no\s+minimum', re.IGNORECASE)
+INITIAL_VALUE = re.compile(r'Initial\s+Investment:[ \t]*([^\n]*)', re.IGNORECASE)
+PERCENT_AFTER = re.compile(r'(\d+\.?\d*)%\s+after', re.IGNORECASE)
+FIELD_SEPARATOR = re.compile(r'[:\s]+')
+CLASS_MENTION = re.compile(r'\bclass\s+[a-z]\b', re.IGNORECASE)
+
+# Class-specific templates; "{cls}" is replaced by the escaped class variation
+# and "{gap}" by the MAX_GAP bound
+CLASS_TEMPLATES = {
+    'mention': (r'{cls}', re.IGNORECASE),
+    'line_percent': (r'{cls}[^\n]{gap}?(\d+\.?\d+)%', re.IGNORECASE),
+    'cdsc_schedule': (r'{cls}[\s\S]{gap}?(\d+)\s*year[\s\S]{gap}?(\d+\.?\d*)%[\s\S]{gap}?(\d+\.?\d*)%',
+                      re.IGNORECASE),
+    'cdsc_years': (r'{cls}[\s\S]{gap}?(\d+)\s*(?:year|yr)', re.IGNORECASE),
+    'labelled': (r'{cls}:[ \t]*', re.IGNORECASE),
+    'field_value': (r'{cls}[:\s]+([^\n]*)', re.IGNORECASE),
+}
+
+
+@lru_cache(maxsize=512)
+def class_regex(template: str, class_var: str) -> Pattern:
+    """
+    Compile a class-specific template for one class variation (cached).
+
+    The class text must stand alone, so "Class A" never matches "Class AA".
+    """
+    source, flags = CLASS_TEMPLATES[template]
+    cls = rf'(?<![A-Za-z0-9]){re.escape(class_var)}(?![A-Za-z0-9])'
+    source = source.replace('{cls}', cls).replace('{gap}', f'{{0,{MAX_GAP}}}')
+    return re.compile(source, flags)
+
+
+def anchor_hits(text: str, anchor: str) -> List[Tuple[int, int]]:
+    """
+    Find the keyword hits of an anchor.
+
+    Returns:
+        (start, end) offsets of hits starting at a word boundary, in document
+        order, at most MAX_ANCHOR_HITS of them
+    """
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        return [m.span() for m in itertools.islice(_ANCHOR_FALLBACK[anchor].finditer(text), MAX_ANCHOR_HITS)]
+
+    hits = []
+    for regex in _ANCHOR_REGEXES[anchor]:
+        for match in regex.finditer(lowered):
+            start = match.start()
+            if start and lowered[start - 1].isalnum():
+                continue
+            hits.append(match.span())
+            if len(hits) >= MAX_ANCHOR_HITS * len(_ANCHOR_REGEXES[anchor]):
+                break
+    hits.sort()
+    return hits[:MAX_ANCHOR_HITS]
+
+
+def line_bounds(text: str, pos: int) -> Tuple[int, int]:
+    """Return the (start, end) offsets of the line containing pos."""
+    start = text.rfind('\n', 0, pos) + 1
+    end = text.find('\n', pos)
+    return start, len(text) if end == -1 else end
+
+
+def surrounding_lines(text: str, pos: int, before: int, after: int) -> str:
+    """Return the line containing pos plus up to `before`/`after` neighbouring lines."""
+    start, end = line_bounds(text, pos)
+    for _ in range(before):
+        if start == 0:
+            break
+        start = text.rfind('\n', 0, start - 1) + 1
+    for _ in range(after):
+        if end >= len(text):
+            break
+        next_end = text.find('\n', end + 1)
+        end = len(text) if next_end == -1 else next_end
+    return text[start:end]
+
+
+def nearest_class_mention(text: str, class_variations: Sequence[str], pos: int,
+                          window: int = WINDOW_BEFORE) -> Optional[re.Match]:
+    """
+    Find the mention of a class that opens the block containing pos.
+
+    Returns:
+        The last "Class X" label before pos (within the window) if it names
+        this class, None if it names another one. Without any "Class X" label
+        nearby, the last mention of any class variation is used instead.
+    """
+    lo = max(0, pos - window)
+    last = None
+    for last in CLASS_MENTION.finditer(text, lo, pos):
+        pass
+    if last is not None:
+        if any(class_regex('mention', v).fullmatch(last.group(0)) for v in class_variations):
+            return last
+        return None
+
+    ours = None
+    for class_var in class_variations:
+        for match in class_regex('mention', class_var).finditer(text, lo, pos):
+            if ours is None or match.start() > ours.start():
+                ours = match
+    return ours
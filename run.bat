@@ -31,6 +31,13 @@ if errorlevel 1 (
 
 echo Dependencies installed successfully
 echo.
+
+REM Headless batch extraction: run.bat batch ^<dir^|manifest^> -o results.xlsx
+if "%~1"=="batch" (
+    python smartally_cli.py %*
+    exit /b %errorlevel%
+)
+
 echo Starting SmartAlly...
 echo.
 echo The application will open in your browser at: http://localhost:8501
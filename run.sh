@@ -35,6 +35,11 @@ else
     exit 1
 fi
 
+# Headless batch extraction: ./run.sh batch <dir|manifest> -o results.xlsx
+if [ "$1" = "batch" ]; then
+    exec python3 smartally_cli.py "$@"
+fi
+
 echo ""
 echo "🚀 Starting SmartAlly..."
 echo ""
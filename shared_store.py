@@ -0,0 +1,218 @@
+"""
+SmartAlly - Shared Document Store
+Process-wide store of parsed documents, shared by every Streamlit session, and
+single-flight request coalescing.
+
+When several analysts open the same prospectus, the first session parses it
+and the others get the same parsed document (indexes, lazily loaded tables and
+extraction grid included) instead of parsing it again. Documents are kept
+least-recently-used under a memory bound. Identical work started concurrently
+(a parse of the same bytes, an LLM extraction with the same cache key) runs
+once: later callers wait for the in-flight computation and share its result.
+"""
+
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+from document_layout import PageText
+
+DOCUMENT_STORE_MAX_MB = int(os.getenv("SMARTALLY_DOCUMENT_STORE_MAX_MB", "1024"))
+
+# A parsed document takes about 7 bytes per character of text once its page
+# buffer, tables and search indexes are built (measured on synthetic prospectuses)
+_BYTES_PER_TEXT_CHAR = 8
+
+T = TypeVar('T')
+
+
+class _Abandoned(Exception):
+    """The computation a caller was waiting on was cancelled; it runs its own."""
+
+
+class SingleFlight:
+    """Runs one computation per key at a time; concurrent callers share its outcome."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        """The in-flight future for key, and whether the caller has to compute it."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _finish(self, key: Hashable, future: Future, result: Any = None,
+                error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            del self._calls[key]
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            # Cancelled or interrupted: the waiters start over
+            future.set_exception(_Abandoned())
+
+    def do(self, key: Hashable, compute: Callable[[], T]) -> T:
+        """
+        Compute a value, or wait for the identical computation already running.
+
+        Exceptions are raised to every caller that waited on the computation.
+        """
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    return future.result()
+                except _Abandoned:
+                    continue
+            try:
+                result = compute()
+            except BaseException as e:
+                self._finish(key, future, error=e)
+                raise
+            self._finish(key, future, result)
+            return result
+
+    async def ado(self, key: Hashable, compute: Callable[[], Awaitable[T]]) -> T:
+        """Async variant of do; callers on any thread or event loop are coalesced."""
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    # Shielded: a waiter timing out must not cancel the shared result
+                    return await asyncio.shield(asyncio.wrap_future(future))
+                except _Abandoned:
+                    continue
+            try:
+                result = await compute()
+            except BaseException as e:
+                self._finish(key, future, error=e)
+                raise
+            self._finish(key, future, result)
+            return result
+
+
+def document_size(doc_data: Dict[str, Any]) -> int:
+    """Approximate memory held by a parsed document (bytes)."""
+    pages = doc_data.get('pages')
+    if isinstance(pages, PageText):
+        text_chars = len(pages.text)
+    elif pages:
+        text_chars = sum(len(page_text) for page_text in pages.values())
+    else:
+        text_chars = len(doc_data.get('text', ''))
+    size = text_chars * _BYTES_PER_TEXT_CHAR
+    # Spilled (memory-mapped) bytes are not on the heap
+    if isinstance(doc_data.get('file_bytes'), bytes):
+        size += len(doc_data['file_bytes'])
+    return size
+
+
+class DocumentStore:
+    """Size-bounded, LRU-evicted map of parse cache key -> parsed document."""
+
+    def __init__(self, max_bytes: int = DOCUMENT_STORE_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._documents: "OrderedDict[str, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # Concurrent loads of the same document
+        self.loads = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a stored document, or None if it was never stored or has been evicted."""
+        with self._lock:
+            entry = self._documents.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._documents.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, doc_data: Dict[str, Any]) -> None:
+        """Store a parsed document, evicting the least recently used ones past the bound."""
+        if self.max_bytes <= 0:
+            return
+        size = document_size(doc_data)
+        with self._lock:
+            previous = self._documents.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._documents[key] = (doc_data, size)
+            self._size += size
+            # Always keep the newest document
+            while self._size > self.max_bytes and len(self._documents) > 1:
+                _, (_, evicted_size) = self._documents.popitem(last=False)
+                self._size -= evicted_size
+
+    def get_or_load(self, key: str, load: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """
+        Return a stored document, or load it once however many sessions ask at the same time.
+
+        Args:
+            key: Parse cache key of the document
+            load: Parses (or reads from the parse cache) the document
+        """
+        doc_data = self.get(key)
+        if doc_data is not None:
+            return doc_data
+
+        def load_and_store() -> Optional[Dict[str, Any]]:
+            # A load that finished just before this one started is reused
+            with self._lock:
+                entry = self._documents.get(key)
+            if entry is not None:
+                return entry[0]
+            loaded = load()
+            # Failed (empty) parses are not kept, so uploading the file again retries
+            if loaded is not None and document_size(loaded) > 0:
+                self.put(key, loaded)
+            return loaded
+
+        return self.loads.do(key, load_and_store)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._documents.clear()
+            self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    @property
+    def size(self) -> int:
+        """Approximate bytes held."""
+        return self._size
+
+    def stats(self) -> Dict[str, int]:
+        return {'documents': len(self._documents), 'bytes': self._size, 'hits': self.hits,
+                'misses': self.misses, 'coalesced': self.loads.coalesced}
+
+
+# Process-wide store shared by every session (Streamlit re-executes the app
+# script on each interaction, so the instance must live in this module)
+_shared_store: Optional[DocumentStore] = None
+_shared_lock = threading.Lock()
+
+
+def get_document_store() -> DocumentStore:
+    """Return the process-wide document store, creating it on first use."""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = DocumentStore()
+        return _shared_store
@@ -5,685 +5,95 @@ using OpenAI GPT-3.5 Turbo for intelligent pattern matching.
 """
 
 import streamlit as st
-import fitz  # PyMuPDF
-import pdfplumber
-from bs4 import BeautifulSoup
+from streamlit import runtime
 import pandas as pd
-import re
-from typing import Dict, List, Tuple, Optional, Any
-import io
+from typing import Callable, Dict, Iterable, Optional, Any
 import os
-import base64
 import hashlib
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# Initialize OpenAI client (only if API key is available)
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
-
-if OPENAI_API_KEY:
-    from openai import OpenAI
-    client = OpenAI(api_key=OPENAI_API_KEY)
-else:
-    client = None
+from urllib.parse import quote
+
+# Extraction engine (loads .env before reading its settings); the engine names
+# are re-exported here so existing `from smartally import ...` callers keep working
+import extraction
+from extraction import (
+    OPENAI_API_KEY, OPENAI_MODEL, client, parse_cache, llm_cache, document_store,
+    EXTRACTION_PROMPT_VERSION, LLM_MAX_CONCURRENCY, LLM_CALL_TIMEOUT,
+    parse_pdf, parse_pdf_tables, parse_html, ingest_document, read_upload,
+    extract_datapoint_with_llm, extract_all_datapoints_with_llm, lookup_extraction_grid,
+    extract_documents_with_llm, document_inputs, document_classes, parse_user_prompt_with_llm,
+    parse_user_prompt_fallback, _format_tables_for_prompt, extract_datapoint, extract_document_datapoint,
+    attribute_element,
+    extract_annual_expenses, extract_net_expenses, extract_minimum_investment_aip,
+    extract_initial_investment, extract_cdsc, extract_redemption_fee,
+)
+from intent import resolve_intent, INTENT_CONFIDENCE_THRESHOLD
+from blob_store import get_blob_store, MIME_TYPES
+from prefetch import PREFETCH_DEFAULT, clear_prefetch, get_prefetch, start_prefetch
+import tracing
+
+# Engine errors are shown in the app
+extraction.set_error_reporter(st.error)
+
+# Uploaded document bytes, stored once per content hash and linked from answers
+blob_store = get_blob_store()
+
+# Whether answers are streamed into the chat while the model is responding
+STREAMING_DEFAULT = os.getenv("SMARTALLY_STREAMING", "1") == "1"
+
+# Whether batch (whole datapoint x class grid) extraction is enabled by default
+BATCH_EXTRACTION_DEFAULT = os.getenv("SMARTALLY_BATCH_EXTRACTION", "1") == "1"
 
 
 # ============================================================================
-# Document Parsing Functions
+# Hyperlink Generation
 # ============================================================================
 
-def parse_pdf(file) -> Dict[int, str]:
-    """
-    Extract raw text from PDF file, organized by page number.
-    
-    Args:
-        file: Uploaded PDF file object
-        
-    Returns:
-        Dictionary mapping page number to text content
-    """
-    pages_text = {}
-    
-    try:
-        # Use PyMuPDF for text extraction
-        pdf_bytes = file.read()
-        file.seek(0)  # Reset file pointer
-        
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            text = page.get_text()
-            pages_text[page_num + 1] = text  # 1-indexed pages
-        doc.close()
-        
-    except Exception as e:
-        st.error(f"Error parsing PDF with PyMuPDF: {e}")
-        
-    return pages_text
-
-
-def parse_pdf_tables(file) -> Dict[int, List[List[str]]]:
-    """
-    Extract tables from PDF using pdfplumber.
-    
-    Args:
-        file: Uploaded PDF file object
-        
-    Returns:
-        Dictionary mapping page number to list of tables
-    """
-    tables_by_page = {}
-    
-    try:
-        pdf = pdfplumber.open(file)
-        for page_num, page in enumerate(pdf.pages, start=1):
-            tables = page.extract_tables()
-            if tables:
-                tables_by_page[page_num] = tables
-        pdf.close()
-        
-    except Exception as e:
-        st.error(f"Error extracting tables from PDF: {e}")
-        
-    return tables_by_page
-
-
-def parse_html(file) -> Tuple[str, Dict[str, str]]:
+def register_document_links(doc_hashes: Iterable[str]) -> Dict[str, str]:
     """
-    Extract raw text and anchor points from HTML file.
+    Serve stored documents through Streamlit's media endpoint for this script run.
     
-    Args:
-        file: Uploaded HTML file object
-        
-    Returns:
-        Tuple of (full text, dictionary mapping element IDs to text content)
-    """
-    try:
-        html_content = file.read()
-        if isinstance(html_content, bytes):
-            # Try multiple encodings to handle different file formats
-            for encoding in ['utf-8', 'latin-1', 'windows-1252', 'iso-8859-1']:
-                try:
-                    html_content = html_content.decode(encoding)
-                    break
-                except (UnicodeDecodeError, AttributeError):
-                    continue
-            else:
-                # If all encodings fail, use utf-8 with error handling
-                html_content = html_content.decode('utf-8', errors='replace')
-        
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Extract full text
-        full_text = soup.get_text(separator=' ', strip=True)
-        
-        # Extract anchors (elements with IDs)
-        anchors = {}
-        for element in soup.find_all(id=True):
-            element_id = element.get('id')
-            element_text = element.get_text(strip=True)
-            anchors[element_id] = element_text
-            
-        return full_text, anchors
-        
-    except Exception as e:
-        st.error(f"Error parsing HTML: {e}")
-        return "", {}
-
-
-# ============================================================================
-# LLM-Based Data Extraction Functions
-# ============================================================================
-
-def extract_datapoint_with_llm(text: str, tables: List[List[str]], datapoint_name: str, 
-                               class_name: str, output_rule: str, 
-                               page_texts: Optional[Dict[int, str]] = None) -> Tuple[Optional[str], Optional[str], Optional[int]]:
-    """
-    Extract a specific datapoint from text using LLM (GPT-3.5 Turbo).
+    Streamlit drops a session's media files at the start of every run, so the
+    documents linked from the chat are registered again on each run, once per
+    document however many answers link to it. The URLs are derived from the
+    content and stay the same across runs, so links in earlier answers remain
+    valid.
     
     Args:
-        text: Raw text to search
-        tables: List of tables from the document
-        datapoint_name: Name of the datapoint to extract
-        class_name: Share class (e.g., "Class A", "Class I")
-        output_rule: Formatting rule for output
-        page_texts: Optional dictionary of page texts for better location tracking
+        doc_hashes: Content hashes of documents in the blob store
         
     Returns:
-        Tuple of (extracted value, location description, page number)
+        Dictionary mapping content hash to URL (empty outside a running app)
     """
-    
-    if not client:
-        return "0", None, None
-    
-    # Format tables as text for the LLM
-    tables_text = ""
-    if tables:
-        tables_text = "\n\nTABLES IN DOCUMENT:\n"
-        for i, table in enumerate(tables[:5], 1):  # Limit to first 5 tables
-            tables_text += f"\nTable {i}:\n"
-            for row in table[:10]:  # Limit rows per table
-                tables_text += "| " + " | ".join([str(cell) for cell in row]) + " |\n"
-    
-    # Create a comprehensive prompt for the LLM
-    prompt = f"""You are a financial document data extraction assistant. Your task is to extract specific data points from fund prospectus documents.
-
-TASK: Extract the {datapoint_name} for {class_name}.
-
-DOCUMENT TEXT:
-{text[:8000]}  
-
-{tables_text}
-
-INSTRUCTIONS:
-1. Find the {datapoint_name} value for {class_name} in the document
-2. Return ONLY the value in the format specified by the output rule: {output_rule}
-3. Also identify the specific location/section where this value was found
-4. Include relevant context words or phrases that appear near the value
-
-OUTPUT FORMAT (respond in exactly this JSON format):
-{{
-    "value": "the extracted value (or '0' if not found)",
-    "location": "specific section/context where found",
-    "context": "2-3 words or phrases that appear near the value in the document"
-}}
-
-DATAPOINT DESCRIPTIONS:
-- TOTAL_ANNUAL_FUND_OPERATING_EXPENSES: The total annual operating expenses percentage
-- NET_EXPENSES: Net expenses after fee waivers/reimbursements
-- MINIMUM_SUBSEQUENT_INVESTMENT_AIP: Minimum subsequent investment for Automatic Investment Plans
-- INITIAL_INVESTMENT: Initial investment amount required
-- CDSC: Contingent Deferred Sales Charge information
-- REDEMPTION_FEE: Redemption fee details
-
-OUTPUT RULES:
-- percentage: Return as "X.XX%" (e.g., "1.19%")
-- currency: Return as "$X" or "$X,XXX" (e.g., "$50", "$2,500")
-- currency_or_text: Return dollar amount or text like "No minimum"
-- text: Return as descriptive text
-- cdsc_special: Return in format "X year, Y% then Z%"
-
-Remember: Return "0" if the value is not found. Be precise and extract only the requested information."""
-
-    try:
-        # Call OpenAI API
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a precise financial data extraction assistant. Always respond with valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,  # Low temperature for consistent extraction
-            max_tokens=500
-        )
-        
-        # Parse response
-        response_text = response.choices[0].message.content.strip()
-        
-        # Extract JSON from response (handle markdown code blocks)
-        import json
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-        
-        result = json.loads(response_text)
-        
-        value = result.get("value", "0")
-        location = result.get("location", "document")
-        context = result.get("context", "")
-        
-        # Find page number based on context
-        page_num = None
-        if page_texts and context:
-            context_words = context.lower().split()
-            for pnum, ptext in page_texts.items():
-                ptext_lower = ptext.lower()
-                # Check if multiple context words appear on this page
-                matches = sum(1 for word in context_words if word in ptext_lower)
-                if matches >= 2:  # At least 2 context words must match
-                    page_num = pnum
-                    break
-        
-        return value, location, page_num
-        
-    except Exception as e:
-        st.error(f"LLM extraction error: {str(e)}")
-        return "0", None, None
-
-
-def parse_user_prompt_with_llm(prompt: str, mapping_df: pd.DataFrame) -> Tuple[Optional[str], Optional[str]]:
-    """
-    Parse user prompt using LLM to identify datapoint and class.
-    
-    Args:
-        prompt: User's natural language prompt
-        mapping_df: DataFrame with datapoint mappings
-        
-    Returns:
-        Tuple of (datapoint_name, class_name)
-    """
-    
-    if not client:
-        return parse_user_prompt_fallback(prompt, mapping_df)
-    
-    # Get list of available datapoints
-    available_datapoints = mapping_df['Datapoint'].unique().tolist()
-    
-    llm_prompt = f"""You are a financial document query parser. Analyze the user's question and identify:
-1. Which datapoint they are asking about
-2. Which share class they are interested in
-
-USER QUERY: {prompt}
-
-AVAILABLE DATAPOINTS:
-{', '.join(available_datapoints)}
-
-COMMON SHARE CLASSES:
-Class A, Class B, Class C, Class F, Class I, Class R, Class Z
-
-OUTPUT FORMAT (respond in exactly this JSON format):
-{{
-    "datapoint": "the exact datapoint name from the available list (or null if unclear)",
-    "class": "the share class in format 'Class X' (or null if not specified)"
-}}
-
-Example responses:
-- For "What is the total annual fund operating expenses for Class A?": {{"datapoint": "TOTAL_ANNUAL_FUND_OPERATING_EXPENSES", "class": "Class A"}}
-- For "Initial investment Class C": {{"datapoint": "INITIAL_INVESTMENT", "class": "Class C"}}
-- For "CDSC Class I": {{"datapoint": "CDSC", "class": "Class I"}}
-"""
-
-    try:
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a query parsing assistant. Always respond with valid JSON."},
-                {"role": "user", "content": llm_prompt}
-            ],
-            temperature=0.1,
-            max_tokens=200
-        )
-        
-        response_text = response.choices[0].message.content.strip()
-        
-        # Extract JSON
-        import json
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-        
-        result = json.loads(response_text)
-        
-        datapoint = result.get("datapoint")
-        class_name = result.get("class")
-        
-        return datapoint, class_name
-        
-    except Exception as e:
-        st.error(f"Prompt parsing error: {str(e)}")
-        # Fallback to simple pattern matching
-        return parse_user_prompt_fallback(prompt, mapping_df)
-
-
-def parse_user_prompt_fallback(prompt: str, mapping_df: pd.DataFrame) -> Tuple[Optional[str], Optional[str]]:
-    """
-    Fallback parser using rule-based matching when LLM fails.
-    """
-    prompt_lower = prompt.lower()
-    
-    # Extract class name
-    class_name = None
-    class_patterns = [
-        r'class\s+([a-z])\b',
-        r'class\s+([a-z])\s+shares',
-        r'for\s+class\s+([a-z])',
-        r'\(class\s+([a-z])\)'
-    ]
-    
-    for pattern in class_patterns:
-        match = re.search(pattern, prompt_lower)
-        if match:
-            class_name = f"Class {match.group(1).upper()}"
-            break
-    
-    # Match against instruction patterns
-    for _, row in mapping_df.iterrows():
-        instruction_pattern = row['Instruction'].lower().replace('{class}', '.*?')
-        if re.search(instruction_pattern, prompt_lower, re.IGNORECASE):
-            return row['Datapoint'], class_name or row['Class']
-    
-    # Fallback: keyword matching
-    if 'total annual fund operating expenses' in prompt_lower or 'total_annual_fund_operating_expenses' in prompt_lower:
-        return 'TOTAL_ANNUAL_FUND_OPERATING_EXPENSES', class_name
-    elif 'net expenses' in prompt_lower or 'net_expenses' in prompt_lower:
-        return 'NET_EXPENSES', class_name
-    elif 'automatic investment plan' in prompt_lower and 'subsequent' in prompt_lower:
-        return 'MINIMUM_SUBSEQUENT_INVESTMENT_AIP', class_name
-    elif 'initial investment' in prompt_lower:
-        return 'INITIAL_INVESTMENT', class_name
-    elif 'cdsc' in prompt_lower:
-        return 'CDSC', class_name
-    elif 'redemption fee' in prompt_lower:
-        return 'REDEMPTION_FEE', class_name
-    
-    return None, class_name
+    if not runtime.exists():
+        return {}
+    media_file_mgr = runtime.get_instance().media_file_mgr
+    urls = {}
+    for doc_hash in doc_hashes:
+        blob = blob_store.get(doc_hash)
+        if blob is not None:
+            urls[doc_hash] = media_file_mgr.add(blob.data, blob.mime, f"smartally.document.{doc_hash}",
+                                                file_name=blob.name)
+    return urls
 
 
-# ============================================================================
-# Legacy Rule-Based Data Extraction Functions (Kept as Fallback)
-# ============================================================================
-
-def extract_datapoint(text: str, tables: List[List[str]], datapoint_name: str, 
-                      class_name: str, output_rule: str) -> Tuple[Optional[str], Optional[str]]:
-    """
-    Extract a specific datapoint from text using rule-based pattern matching.
-    
-    Args:
-        text: Raw text to search
-        tables: List of tables from the document
-        datapoint_name: Name of the datapoint to extract
-        class_name: Share class (e.g., "Class A", "Class I")
-        output_rule: Formatting rule for output
-        
-    Returns:
-        Tuple of (extracted value, location description)
-    """
-    
-    # Normalize class name variations
-    class_variations = [
-        class_name,
-        class_name.replace("Class ", ""),
-        f"Class {class_name.replace('Class ', '')}",
-        f"Shares {class_name.replace('Class ', '')}",
-        f"{class_name.replace('Class ', '')} Shares"
-    ]
-    
-    if datapoint_name == "TOTAL_ANNUAL_FUND_OPERATING_EXPENSES":
-        return extract_annual_expenses(text, tables, class_variations, output_rule)
-    
-    elif datapoint_name == "NET_EXPENSES":
-        return extract_net_expenses(text, tables, class_variations, output_rule)
-    
-    elif datapoint_name == "MINIMUM_SUBSEQUENT_INVESTMENT_AIP":
-        return extract_minimum_investment_aip(text, class_variations, output_rule)
-    
-    elif datapoint_name == "INITIAL_INVESTMENT":
-        return extract_initial_investment(text, class_variations, output_rule)
-    
-    elif datapoint_name == "CDSC":
-        return extract_cdsc(text, tables, class_variations, output_rule)
-    
-    elif datapoint_name == "REDEMPTION_FEE":
-        return extract_redemption_fee(text, class_variations, output_rule)
-    
-    return "0", None
-
-
-def extract_annual_expenses(text: str, tables: List[List[str]], 
-                           class_variations: List[str], output_rule: str) -> Tuple[str, Optional[str]]:
-    """Extract total annual fund operating expenses."""
-    
-    # Search in tables first
-    for table in tables:
-        # Find header row with class names
-        header_row = None
-        class_col_idx = None
-        
-        for row_idx, row in enumerate(table):
-            if row:
-                # Check if this row has class names
-                for col_idx, cell in enumerate(row):
-                    cell_str = str(cell).strip()
-                    for class_var in class_variations:
-                        if class_var.lower() == cell_str.lower() or \
-                           class_var.replace('Class ', '').lower() == cell_str.lower():
-                            header_row = row_idx
-                            class_col_idx = col_idx
-                            break
-                    if class_col_idx is not None:
-                        break
-        
-        # Now find the Total Annual Fund Operating Expenses row
-        if header_row is not None and class_col_idx is not None:
-            for row_idx in range(header_row, len(table)):
-                row = table[row_idx]
-                if row and len(row) > 0:
-                    first_cell = str(row[0]).lower()
-                    if "total annual fund operating" in first_cell:
-                        if class_col_idx < len(row):
-                            value = str(row[class_col_idx]).strip()
-                            match = re.search(r'(\d+\.?\d*)%', value)
-                            if match:
-                                return f"{match.group(1)}%", "expenses table"
-    
-    # Search in text - look for the specific line with Total Annual
-    lines = text.split('\n')
-    for i, line in enumerate(lines):
-        if 'total annual fund operating' in line.lower() and 'expenses' in line.lower():
-            # Found the row, now look for class and value in nearby lines
-            for class_var in class_variations:
-                # Search in current line and next few lines
-                search_text = '\n'.join(lines[max(0, i-2):min(len(lines), i+3)])
-                pattern = rf"{re.escape(class_var)}.*?(\d+\.?\d+)%"
-                match = re.search(pattern, search_text, re.IGNORECASE)
-                if match:
-                    return f"{match.group(1)}%", "expenses section"
-    
-    return "0", None
-
-
-def extract_net_expenses(text: str, tables: List[List[str]], 
-                        class_variations: List[str], output_rule: str) -> Tuple[str, Optional[str]]:
-    """Extract net expenses after fee waiver/expense reimbursement."""
-    
-    # Search in tables
-    for table in tables:
-        # Find header row with class names
-        header_row = None
-        class_col_idx = None
-        
-        for row_idx, row in enumerate(table):
-            if row:
-                for col_idx, cell in enumerate(row):
-                    cell_str = str(cell).strip()
-                    for class_var in class_variations:
-                        if class_var.lower() == cell_str.lower() or \
-                           class_var.replace('Class ', '').lower() == cell_str.lower():
-                            header_row = row_idx
-                            class_col_idx = col_idx
-                            break
-                    if class_col_idx is not None:
-                        break
-        
-        # Find Net Expenses row
-        if header_row is not None and class_col_idx is not None:
-            for row_idx in range(header_row, len(table)):
-                row = table[row_idx]
-                if row and len(row) > 0:
-                    first_cell = str(row[0]).lower()
-                    if "net expense" in first_cell or "net annual" in first_cell:
-                        if class_col_idx < len(row):
-                            value = str(row[class_col_idx]).strip()
-                            match = re.search(r'(\d+\.?\d*)%', value)
-                            if match:
-                                return f"{match.group(1)}%", "net expenses table"
-    
-    # Search in text
-    lines = text.split('\n')
-    for i, line in enumerate(lines):
-        if ('net expense' in line.lower() or 'after fee waiver' in line.lower()) and 'expense' in line.lower():
-            for class_var in class_variations:
-                search_text = '\n'.join(lines[max(0, i-2):min(len(lines), i+3)])
-                pattern = rf"{re.escape(class_var)}.*?(\d+\.?\d+)%"
-                match = re.search(pattern, search_text, re.IGNORECASE)
-                if match:
-                    return f"{match.group(1)}%", "net expenses section"
-    
-    return "0", None
-
-
-def extract_minimum_investment_aip(text: str, class_variations: List[str], 
-                                   output_rule: str) -> Tuple[str, Optional[str]]:
-    """Extract minimum subsequent investment for Automatic Investment Plans."""
-    
-    # Look for Minimum Investment section with AIP
-    for class_var in class_variations:
-        # Pattern: Class block -> Subsequent investment -> AIP value
-        pattern = rf"{re.escape(class_var)}.*?(?:subsequent\s+investment|subsequent).*?(?:automatic\s+investment\s+plans?|aip).*?\$\s*([\d,]+)"
-        match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-        if match:
-            amount = match.group(1).replace(',', '')
-            return f"${amount}", "minimum investment section"
-    
-    # Try alternate pattern
-    pattern = r"(?:automatic\s+investment\s+plans?|aip).*?(?:subsequent\s+investment|subsequent).*?\$\s*([\d,]+)"
-    match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-    if match:
-        amount = match.group(1).replace(',', '')
-        return f"${amount}", "minimum investment section"
-    
-    return "0", None
-
-
-def extract_initial_investment(text: str, class_variations: List[str], 
-                               output_rule: str) -> Tuple[str, Optional[str]]:
-    """Extract initial investment amount."""
-    
-    for class_var in class_variations:
-        # Create a class section pattern - look for the class heading
-        class_section_pattern = rf"{re.escape(class_var)}\s+(?:Shares?)?\s*\n(.*?)(?=\n\s*Class\s+[A-Z]|\Z)"
-        class_match = re.search(class_section_pattern, text, re.IGNORECASE | re.DOTALL)
-        
-        if class_match:
-            class_section = class_match.group(1)
-            
-            # Look for "initial investment" in this section
-            init_pattern = r"Initial\s+Investment:\s*(.*?)(?=\n|$)"
-            init_match = re.search(init_pattern, class_section, re.IGNORECASE)
-            
-            if init_match:
-                value = init_match.group(1).strip()
-                if 'no minimum' in value.lower():
-                    return "No minimum", "minimum investment section"
-                # Extract dollar amount
-                dollar_match = re.search(r'\$\s*([\d,]+)', value)
-                if dollar_match:
-                    amount = dollar_match.group(1).replace(',', '')
-                    return f"${amount}", "minimum investment section"
-    
-    # Fallback: direct pattern matching
-    for class_var in class_variations:
-        # Look for "no minimum" first
-        pattern = rf"{re.escape(class_var)}.*?(?:initial\s+investment).*?(no\s+minimum)"
-        match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-        if match:
-            return "No minimum", "minimum investment section"
-        
-        # Look for dollar amount
-        pattern = rf"{re.escape(class_var)}.*?(?:initial\s+investment).*?\$\s*([\d,]+)"
-        match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-        if match:
-            amount = match.group(1).replace(',', '')
-            return f"${amount}", "minimum investment section"
-    
-    return "0", None
-
-
-def extract_cdsc(text: str, tables: List[List[str]], class_variations: List[str], 
-                output_rule: str) -> Tuple[str, Optional[str]]:
-    """Extract CDSC (Contingent Deferred Sales Charge) information."""
-    
-    # CDSC typically shows years and percentages
-    for class_var in class_variations:
-        # Look for CDSC section with years and percentages
-        pattern = rf"(?:cdsc|contingent\s+deferred\s+sales\s+charge).*?{re.escape(class_var)}.*?(\d+)\s*year.*?(\d+\.?\d*)%.*?(\d+\.?\d*)%"
-        match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-        if match:
-            years = match.group(1)
-            first_pct = match.group(2)
-            after_pct = match.group(3)
-            return f"{years} year, {first_pct}% then {after_pct}%", "CDSC section"
-        
-        # Simpler pattern for "1 year" and "0% after first year"
-        pattern = rf"(?:cdsc|contingent\s+deferred\s+sales\s+charge).*?{re.escape(class_var)}.*?(\d+)\s*(?:year|yr)"
-        match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-        if match:
-            years = match.group(1)
-            # Look for "0% after" nearby
-            after_pattern = r"(\d+\.?\d*)%\s+after"
-            after_match = re.search(after_pattern, text[match.end():match.end()+100], re.IGNORECASE)
-            if after_match:
-                return f"{years} year, {after_match.group(1)}% after first year", "CDSC section"
-            return f"{years} year", "CDSC section"
-    
-    return "0", None
-
-
-def extract_redemption_fee(text: str, class_variations: List[str], 
-                          output_rule: str) -> Tuple[str, Optional[str]]:
-    """Extract redemption fee information."""
-    
-    for class_var in class_variations:
-        # Look for class-specific redemption fee
-        pattern = rf"{re.escape(class_var)}:\s*(.*?)(?:redemption\s+fee|$)"
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            fee_text = match.group(1).strip()
-            # Extract percentage or "No" fee
-            if re.search(r'\d+\.?\d*%', fee_text):
-                pct_match = re.search(r'(\d+\.?\d*)%', fee_text)
-                if pct_match:
-                    # Get more context - look for full sentence
-                    context_pattern = rf"{re.escape(class_var)}:\s*(.*?)(?=\n\s*Class\s+[A-Z]|\n\s*$)"
-                    context_match = re.search(context_pattern, text, re.IGNORECASE)
-                    if context_match:
-                        return context_match.group(1).strip(), "redemption fee section"
-                    return fee_text, "redemption fee section"
-            elif 'no' in fee_text.lower():
-                return "No redemption fee", "redemption fee section"
-        
-        # Alternative pattern
-        pattern = rf"{re.escape(class_var)}.*?redemption\s+fee[:\s]+(.*?)(?=\n|$)"
-        match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-        if match:
-            fee_info = match.group(1).strip()
-            if fee_info:
-                return fee_info, "redemption fee section"
-        
-        # Try reverse: redemption fee first
-        pattern = rf"redemption\s+fee.*?{re.escape(class_var)}[:\s]+(.*?)(?=\n|$)"
-        match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-        if match:
-            fee_info = match.group(1).strip()
-            if fee_info:
-                return fee_info, "redemption fee section"
-    
-    return "0", None
-
-
-# ============================================================================
-# Hyperlink Generation
-# ============================================================================
-
 def generate_hyperlink(doc_type: str, location: Optional[str], 
                        page_num: Optional[int] = None, element_id: Optional[str] = None,
-                       doc_name: Optional[str] = None, file_bytes: Optional[bytes] = None,
+                       doc_name: Optional[str] = None, doc_url: Optional[str] = None,
                        value: Optional[str] = None) -> str:
     """
     Generate a clickable hyperlink to the location in the document.
     
+    The link points at the served document (see register_document_links) with
+    a page or element anchor, so the answer stays a few hundred bytes however
+    large the document is.
+    
     Args:
         doc_type: Type of document ("pdf" or "html")
         location: Description of where the value was found
         page_num: Page number (for PDFs)
         element_id: Element ID (for HTML)
         doc_name: Name of the document file
-        file_bytes: Original file bytes for creating downloadable link
+        doc_url: URL serving the document
         value: The extracted value (used for creating unique tag)
         
     Returns:
@@ -696,44 +106,37 @@ def generate_hyperlink(doc_type: str, location: Optional[str],
     else:
         unique_tag = None
     
-    if doc_type == "pdf" and page_num and file_bytes and doc_name:
-        # Create a download link with the file
-        # Store in session state for download button
-        doc_key = f"doc_{hashlib.md5(doc_name.encode()).hexdigest()}"
-        
+    if doc_type == "pdf" and page_num and doc_url and doc_name:
         # Generate tag badge
         tag_display = f"<span style='background-color: #FEF3C7; color: #78350F; padding: 2px 8px; border-radius: 4px; font-size: 0.75em; font-weight: 600; margin-left: 8px;'>🔖 {unique_tag}</span>" if unique_tag else ""
         
-        # Create HTML with download button embedded
+        # Create HTML with a link to the page of the served document
         location_text = f" - {location}" if location else " - See document for details"
         
-        # Base64 encode for download button
-        base64_pdf = base64.b64encode(file_bytes).decode('utf-8')
-        download_link = f'<a href="data:application/pdf;base64,{base64_pdf}" download="{doc_name}" target="_blank" style="color: #2563EB; text-decoration: none; font-weight: 600; border: 1px solid #2563EB; padding: 4px 12px; border-radius: 6px; display: inline-block; margin-top: 4px; background-color: #EFF6FF; transition: all 0.2s;">📥 Open Page {page_num} in `{doc_name}`</a>'
+        download_link = f'<a href="{doc_url}#page={page_num}" target="_blank" style="color: #2563EB; text-decoration: none; font-weight: 600; border: 1px solid #2563EB; padding: 4px 12px; border-radius: 6px; display: inline-block; margin-top: 4px; background-color: #EFF6FF; transition: all 0.2s;">📥 Open Page {page_num} in `{doc_name}`</a>'
         
-        return f"📄 **Page {page_num}** in `{doc_name}`{location_text}{tag_display}\n\n{download_link}\n\n<small style='color: #64748B;'>💡 <em>Click the link above to open the PDF. Navigate to page {page_num} to find the highlighted data.</em></small>"
+        return f"📄 **Page {page_num}** in `{doc_name}`{location_text}{tag_display}\n\n{download_link}\n\n<small style='color: #64748B;'>💡 <em>Click the link above to open the PDF at page {page_num}.</em></small>"
     
-    elif doc_type == "html" and element_id and file_bytes and doc_name:
+    elif doc_type == "html" and element_id and doc_url and doc_name:
         # Create a download/view link for HTML
         tag_display = f"<span style='background-color: #FEF3C7; color: #78350F; padding: 2px 8px; border-radius: 4px; font-size: 0.75em; font-weight: 600; margin-left: 8px;'>🔖 {unique_tag}</span>" if unique_tag else ""
         
         location_text = f" - {location}" if location else " - See document for details"
         
-        # Base64 encode for view button with anchor
-        base64_html = base64.b64encode(file_bytes).decode('utf-8')
-        view_link = f'<a href="data:text/html;base64,{base64_html}#{element_id}" target="_blank" style="color: #2563EB; text-decoration: none; font-weight: 600; border: 1px solid #2563EB; padding: 4px 12px; border-radius: 6px; display: inline-block; margin-top: 4px; background-color: #EFF6FF; transition: all 0.2s;">🔗 Open Section #{element_id} in `{doc_name}`</a>'
+        # Link to the element anchor of the served document
+        view_link = f'<a href="{doc_url}#{quote(element_id, safe="")}" target="_blank" style="color: #2563EB; text-decoration: none; font-weight: 600; border: 1px solid #2563EB; padding: 4px 12px; border-radius: 6px; display: inline-block; margin-top: 4px; background-color: #EFF6FF; transition: all 0.2s;">🔗 Open Section #{element_id} in `{doc_name}`</a>'
         
         return f"🔗 **Section #{element_id}** in `{doc_name}`{location_text}{tag_display}\n\n{view_link}\n\n<small style='color: #64748B;'>💡 <em>Click the link above to open the HTML document at the specific section.</em></small>"
     
     elif doc_type == "pdf" and page_num:
-        # Fallback without file bytes
+        # Fallback without a document link
         tag_display = f"<span style='background-color: #FEF3C7; color: #78350F; padding: 2px 8px; border-radius: 4px; font-size: 0.75em; font-weight: 600; margin-left: 8px;'>🔖 {unique_tag}</span>" if unique_tag else ""
         doc_ref = f" in `{doc_name}`" if doc_name else ""
         location_text = f" - {location}" if location else " - See document for details"
         return f"📄 **Page {page_num}**{doc_ref}{location_text}{tag_display}"
     
     elif doc_type == "html" and element_id:
-        # Fallback without file bytes
+        # Fallback without a document link
         tag_display = f"<span style='background-color: #FEF3C7; color: #78350F; padding: 2px 8px; border-radius: 4px; font-size: 0.75em; font-weight: 600; margin-left: 8px;'>🔖 {unique_tag}</span>" if unique_tag else ""
         doc_ref = f" in `{doc_name}`" if doc_name else ""
         location_text = f" - {location}" if location else " - See document for details"
@@ -751,8 +154,22 @@ def generate_hyperlink(doc_type: str, location: Optional[str],
 # Chatbot Response Handler
 # ============================================================================
 
+def _render_partial_answers(partials: Dict[str, Dict[str, str]]) -> str:
+    """Format streamed, still-incomplete answers for the chat placeholder."""
+    lines = ["⏳ **Receiving answers...**", ""]
+    for doc_name, fields in partials.items():
+        value = fields.get('value') or '…'
+        location = fields.get('location')
+        location_text = f" _({location})_" if location else ""
+        lines.append(f"- `{doc_name}`: **{value}**{location_text}")
+    return "\n".join(lines)
+
+
 def chatbot_response(user_prompt: str, parsed_docs: Dict[str, Any], 
-                    mapping_df: pd.DataFrame, use_llm: bool = True) -> str:
+                    mapping_df: pd.DataFrame, use_llm: bool = True,
+                    batch_mode: bool = False,
+                    stream_callback: Optional[Callable[[str], None]] = None,
+                    doc_urls: Optional[Dict[str, str]] = None) -> str:
     """
     Process user prompt and return extracted data with hyperlink.
     
@@ -761,6 +178,13 @@ def chatbot_response(user_prompt: str, parsed_docs: Dict[str, Any],
         parsed_docs: Dictionary containing parsed document data
         mapping_df: DataFrame with datapoint mappings
         use_llm: Whether to use LLM-based extraction (default: True)
+        batch_mode: Extract the full datapoint x class grid once per document and
+            answer from it (LLM mode only)
+        stream_callback: If given, LLM completions are streamed and this is
+            called with interim markdown (query understanding, partial values)
+            until the final response is ready
+        doc_urls: Content hash -> URL of the served documents, used for the
+            source links in the answer
         
     Returns:
         Formatted response string
@@ -770,11 +194,40 @@ def chatbot_response(user_prompt: str, parsed_docs: Dict[str, Any],
         st.warning("⚠️ OpenAI API key not found. Falling back to rule-based extraction. Please set OPENAI_API_KEY in .env file.")
         use_llm = False
     
+    partials: Dict[str, Dict[str, str]] = {}
+    
+    def show_prompt_update(fields: Dict[str, str]) -> None:
+        datapoint = fields.get('datapoint') or '…'
+        share_class = fields.get('class') or '…'
+        stream_callback(f"🔎 Looking for **{datapoint}** for **{share_class}**...")
+    
+    def show_partial(doc_name: str, fields: Dict[str, str]) -> None:
+        partials[doc_name] = fields
+        stream_callback(_render_partial_answers(partials))
+    
+    # Interim output is only shown when streaming
+    streaming = stream_callback is not None
+    on_prompt_update = show_prompt_update if streaming else None
+    on_partial = show_partial if streaming else None
+    
+    # Share classes offered by the uploaded documents (from their class indexes)
+    share_classes = sorted({class_name for doc_data in parsed_docs.values()
+                            for class_name in document_classes(doc_data)})
+    
     # Parse the prompt
-    if use_llm:
-        datapoint_name, class_name = parse_user_prompt_with_llm(user_prompt, mapping_df)
-    else:
-        datapoint_name, class_name = parse_user_prompt_fallback(user_prompt, mapping_df)
+    with tracing.span('intent') as intent_span:
+        if use_llm:
+            # Resolve locally first; only ambiguous questions need the LLM round trip
+            intent = resolve_intent(user_prompt, mapping_df)
+            intent_span.set(confidence=intent.confidence)
+            if intent.confidence >= INTENT_CONFIDENCE_THRESHOLD:
+                datapoint_name, class_name = intent.datapoint, intent.class_name
+            else:
+                datapoint_name, class_name = parse_user_prompt_with_llm(user_prompt, mapping_df, on_prompt_update,
+                                                                        share_classes)
+        else:
+            datapoint_name, class_name = parse_user_prompt_fallback(user_prompt, mapping_df)
+        intent_span.set(datapoint=datapoint_name, share_class=class_name)
     
     if not datapoint_name:
         return """
@@ -792,15 +245,18 @@ I couldn't determine what data you're looking for from your query.
 """
     
     if not class_name:
-        return """
+        if share_classes:
+            class_choices = f"- {', '.join(share_classes)} (offered by the uploaded documents)"
+        else:
+            class_choices = "- Class A, Class B, Class C\n- Class F, Class I, Class R, Class Z"
+        return f"""
 ---
 ### ❌ Share Class Not Specified
 
 I couldn't identify which share class you're asking about.
 
 **Please specify one of:**
-- Class A, Class B, Class C
-- Class F, Class I, Class R, Class Z
+{class_choices}
 - Example: "What is the operating expense for **Class A**?"
 
 ---
@@ -809,54 +265,41 @@ I couldn't identify which share class you're asking about.
     # Get output rule
     output_rule = mapping_df[mapping_df['Datapoint'] == datapoint_name]['OutputRule'].iloc[0] if not mapping_df[mapping_df['Datapoint'] == datapoint_name].empty else 'text'
     
-    # Extract from all documents
+    # Answers precomputed in the background after upload need no extraction
+    answers = {}
+    for doc_name, doc_data in parsed_docs.items():
+        job = get_prefetch(doc_data, use_llm)
+        answer = job.answer(datapoint_name, class_name) if job is not None else None
+        if answer is not None:
+            answers[doc_name] = answer
+    
+    # Extract from the other documents (LLM calls fan out concurrently across documents)
+    pending_docs = {doc_name: doc_data for doc_name, doc_data in parsed_docs.items() if doc_name not in answers}
+    if use_llm and pending_docs:
+        with tracing.span('extraction', method='llm', documents=len(pending_docs)):
+            answers.update(extract_documents_with_llm(pending_docs, datapoint_name, class_name,
+                                                      output_rule, mapping_df, batch_mode, on_partial))
+    
     results = []
     for doc_name, doc_data in parsed_docs.items():
-        if doc_data['type'] == 'pdf':
-            # Combine all pages
-            all_text = '\n'.join(doc_data['pages'].values())
-            tables = []
-            for page_tables in doc_data.get('tables', {}).values():
-                tables.extend(page_tables)
-            
-            if use_llm:
-                # Use LLM-based extraction with page tracking
-                value, location, page_num = extract_datapoint_with_llm(
-                    all_text, tables, datapoint_name, class_name, output_rule, 
-                    doc_data['pages']
-                )
-            else:
-                # Use legacy rule-based extraction
-                value, location = extract_datapoint(all_text, tables, datapoint_name, class_name, output_rule)
-                # Find which page it was on (approximate)
-                page_num = None
-                for pnum, ptext in doc_data['pages'].items():
-                    if location and any(keyword in ptext.lower() for keyword in location.split()):
-                        page_num = pnum
-                        break
-            
-            if value and value != "0":
-                file_bytes = doc_data.get('file_bytes')
-                hyperlink = generate_hyperlink('pdf', location, page_num, doc_name=doc_name, 
-                                              file_bytes=file_bytes, value=value)
-                results.append(f"### 💼 {value}\n{hyperlink}")
-        
-        elif doc_data['type'] == 'html':
-            all_text = doc_data['text']
-            
-            if use_llm:
-                # Use LLM-based extraction
-                value, location, _ = extract_datapoint_with_llm(
-                    all_text, [], datapoint_name, class_name, output_rule
-                )
-            else:
-                # Use legacy rule-based extraction
-                value, location = extract_datapoint(all_text, [], datapoint_name, class_name, output_rule)
-            
-            if value and value != "0":
-                file_bytes = doc_data.get('file_bytes')
-                hyperlink = generate_hyperlink('html', location, doc_name=doc_name, 
-                                              file_bytes=file_bytes, value=value)
+        if doc_name in answers:
+            value, location, page_num = answers[doc_name]
+        else:
+            # Use legacy rule-based extraction
+            with tracing.span('extraction', method='rules', doc=doc_name):
+                value, location, page_num = extract_document_datapoint(doc_data, datapoint_name,
+                                                                       class_name, output_rule)
+        
+        if value and value != "0":
+            with tracing.span('render', doc=doc_name):
+                doc_url = (doc_urls or {}).get(doc_data.get('sha256'))
+                if doc_data['type'] == 'pdf':
+                    hyperlink = generate_hyperlink('pdf', location, page_num, doc_name=doc_name, 
+                                                  doc_url=doc_url, value=value)
+                else:
+                    element_id = attribute_element(doc_data, value, location or '')
+                    hyperlink = generate_hyperlink('html', location, element_id=element_id,
+                                                  doc_name=doc_name, doc_url=doc_url, value=value)
                 results.append(f"### 💼 {value}\n{hyperlink}")
     
     if results:
@@ -884,6 +327,12 @@ The requested datapoint was not found in the uploaded documents.
 # Streamlit UI
 # ============================================================================
 
+def render_trace(trace: Dict[str, Any], title: str = "⏱️ Timing breakdown") -> None:
+    """Show a recorded trace as a collapsible per-stage timing table."""
+    with st.expander(f"{title} ({trace['total_ms']:.0f} ms)"):
+        st.dataframe(pd.DataFrame(tracing.summarize(trace)), hide_index=True, use_container_width=True)
+
+
 def main():
     """Main Streamlit application."""
     
@@ -1074,6 +523,8 @@ def main():
                     <span style="color: #065F46; font-weight: 600;">✅ {len(uploaded_files)} document(s) ready</span>
                 </div>
             """, unsafe_allow_html=True)
+            # Filled in once the documents are parsed and their prefetch has started
+            prefetch_status = st.empty()
             
             with st.expander("📄 View uploaded files", expanded=False):
                 for file in uploaded_files:
@@ -1092,6 +543,14 @@ def main():
             help="Use GPT-4 for intelligent data extraction. Requires OpenAI API key."
         )
         
+        prefetch = st.checkbox(
+            "Precompute all datapoints",
+            value=PREFETCH_DEFAULT,
+            help="Right after upload, extract every datapoint for every share class of each document in the background, so most questions are answered instantly."
+        )
+        
+        batch_mode = False
+        streaming = False
         if api_key_configured:
             st.markdown(f"""
                 <div style="background-color: #DBEAFE; padding: 0.5rem; border-radius: 6px; margin-top: 0.5rem;">
@@ -1100,12 +559,48 @@ def main():
                     </span>
                 </div>
             """, unsafe_allow_html=True)
+            
+            batch_mode = st.checkbox(
+                "Batch extraction",
+                value=BATCH_EXTRACTION_DEFAULT,
+                disabled=not use_llm,
+                help="Extract every datapoint for every share class in one call per document, then answer follow-up questions from that grid."
+            )
+            
+            streaming = st.checkbox(
+                "Stream answers",
+                value=STREAMING_DEFAULT,
+                disabled=not use_llm,
+                help="Show the query interpretation and partial values while the model is still answering."
+            )
+            
+            cache_stats = llm_cache.stats()
+            st.caption(f"🗄️ LLM cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+            store_stats = document_store.stats()
+            st.caption(f"📚 Shared documents: {store_stats['documents']} "
+                       f"({store_stats['bytes'] / (1024 * 1024):.0f} MB), "
+                       f"{store_stats['hits'] + store_stats['coalesced']} parses saved")
+            if st.button("Clear LLM cache", help="Discard memoized extraction results"):
+                llm_cache.clear()
+                clear_prefetch()
+                for doc_data in st.session_state.get('parsed_docs', {}).values():
+                    doc_data.pop('extraction_grid', None)
         
         if 'use_llm' not in st.session_state:
             st.session_state.use_llm = use_llm
         else:
             st.session_state.use_llm = use_llm
         
+        st.session_state.batch_mode = batch_mode
+        st.session_state.prefetch = prefetch
+        st.session_state.streaming = streaming
+        
+        st.session_state.tracing = st.checkbox(
+            "Show timing breakdown",
+            value=tracing.TRACING_ENABLED,
+            help="Time each stage of parsing and answering (intent, retrieval, LLM call, attribution, rendering) and log it to the trace file."
+        )
+        
         st.markdown("---")
         
         # Improved example queries section
@@ -1138,6 +633,8 @@ def main():
     
     if 'parsed_docs' not in st.session_state:
         st.session_state.parsed_docs = {}
+    # Upload each parsed document came from (the documents are shared across sessions)
+    upload_ids = st.session_state.setdefault('upload_ids', {})
     
     # Parse uploaded documents (with caching)
     if uploaded_files:
@@ -1147,35 +644,42 @@ def main():
         for doc_name in list(st.session_state.parsed_docs.keys()):
             if doc_name not in current_files:
                 del st.session_state.parsed_docs[doc_name]
+                upload_ids.pop(doc_name, None)
         
-        # Parse new documents
+        # Parse new documents (and files re-uploaded under an existing name)
         for file_name, file in current_files.items():
-            if file_name not in st.session_state.parsed_docs:
-                with st.spinner(f"📄 Parsing {file_name}..."):
-                    if file_name.lower().endswith('.pdf'):
-                        # Store file bytes for later use
-                        file_bytes = file.read()
-                        file.seek(0)
-                        pages = parse_pdf(file)
-                        file.seek(0)
-                        tables = parse_pdf_tables(file)
-                        st.session_state.parsed_docs[file_name] = {
-                            'type': 'pdf',
-                            'pages': pages,
-                            'tables': tables,
-                            'file_bytes': file_bytes
-                        }
-                    elif file_name.lower().endswith(('.html', '.htm')):
-                        # Store file bytes for later use
-                        file_bytes = file.read()
-                        file.seek(0)
-                        text, anchors = parse_html(file)
-                        st.session_state.parsed_docs[file_name] = {
-                            'type': 'html',
-                            'text': text,
-                            'anchors': anchors,
-                            'file_bytes': file_bytes
-                        }
+            upload_id = getattr(file, 'file_id', None)
+            if file_name not in st.session_state.parsed_docs or upload_ids.get(file_name) != upload_id:
+                with st.spinner(f"📄 Parsing {file_name}..."), \
+                        tracing.start_trace('ingest', enabled=st.session_state.tracing, doc=file_name) as trace:
+                    # Read the upload once; parsers and hyperlinks share these bytes
+                    # (not spilled: the blob store keeps them in memory to serve them)
+                    file_bytes = read_upload(file)
+                    doc_data = ingest_document(file_name, file_bytes, spill=False)
+                if trace is not None:
+                    st.session_state.setdefault('parse_traces', {})[file_name] = trace.to_dict()
+                if doc_data is not None:
+                    # One shared copy per document serves every answer that links to it
+                    blob_store.put(file_bytes, file_name, MIME_TYPES[doc_data['type']],
+                                   key=doc_data['sha256'])
+                    upload_ids[file_name] = upload_id
+                    st.session_state.parsed_docs[file_name] = doc_data
+    
+    # Precompute every answer of the documents in the background
+    if uploaded_files and st.session_state.prefetch:
+        with prefetch_status.container():
+            for doc_name, doc_data in st.session_state.parsed_docs.items():
+                job = start_prefetch(doc_data, mapping_df, use_llm=st.session_state.use_llm)
+                if job.done:
+                    st.caption(f"⚡ `{doc_name}`: {len(job.answers)} answers precomputed")
+                else:
+                    st.progress(job.progress, text=f"⚡ `{doc_name}`: precomputing "
+                                                   f"{len(job.answers)}/{job.total or '…'}")
+    
+    # Serve every document an answer may link to (removed uploads included)
+    linked_docs = st.session_state.setdefault('linked_docs', set())
+    linked_docs.update(doc['sha256'] for doc in st.session_state.parsed_docs.values())
+    doc_urls = register_document_links(linked_docs)
     
     # Show welcome message if no messages yet
     if not st.session_state.messages and st.session_state.parsed_docs:
@@ -1183,10 +687,18 @@ def main():
     elif not st.session_state.messages:
         st.info("👋 **Welcome!** Upload documents using the sidebar to get started.")
     
+    # Timings of the documents parsed while tracing was on
+    if st.session_state.tracing:
+        for file_name, trace in st.session_state.get('parse_traces', {}).items():
+            if file_name in st.session_state.parsed_docs:
+                render_trace(trace, f"⏱️ Parsing {file_name}")
+    
     # Display chat history
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"], unsafe_allow_html=True)
+            if message.get("trace"):
+                render_trace(message["trace"])
     
     # Chat input with improved placeholder
     placeholder_text = "💬 Ask me anything about the documents... (e.g., 'What is the total annual operating expenses for Class A?')"
@@ -1199,9 +711,12 @@ def main():
         with st.chat_message("user"):
             st.markdown(prompt)
         
-        # Generate response
-        if not st.session_state.parsed_docs:
-            response = """
+        # Generate response (streamed into the placeholder when enabled)
+        trace = None
+        with st.chat_message("assistant"):
+            answer_placeholder = st.empty()
+            if not st.session_state.parsed_docs:
+                response = """
 ---
 ### ⚠️ No Documents Available
 
@@ -1209,16 +724,23 @@ Please upload at least one document using the sidebar before asking questions.
 
 ---
 """
-        else:
-            # Use the LLM setting from session state
-            use_llm_mode = st.session_state.get('use_llm', api_key_configured)
-            with st.spinner("🤔 Analyzing documents..."):
-                response = chatbot_response(prompt, st.session_state.parsed_docs, mapping_df, use_llm=use_llm_mode)
+            else:
+                # Use the LLM setting from session state
+                use_llm_mode = st.session_state.get('use_llm', api_key_configured)
+                answer_placeholder.markdown("🤔 Analyzing documents...")
+                stream_callback = answer_placeholder.markdown if st.session_state.get('streaming', False) else None
+                with tracing.start_trace('answer', enabled=st.session_state.tracing, prompt=prompt,
+                                         llm=use_llm_mode, documents=len(st.session_state.parsed_docs)) as trace:
+                    response = chatbot_response(prompt, st.session_state.parsed_docs, mapping_df, use_llm=use_llm_mode,
+                                                batch_mode=st.session_state.get('batch_mode', False),
+                                                stream_callback=stream_callback, doc_urls=doc_urls)
+            answer_placeholder.markdown(response, unsafe_allow_html=True)
+            if trace is not None:
+                trace = trace.to_dict()
+                render_trace(trace)
         
         # Add assistant response to chat
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        with st.chat_message("assistant"):
-            st.markdown(response, unsafe_allow_html=True)
+        st.session_state.messages.append({"role": "assistant", "content": response, "trace": trace})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+"""
+SmartAlly - Command Line
+Headless entry point for jobs that run without the Streamlit app.
+
+    python smartally_cli.py batch filings/ -o results.xlsx
+    python smartally_cli.py batch manifest.txt -o results.parquet --mode rules --workers 8
+
+Must never import Streamlit.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+import batch
+
+
+def _batch_command(args: argparse.Namespace) -> int:
+    inputs = batch.discover_inputs(args.input)
+    if not inputs:
+        print(f"No PDF/HTML documents found in {args.input}", file=sys.stderr)
+        return 1
+
+    use_llm = {'auto': None, 'llm': True, 'rules': False}[args.mode]
+    if use_llm and batch.extraction.client is None:
+        print("--mode llm requires OPENAI_API_KEY", file=sys.stderr)
+        return 2
+    classes = [c.strip() for c in args.classes.split(',') if c.strip()] if args.classes else None
+
+    try:
+        status_df = batch.run_batch(inputs, Path(args.output), Path(args.mapping), classes=classes,
+                                    use_llm=use_llm, workers=args.workers, checkpoint=args.checkpoint,
+                                    resume=not args.restart, on_progress=batch.print_progress)
+    except (ValueError, ImportError) as e:
+        # Unsupported output format, or no Parquet engine (pyarrow) installed
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    counts = status_df['status'].value_counts().to_dict()
+    print(f"{len(status_df)} documents: " + ', '.join(f"{n} {status}" for status, n in counts.items())
+          + f" -> {args.output}", file=sys.stderr)
+    return 1 if counts.get('error') else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='smartally', description='SmartAlly headless tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    batch_parser = commands.add_parser(
+        'batch', help='extract every datapoint for every share class from a set of filings')
+    batch_parser.add_argument('input', help='directory of PDF/HTML files, or manifest with one path per line')
+    batch_parser.add_argument('-o', '--output', required=True, help='results file: .csv, .parquet or .xlsx')
+    batch_parser.add_argument('--mapping', default=str(batch.DEFAULT_MAPPING), help='datapoint mapping CSV')
+    batch_parser.add_argument('--classes', help='comma-separated share classes (default: classes found per document)')
+    batch_parser.add_argument('--mode', choices=('auto', 'llm', 'rules'), default='auto',
+                              help='extraction method (auto: LLM when OPENAI_API_KEY is set)')
+    batch_parser.add_argument('--workers', type=int, help='worker processes (default: SMARTALLY_BATCH_WORKERS or CPUs)')
+    batch_parser.add_argument('--checkpoint', help='checkpoint file (default: <output>.checkpoint.jsonl)')
+    batch_parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start over')
+    batch_parser.set_defaults(handler=_batch_command)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+SmartAlly - Synthetic Prospectus Generator
+Deterministic fund prospectuses for benchmarks and tests, as PDF (PyMuPDF) or
+HTML, with a configurable page count, number of share classes and density of
+ruled tables. Fee, minimum investment, CDSC and redemption fee sections are
+spread through the document and their values are returned as ground truth.
+"""
+
+import html
+import random
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+# Share class letters, in the order classes are added to a generated fund
+CLASS_CODES = 'ACIRFZBKYT'
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+MARGIN = 54
+
+_VOCABULARY = (
+    "fund shares investment portfolio securities market risk income return value class "
+    "adviser distributor board trustees prospectus statement net asset daily redemption "
+    "purchase exchange dividend capital gains tax account shareholder intermediary policy "
+    "equity fixed interest rate credit liquidity derivatives currency issuer performance "
+    "benchmark index annual report semi-annual period year month business day price order"
+).split()
+
+_FEE_ROWS = ('Management Fees', 'Distribution (12b-1) Fees', 'Other Expenses',
+             'Total Annual Fund Operating Expenses', 'Fee Waiver and/or Expense Reimbursement',
+             'Net Expenses')
+
+
+class SyntheticProspectus(NamedTuple):
+    """A generated document and the values planted in it."""
+    data: bytes
+    doc_type: str
+    page_count: int
+    classes: List[str]
+    # (datapoint, class) -> planted value; None where the class has no such value
+    truth: Dict[Tuple[str, str], Optional[str]]
+
+
+# ============================================================================
+# Content
+# ============================================================================
+
+def _class_terms(rng: random.Random, classes: List[str]) -> Dict[str, Dict[str, object]]:
+    """Draw the fees and investment minimums of every class."""
+    terms = {}
+    for class_name in classes:
+        management = rng.choice((0.35, 0.5, 0.65, 0.8))
+        distribution = rng.choice((0.0, 0.25, 0.5, 1.0))
+        other = rng.randint(10, 40) / 100
+        total = management + distribution + other
+        waiver = rng.choice((0.0, 0.05, 0.09, 0.12))
+        has_cdsc = class_name in ('Class B', 'Class C') or rng.random() < 0.2
+        has_fee = rng.random() < 0.3
+        terms[class_name] = {
+            'fees': [management, distribution, other, total, -waiver, total - waiver],
+            'initial': rng.choice(('$1,000', '$2,500', '$25,000', '$1,000,000', 'No minimum')),
+            'subsequent': rng.choice(('$50', '$100', '$250')),
+            'aip': rng.choice(('$25', '$50', '$100')),
+            'cdsc': f"{rng.choice((1.0, 1.5)):.2f}%" if has_cdsc else None,
+            'redemption_fee': f"{rng.choice((1, 2))}%" if has_fee else None,
+        }
+    return terms
+
+
+def _truth(terms: Dict[str, Dict[str, object]]) -> Dict[Tuple[str, str], Optional[str]]:
+    truth = {}
+    for class_name, t in terms.items():
+        truth[('TOTAL_ANNUAL_FUND_OPERATING_EXPENSES', class_name)] = f"{t['fees'][3]:.2f}%"
+        truth[('NET_EXPENSES', class_name)] = f"{t['fees'][5]:.2f}%"
+        truth[('INITIAL_INVESTMENT', class_name)] = t['initial']
+        truth[('MINIMUM_SUBSEQUENT_INVESTMENT_AIP', class_name)] = t['aip']
+        truth[('CDSC', class_name)] = t['cdsc']
+        truth[('REDEMPTION_FEE', class_name)] = t['redemption_fee'] or 'No redemption fee'
+    return truth
+
+
+def _fee_table(terms: Dict[str, Dict[str, object]]) -> List[List[str]]:
+    table = [[''] + list(terms)]
+    for row, label in enumerate(_FEE_ROWS):
+        table.append([label] + [f"{t['fees'][row]:.2f}%" for t in terms.values()])
+    return table
+
+
+def _filler_table(rng: random.Random) -> List[List[str]]:
+    years = ['2021', '2022', '2023', '2024']
+    table = [['Financial Highlights'] + years]
+    for label in ('Net asset value, beginning', 'Net investment income', 'Total return', 'Net assets ($000)'):
+        table.append([label] + [f"{rng.uniform(0.1, 40):.2f}" for _ in years])
+    return table
+
+
+def _paragraph(rng: random.Random, words: int) -> str:
+    text = ' '.join(rng.choices(_VOCABULARY, k=words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def _section_lines(section: str, terms: Dict[str, Dict[str, object]]) -> List[str]:
+    """Text lines of a datapoint section, laid out like real prospectuses."""
+    if section == 'fees':
+        return ['FEES AND EXPENSES OF THE FUND',
+                'Annual Fund Operating Expenses (expenses that you pay each year as a percentage '
+                'of the value of your investment)']
+    if section == 'minimums':
+        lines = ['MINIMUM INVESTMENT']
+        for class_name, t in terms.items():
+            lines += [f"{class_name} Shares",
+                      f"  Initial Investment: {t['initial']}",
+                      f"  Subsequent Investment: {t['subsequent']}",
+                      "  Automatic Investment Plans",
+                      f"    Subsequent Investment: {t['aip']}"]
+        return lines
+    if section == 'cdsc':
+        lines = ['CONTINGENT DEFERRED SALES CHARGE (CDSC)']
+        for class_name, t in terms.items():
+            lines.append(f"{class_name}: 1 year at {t['cdsc']}, 0% after first year" if t['cdsc']
+                         else f"{class_name}: No CDSC")
+        return lines
+    lines = ['REDEMPTION FEES']
+    for class_name, t in terms.items():
+        lines.append(f"{class_name}: {t['redemption_fee']} redemption fee on shares held less than 60 days"
+                     if t['redemption_fee'] else f"{class_name}: No redemption fee")
+    return lines
+
+
+def _layout(rng: random.Random, pages: int, table_density: float) -> List[Tuple[Optional[str], bool]]:
+    """(datapoint section or None, has filler table) for every page."""
+    plan = [[None, rng.random() < table_density] for _ in range(pages)]
+    # Sections are spread through the document rather than packed at the start
+    for section, fraction in (('fees', 0.1), ('minimums', 0.45), ('cdsc', 0.6), ('redemption', 0.75)):
+        page = min(pages - 1, int(fraction * pages))
+        while plan[page][0] is not None and page + 1 < pages:
+            page += 1
+        if plan[page][0] is None:
+            plan[page] = [section, False]
+        else:
+            # Fewer pages than sections: append the section to the last page
+            plan[page][0] += ',' + section
+    return [(section, table) for section, table in plan]
+
+
+# ============================================================================
+# Rendering
+# ============================================================================
+
+def _draw_table(page: "fitz.Page", table: List[List[str]], top: float) -> float:
+    """Draw a ruled table (detected by pdfplumber) and return its bottom edge."""
+    label_width = 200
+    col_width = (PAGE_WIDTH - 2 * MARGIN - label_width) / max(1, len(table[0]) - 1)
+    row_height = 16
+    shape = page.new_shape()
+    for r, row in enumerate(table):
+        y0 = top + r * row_height
+        for c, cell in enumerate(row):
+            x0 = MARGIN if c == 0 else MARGIN + label_width + (c - 1) * col_width
+            x1 = MARGIN + label_width if c == 0 else x0 + col_width
+            shape.draw_rect(fitz.Rect(x0, y0, x1, y0 + row_height))
+            shape.insert_text((x0 + 3, y0 + 11), cell, fontsize=7)
+    shape.finish(color=(0, 0, 0), width=0.5)
+    shape.commit()
+    return top + len(table) * row_height
+
+
+def _render_pdf(rng: random.Random, plan, terms, fund: str) -> bytes:
+    doc = fitz.open()
+    text_rect_width = PAGE_WIDTH - 2 * MARGIN
+    for page_num, (sections, has_table) in enumerate(plan, start=1):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        y = MARGIN
+        page.insert_text((MARGIN, y), f"{fund} Prospectus - page {page_num}", fontsize=9)
+        y += 20
+        for section in (sections.split(',') if sections else []):
+            for line in _section_lines(section, terms):
+                page.insert_text((MARGIN, y), line, fontsize=8)
+                y += 11
+            if section == 'fees':
+                y = _draw_table(page, _fee_table(terms), y + 4) + 12
+        if has_table:
+            y = _draw_table(page, _filler_table(rng), y + 4) + 12
+        if not sections and y < PAGE_HEIGHT - MARGIN - 40:
+            body = '\n\n'.join(_paragraph(rng, 90) for _ in range(4))
+            page.insert_textbox(fitz.Rect(MARGIN, y, MARGIN + text_rect_width, PAGE_HEIGHT - MARGIN),
+                                body, fontsize=8)
+    # Fixed metadata and file ID keep the bytes (and content hash) reproducible
+    doc.set_metadata({'title': f"{fund} Prospectus", 'creationDate': 'D:20240101000000',
+                      'modDate': 'D:20240101000000'})
+    data = doc.tobytes(no_new_id=True)
+    doc.close()
+    return data
+
+
+def _html_table(table: List[List[str]]) -> str:
+    rows = []
+    for r, row in enumerate(table):
+        tag = 'th' if r == 0 else 'td'
+        rows.append('<tr>' + ''.join(f'<{tag}>{html.escape(cell)}</{tag}>' for cell in row) + '</tr>')
+    return '<table>' + ''.join(rows) + '</table>'
+
+
+def _render_html(rng: random.Random, plan, terms, fund: str) -> bytes:
+    parts = [f'<html><head><title>{html.escape(fund)} Prospectus</title></head><body>']
+    for page_num, (sections, has_table) in enumerate(plan, start=1):
+        parts.append(f'<div class="page" id="page-{page_num}">')
+        for section in (sections.split(',') if sections else []):
+            lines = _section_lines(section, terms)
+            parts.append(f'<h2 id="{section}">{html.escape(lines[0])}</h2>')
+            parts.extend(f'<p>{html.escape(line.strip())}</p>' for line in lines[1:])
+            if section == 'fees':
+                parts.append(_html_table(_fee_table(terms)))
+        if has_table:
+            parts.append(_html_table(_filler_table(rng)))
+        if not sections:
+            parts.extend(f'<p>{_paragraph(rng, 90)}</p>' for _ in range(4))
+        parts.append('</div>')
+    parts.append('</body></html>')
+    return '\n'.join(parts).encode('utf-8')
+
+
+def generate_prospectus(pages: int = 20, classes: int = 4, table_density: float = 0.25,
+                        doc_type: str = 'pdf', seed: int = 0) -> SyntheticProspectus:
+    """
+    Generate a synthetic fund prospectus.
+
+    Args:
+        pages: Page count (HTML documents get one <div class="page"> per page)
+        classes: Number of share classes (at most len(CLASS_CODES))
+        table_density: Fraction of pages carrying an extra ruled table
+        doc_type: 'pdf' or 'html'
+        seed: Seed of the random content; equal arguments give identical bytes
+
+    Returns:
+        SyntheticProspectus with the document bytes and the planted values
+    """
+    if doc_type not in ('pdf', 'html'):
+        raise ValueError(f"unsupported document type: {doc_type}")
+    rng = random.Random(seed)
+    class_names = [f"Class {code}" for code in CLASS_CODES[:max(1, min(classes, len(CLASS_CODES)))]]
+    terms = _class_terms(rng, class_names)
+    plan = _layout(rng, max(1, pages), table_density)
+    fund = f"Synthetic Growth Fund {seed}"
+    render = _render_pdf if doc_type == 'pdf' else _render_html
+    return SyntheticProspectus(render(rng, plan, terms, fund), doc_type, len(plan), class_names, _truth(terms))
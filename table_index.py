@@ -0,0 +1,186 @@
+"""
+SmartAlly - Table Index
+Per-document index over the extracted tables, built once at parse time: share
+class header -> column maps, row label lookups and the page each table came
+from. Rule-based table lookups become dictionary hits, and the prompt
+serializer uses the same index to send fee tables to the LLM first.
+"""
+
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Row label phrases (first cell, lowercased) that identify datapoint rows
+ROW_LABELS = {
+    'TOTAL_ANNUAL_FUND_OPERATING_EXPENSES': ('total annual fund operating',),
+    'NET_EXPENSES': ('net expense', 'net annual'),
+}
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+_CLASS_CODE_RE = re.compile(r'[a-z]\d{0,2}')
+_CLASS_WORDS = frozenset(('class', 'shares', 'share'))
+# Header cells announcing a row of share class codes ("Share Class", "Classes")
+_CLASS_HEADER_WORDS = _CLASS_WORDS | {'classes', 'of'}
+
+
+def class_key(label: Any) -> Optional[str]:
+    """
+    Canonical share class code of a header cell or class name.
+
+    "Class A", "A", "A Shares", "Shares A" and "Class A Shares" all map to "A";
+    anything that is not a single class letter (optionally with digits, e.g.
+    "R6") maps to None.
+    """
+    words = [w for w in _WORD_RE.findall(str(label).lower()) if w not in _CLASS_WORDS]
+    if len(words) == 1 and _CLASS_CODE_RE.fullmatch(words[0]):
+        return words[0].upper()
+    return None
+
+
+def names_share_class(cell: Any) -> bool:
+    """
+    Whether a cell names a share class by itself: "Class A", "A Shares".
+
+    A bare letter such as "A" or "(a)" does not; it may be a footnote marker
+    or a Y/N flag.
+    """
+    words = _WORD_RE.findall(str(cell).lower())
+    return class_key(cell) is not None and any(word in _CLASS_WORDS for word in words)
+
+
+def is_class_header(cell: Any) -> bool:
+    """Whether a cell heads a row of share class codes ("Share Class", "Class")."""
+    words = _WORD_RE.findall(str(cell).lower())
+    return bool(words) and all(word in _CLASS_HEADER_WORDS for word in words)
+
+
+def normalize_label(label: Any) -> str:
+    """Lowercase a row label and collapse its whitespace."""
+    return ' '.join(str(label).lower().split())
+
+
+class TableIndex:
+    """Header and row-label maps for every table of one document."""
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.entries = entries
+
+    @classmethod
+    def build(cls, tables: List[List[List[str]]], pages: Optional[List[Optional[int]]] = None) -> "TableIndex":
+        """
+        Index a document's tables.
+
+        Args:
+            tables: Flat list of tables (lists of rows of cells)
+            pages: Page number of each table, if known
+
+        Returns:
+            TableIndex with one entry per table, in the same order
+        """
+        entries = []
+        for position, table in enumerate(tables):
+            columns: Dict[str, Tuple[int, int]] = {}
+            classes = set()
+            labels: Dict[str, int] = {}
+            rows: Dict[str, List[int]] = {}
+            terms = set()
+            for row_idx, row in enumerate(table):
+                if not row:
+                    continue
+                for cell in row:
+                    if cell:
+                        terms.update(_WORD_RE.findall(str(cell).lower()))
+                header_row = any(is_class_header(cell) for cell in row if cell)
+                for col_idx, cell in enumerate(row):
+                    code = class_key(cell)
+                    if code is not None and code not in columns:
+                        columns[code] = (row_idx, col_idx)
+                    # Share classes for certain: named as such, or in a class header row
+                    if code is not None and (header_row or names_share_class(cell)):
+                        classes.add(code)
+
+                label = normalize_label(row[0])
+                labels.setdefault(label, row_idx)
+                for row_key, phrases in ROW_LABELS.items():
+                    if any(phrase in label for phrase in phrases):
+                        rows.setdefault(row_key, []).append(row_idx)
+
+            entries.append({
+                'page': pages[position] if pages else None,
+                'columns': columns,
+                # Column codes that are share classes (not footnotes or flags)
+                'classes': sorted(classes),
+                'labels': labels,
+                'rows': rows,
+                # Words of the table, scored against a datapoint query for prompts
+                'terms': sorted(terms),
+            })
+        return cls(entries)
+
+    @classmethod
+    def from_document_tables(cls, tables_by_page: Dict[int, List[List[List[str]]]]) -> "TableIndex":
+        """Index the page -> tables mapping of a parsed PDF, in page order."""
+        tables = []
+        pages = []
+        for page_num, page_tables in tables_by_page.items():
+            tables.extend(page_tables)
+            pages.extend([page_num] * len(page_tables))
+        return cls.build(tables, pages)
+
+    def to_state(self) -> List[Dict[str, Any]]:
+        """Plain-data form of the index, suitable for the parse cache."""
+        return self.entries
+
+    @classmethod
+    def from_state(cls, state: List[Dict[str, Any]]) -> "TableIndex":
+        return cls(state)
+
+    def cells(self, tables: List[List[List[str]]], row_key: str,
+              class_names: Iterable[str]) -> Iterator[Tuple[str, Optional[int]]]:
+        """
+        Yield the cells at a datapoint row and share class column.
+
+        Only rows at or below the class header row are considered.
+
+        Args:
+            tables: The indexed tables, in the order they were indexed
+            row_key: Key of ROW_LABELS (datapoint name)
+            class_names: Class name variations ("Class A", "A", ...)
+
+        Yields:
+            (cell text, page number) in document order
+        """
+        codes = [code for code in (class_key(name) for name in class_names) if code]
+        for position, entry in enumerate(self.entries):
+            row_idxs = entry['rows'].get(row_key)
+            if not row_idxs:
+                continue
+            header = next((entry['columns'][code] for code in codes if code in entry['columns']), None)
+            if header is None:
+                continue
+            header_row, col_idx = header
+            for row_idx in row_idxs:
+                row = tables[position][row_idx]
+                if row_idx >= header_row and col_idx < len(row):
+                    yield str(row[col_idx]).strip(), entry['page']
+
+    def row(self, tables: List[List[List[str]]], label: str) -> Optional[Tuple[List[str], Optional[int]]]:
+        """Return the first row whose first cell equals a label, with its page."""
+        key = normalize_label(label)
+        for position, entry in enumerate(self.entries):
+            row_idx = entry['labels'].get(key)
+            if row_idx is not None:
+                return tables[position][row_idx], entry['page']
+        return None
+
+    def priority_order(self) -> List[int]:
+        """
+        Table positions ordered for prompts: tables with share class columns and
+        datapoint rows first, then other tables with class columns, then the rest,
+        keeping document order within each group.
+        """
+        def rank(position: int) -> int:
+            entry = self.entries[position]
+            if entry['columns'] and entry['rows']:
+                return 0
+            return 1 if entry['columns'] else 2
+        return sorted(range(len(self.entries)), key=rank)
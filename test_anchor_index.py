@@ -0,0 +1,69 @@
+"""
+Test script for the SmartAlly HTML anchor index
+"""
+
+import marshal
+
+import pandas as pd
+
+import extraction
+import smartally
+from anchor_index import AnchorIndex
+from html_ingest import parse_html_bytes
+from parse_cache import ParseCache
+from position_index import Span
+from retrieval import split_passages
+
+FILING = b"""<html><body>
+<p>Summary of the fund and its investment objectives.</p>
+<a name="fees"></a><h2>Fees and Expenses</h2>
+<div id="fee-section">Annual Fund Operating Expenses
+  <table id="fee-table"><tr><td>Net Expenses</td><td>Class A</td><td id="net-a">1.10%</td></tr>
+  <tr><td>Net Expenses</td><td>Class C</td><td>1.85%</td></tr></table>
+  Fee waivers continue through 2025.
+</div>
+<p>Redemption fees are described below.</p>
+</body></html>"""
+
+
+def build_index(passage_chars: int = 1000):
+    text, anchors = parse_html_bytes(FILING)
+    return text, AnchorIndex.build(anchors, split_passages(text, passage_chars))
+
+
+def test_offsets_resolve_to_the_innermost_enclosing_element():
+    text, index = build_index()
+    assert index.element_at(text.index('1.10%')) == 'net-a'
+    assert index.element_at(text.index('1.85%')) == 'fee-table'
+    assert index.element_at(text.index('Fee waivers')) == 'fee-section'
+    # Outside every element: the nearest anchor before it (an empty <a name> marker)
+    assert index.element_at(text.index('Fees and Expenses')) == 'fees'
+    assert index.element_at(text.index('Redemption')) == 'fee-section'
+    assert index.element_at(0) is None
+
+
+def test_passage_spans_and_state_round_trip():
+    text, index = build_index(passage_chars=60)
+    restored = AnchorIndex.from_state(marshal.loads(marshal.dumps(index.to_state())))
+    passages = split_passages(text, 60)
+    for number, passage in passages.items():
+        start = passage.find('1.85%')
+        if start != -1:
+            assert restored.element_for(Span(number, start, start + 5)) == 'fee-table'
+    assert restored.element_for(Span(99, 0, 1)) is None
+
+
+def test_html_answers_link_to_the_element_holding_the_value(tmp_path, monkeypatch):
+    monkeypatch.setattr(extraction, 'parse_cache', ParseCache(str(tmp_path)))
+    doc_data = extraction.ingest_document('fund.html', FILING)
+    assert extraction.attribute_element(doc_data, '1.85%', 'Net Expenses Class C') == 'fee-table'
+
+    # Served from the parse cache, the index is restored without re-parsing
+    cached = extraction.ingest_document('fund.html', FILING)
+    assert extraction.attribute_element(cached, '1.10%', 'Net Expenses') == 'net-a'
+
+    mapping_df = pd.DataFrame({'Instruction': ['Net expenses for {class}'], 'Datapoint': ['NET_EXPENSES'],
+                               'Class': ['{class}'], 'OutputRule': ['percentage']})
+    response = smartally.chatbot_response('Net expenses for Class A', {'fund.html': doc_data},
+                                          mapping_df, use_llm=False)
+    assert '1.10%' in response and 'Section #net-a' in response
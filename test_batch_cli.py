@@ -0,0 +1,112 @@
+"""
+Test script for the SmartAlly headless batch extraction
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import batch
+from llm_scheduler import LLM_RPM, LLM_TPM
+from parse_cache import ParseCache
+from shared_store import DocumentStore
+
+REPO = Path(__file__).resolve().parent
+
+FILING = """<html><body><pre>
+FEES AND EXPENSES
+Net Expenses (after fee waiver/expense reimbursement)
+  Class A: {net}
+  Class C: 1.85%
+
+MINIMUM INVESTMENT
+Class A Shares
+  Initial Investment: $2,500
+Class C Shares
+  Initial Investment: No minimum
+</pre></body></html>"""
+
+
+def write_filings(directory: Path) -> Path:
+    directory.mkdir()
+    (directory / 'fund_one.html').write_text(FILING.format(net='1.10%'))
+    (directory / 'fund_two.htm').write_text(FILING.format(net='0.95%'))
+    (directory / 'notes.txt').write_text('not a filing')
+    return directory
+
+
+def test_batch_run_writes_results_and_resumes_from_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch.extraction, 'parse_cache', ParseCache(str(tmp_path / 'cache')))
+    store = DocumentStore()
+    monkeypatch.setattr(batch.extraction, 'document_store', store)
+    inputs = batch.discover_inputs(str(write_filings(tmp_path / 'filings')))
+    assert [p.name for p in inputs] == ['fund_one.html', 'fund_two.htm']
+
+    output = tmp_path / 'out' / 'results.csv'
+    status = batch.run_batch(inputs, output, use_llm=False, workers=1)
+    assert status['status'].tolist() == ['ok', 'ok']
+    assert status['classes'].tolist() == ['Class A, Class C', 'Class A, Class C']
+
+    results = pd.read_csv(output)
+    net = results[(results['datapoint'] == 'NET_EXPENSES') & (results['class'] == 'Class A')]
+    assert net['value'].tolist() == ['1.10%', '0.95%']
+    initial = results[(results['datapoint'] == 'INITIAL_INVESTMENT') & (results['document'] == 'fund_one.html')]
+    assert initial['value'].tolist() == ['$2500', 'No minimum']
+    assert (tmp_path / 'out' / 'results_status.csv').exists()
+    # Each document is read once: none is kept in the shared store
+    assert len(store) == 0
+
+    # A restarted run only extracts the documents that are not done yet
+    progress = []
+    batch.run_batch(inputs, output, use_llm=False, workers=1, on_progress=lambda *a: progress.append(a))
+    assert progress == []
+    (inputs[1]).write_text(FILING.format(net='0.90%'))
+    batch.run_batch(inputs, output, use_llm=False, workers=1, on_progress=lambda *a: progress.append(a))
+    assert [(done, total, record['document']) for done, total, record in progress] == [(2, 2, 'fund_two.htm')]
+    assert '0.90%' in pd.read_csv(output)['value'].tolist()
+
+
+def test_cli_runs_in_a_process_pool_without_streamlit(tmp_path):
+    filings = write_filings(tmp_path / 'filings')
+    manifest = tmp_path / 'manifest.txt'
+    manifest.write_text('# nightly run\nfilings/fund_one.html\nfilings/fund_two.htm\nfilings/missing.pdf\n')
+    output = tmp_path / 'results.xlsx'
+
+    script = (
+        "import sys, smartally_cli\n"
+        f"code = smartally_cli.main(['batch', {str(manifest)!r}, '-o', {str(output)!r},"
+        " '--mode', 'rules', '--workers', '2'])\n"
+        "assert 'streamlit' not in sys.modules\n"
+        "sys.exit(code)\n"
+    )
+    env = {'PATH': '', 'SMARTALLY_PARSE_CACHE_DIR': str(tmp_path / 'cache'), 'OPENAI_API_KEY': ''}
+    completed = subprocess.run([sys.executable, '-c', script], cwd=REPO, env=env,
+                               capture_output=True, text=True, timeout=120)
+    # The missing document fails the run but not the other documents
+    assert completed.returncode == 1, completed.stderr
+    assert filings.exists()
+
+    status = pd.read_excel(output, sheet_name='status')
+    assert status['status'].tolist() == ['ok', 'ok', 'error']
+    assert 'FileNotFoundError' in status['error'].iloc[2]
+    results = pd.read_excel(output, sheet_name='results')
+    assert set(results['document']) == {'fund_one.html', 'fund_two.htm'}
+
+
+def scheduler_limits(_):
+    """Requests and tokens per minute of the worker process running this task."""
+    import extraction
+    scheduler = extraction.llm_scheduler
+    return scheduler.requests.capacity, scheduler.tokens.capacity
+
+
+def test_workers_share_the_llm_rate_limits():
+    with batch.worker_pool(3) as pool:
+        limits = set(pool.map(scheduler_limits, range(6)))
+    # Every worker gets a third: together they stay at the configured limits
+    assert limits == {(LLM_RPM / 3, LLM_TPM / 3)}
+    rpm, tpm = limits.pop()
+    assert 3 * rpm == pytest.approx(LLM_RPM) and 3 * tpm == pytest.approx(LLM_TPM)
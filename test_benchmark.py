@@ -0,0 +1,51 @@
+"""
+Test script for the synthetic prospectus generator and the benchmark suite
+"""
+
+import copy
+import json
+
+import extraction
+from benchmark import compare_reports, is_correct, isolated_parse_cache, percentile, run_benchmark
+from synthetic_prospectus import generate_prospectus
+
+
+def test_generated_pdf_is_deterministic_and_its_values_are_extractable():
+    prospectus = generate_prospectus(pages=4, classes=3, table_density=0.5, doc_type='pdf', seed=7)
+    assert prospectus.data == generate_prospectus(4, 3, 0.5, 'pdf', seed=7).data
+    assert prospectus.classes == ['Class A', 'Class C', 'Class I']
+
+    with isolated_parse_cache():
+        doc_data = extraction.ingest_document('synthetic.pdf', prospectus.data)
+    assert doc_data['page_count'] == 4
+    for class_name in prospectus.classes:
+        for datapoint in ('TOTAL_ANNUAL_FUND_OPERATING_EXPENSES', 'NET_EXPENSES', 'INITIAL_INVESTMENT'):
+            value, _, page = extraction.extract_document_datapoint(doc_data, datapoint, class_name, 'text')
+            assert is_correct(value, prospectus.truth[(datapoint, class_name)]), (datapoint, class_name, value)
+
+
+def test_report_is_json_and_regressions_are_flagged():
+    report = run_benchmark([3], classes=2, doc_types=['html'], repeat=2)
+    report = json.loads(json.dumps(report))
+
+    run = report['runs'][0]
+    assert run['pages'] == 3 and run['classes'] == 2
+    assert set(run['stages']) == {'parse_html', 'build_indexes', 'ingest_document_cold', 'ingest_document_warm'}
+    assert all(len(stats['seconds']) == 2 and stats['peak_kib'] > 0 for stats in run['stages'].values())
+    assert run['extraction']['queries'] == 12
+    assert set(run['extraction']['latency_ms']) == {'p50', 'p90', 'p99', 'max'}
+
+    slower = copy.deepcopy(report)
+    slower['runs'][0]['stages']['parse_html']['median_s'] *= 2
+    rows = {row['stage']: row for row in compare_reports(slower, report)}
+    assert rows['parse_html']['regression'] and rows['parse_html']['ratio'] == 2
+    assert not rows['build_indexes']['regression']
+
+
+def test_percentile_and_correctness_rules():
+    assert percentile([5, 1, 3, 2, 4], 50) == 3
+    assert percentile([5, 1, 3, 2, 4], 99) == 5
+    assert is_correct('$2500', '$2,500')
+    assert is_correct('1 year, 1.00% then 0%', '1.00%')
+    assert is_correct('0', None) and not is_correct('1.00%', None)
+    assert not is_correct('0', 'No minimum')
@@ -0,0 +1,52 @@
+"""
+Test script for the SmartAlly document blob store and answer links
+"""
+
+import pandas as pd
+
+from blob_store import BlobStore
+from smartally import chatbot_response, generate_hyperlink
+
+MAPPING_DF = pd.read_csv('datapoint_mapping.csv')
+
+
+def test_identical_documents_are_stored_once():
+    store = BlobStore(max_bytes=1024)
+    data = b'%PDF-1.4 fund prospectus'
+
+    first = store.put(data, 'a.pdf', 'application/pdf')
+    second = store.put(bytes(data), 'copy.pdf', 'application/pdf')
+
+    assert first == second
+    assert len(store) == 1
+    assert store.get(first).data is data
+
+
+def test_least_recently_used_blobs_are_evicted():
+    store = BlobStore(max_bytes=10)
+    old = store.put(b'123456', 'old.pdf', 'application/pdf')
+    new = store.put(b'abcdef', 'new.pdf', 'application/pdf')
+
+    assert store.get(old) is None
+    assert store.get(new).name == 'new.pdf'
+    assert store.size == 6
+
+
+def test_hyperlink_points_at_the_page_of_the_served_document():
+    link = generate_hyperlink('pdf', 'fee table', 4, doc_name='fund.pdf', doc_url='/media/abc.pdf', value='1.10%')
+    assert 'href="/media/abc.pdf#page=4"' in link
+    assert 'data:' not in link
+
+
+def test_answer_size_does_not_depend_on_document_size():
+    pages = {1: 'Cover', 2: 'Net Expenses Class A 1.10%'}
+    tables = {2: [[['', 'Class A'], ['Net Expenses', '1.10%']]]}
+    answers = []
+    for size in (1_000, 5_000_000):
+        parsed_docs = {'fund.pdf': {'type': 'pdf', 'pages': pages, 'tables': tables, 'sha256': f'doc-{size}',
+                                    'file_bytes': b'x' * size}}
+        answers.append(chatbot_response('Net expenses for Class A', parsed_docs, MAPPING_DF, use_llm=False,
+                                        doc_urls={f'doc-{size}': '/media/abc.pdf'}))
+
+    assert '1.10%' in answers[0]
+    assert len(answers[0]) == len(answers[1]) < 2000
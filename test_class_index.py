@@ -0,0 +1,58 @@
+"""
+Test script for the SmartAlly share class index
+"""
+
+import pandas as pd
+
+import batch
+import extraction
+from benchmark import isolated_parse_cache
+from class_index import ShareClassIndex
+from table_index import TableIndex
+from synthetic_prospectus import generate_prospectus
+
+MAPPING_DF = pd.read_csv('datapoint_mapping.csv')
+
+
+def test_share_classes_are_indexed_at_parse_time():
+    for doc_type in ('pdf', 'html'):
+        prospectus = generate_prospectus(pages=8, classes=3, table_density=0.25, doc_type=doc_type, seed=25)
+        with isolated_parse_cache():
+            doc_data = extraction.ingest_document(f'fund.{doc_type}', prospectus.data, parse_workers=1)
+
+        class_index = doc_data['class_index']
+        assert extraction.document_classes(doc_data) == prospectus.classes
+        assert batch.discover_share_classes(doc_data) == prospectus.classes
+        assert all(class_index.pages(class_name) for class_name in prospectus.classes)
+
+        restored = ShareClassIndex.from_state(class_index.to_state())
+        assert restored.class_names == prospectus.classes
+
+    # Footnote markers and Y/N flags are not share classes
+    tables = [
+        [['', 'Class A', 'Class C'], ['Net Expenses', '1.10%', '1.85% (b)'], ['(d)', 'Waiver', 'through 2026']],
+        [['Share Class', 'I', 'R6'], ['Minimum', '$1,000,000', 'None']],
+        [['Feature', 'Eligible'], ['Exchange privilege', 'Y'], ['Checkwriting', 'N']],
+    ]
+    class_index = ShareClassIndex.build({1: 'See note (d). Exchanges: Y'}, TableIndex.build(tables, [1, 2, 3]))
+    assert class_index.class_names == ['Class A', 'Class C', 'Class I', 'Class R6']
+    assert class_index.pages('Class A') == [1]
+    assert not class_index.offers('Class D') and not class_index.offers('Class Y')
+
+    # Single-class documents name no classes: nothing is ruled out
+    assert ShareClassIndex.build({1: 'The Fund offers one class of shares.'}).offers('Class Z')
+
+
+def test_absent_class_is_answered_without_extraction(monkeypatch):
+    pages = {1: 'Class A Shares and Class C Shares are offered by this prospectus.',
+             2: 'Net Expenses Class A 1.10% Class C 1.85%'}
+    doc_data = {'type': 'html', 'text': '\n'.join(pages.values()), 'passages': pages,
+                'sha256': 'doc-classes', 'class_index': ShareClassIndex.build(pages)}
+    assert extraction.document_classes(doc_data) == ['Class A', 'Class C']
+
+    def no_extraction(*args, **kwargs):
+        raise AssertionError('extracted an absent class')
+    monkeypatch.setattr(extraction, 'extract_datapoint', no_extraction)
+
+    assert extraction.extract_document_datapoint(doc_data, 'NET_EXPENSES', 'Class I', 'percentage') == ("0", None, None)
+    assert extraction.document_offers_class(doc_data, 'Class C')
@@ -0,0 +1,78 @@
+"""
+Test script for the SmartAlly compact document layout
+"""
+
+import marshal
+import mmap
+
+import extraction
+from document_layout import PageText, compact_tables, spill_bytes
+from parse_cache import ParseCache
+from shared_store import DocumentStore
+from synthetic_prospectus import generate_prospectus
+
+PAGES = {1: 'Summary\nClass A', 2: '', 3: 'Net Expenses 1.10%'}
+
+
+def test_page_text_is_one_buffer_behaving_like_a_dict():
+    pages = PageText.from_pages(PAGES)
+    assert pages == PAGES and list(pages) == [1, 2, 3] and len(pages) == 3
+    assert pages.text == '\n'.join(PAGES.values())
+    assert pages[3] == 'Net Expenses 1.10%' and pages.get(4) is None
+
+    restored = PageText.from_state(marshal.loads(marshal.dumps(pages.to_state())))
+    assert restored == PAGES
+
+    text = 'first passage second passage'
+    passages = PageText.from_slices(text, {1: 'first passage ', 2: 'second passage'})
+    assert passages.text is text and passages[2] == 'second passage'
+
+
+def test_tables_are_tuples_of_interned_cells():
+    tables = compact_tables({4: [[['', 'Class ' + 'A'], ['Net Expenses', None]]]})
+    assert tables == {4: [(('', 'Class A'), ('Net Expenses', None))]}
+    assert tables[4][0][0][1] is compact_tables({1: [[['Class A']]]})[1][0][0][0]
+
+
+def test_spilled_documents_are_memory_mapped_and_still_parse(tmp_path, monkeypatch):
+    assert spill_bytes(b'tiny', min_kb=1) == b'tiny'
+    assert spill_bytes(b'%PDF' * 512, min_kb=-1) == b'%PDF' * 512
+
+    data = generate_prospectus(pages=6, classes=2, table_density=0.5, doc_type='pdf', seed=1).data
+    monkeypatch.setattr(extraction, 'spill_bytes', lambda b: spill_bytes(b, min_kb=0))
+    monkeypatch.setattr(extraction, 'parse_cache', ParseCache(str(tmp_path)))
+    monkeypatch.setattr(extraction, 'document_store', DocumentStore(max_bytes=0))
+    doc_data = extraction.ingest_document('fund.pdf', data, parse_workers=1)
+
+    assert isinstance(doc_data['file_bytes'], mmap.mmap) and doc_data['file_bytes'][:] == data
+    assert isinstance(doc_data['pages'], PageText)
+    assert extraction.document_inputs(doc_data)[0] is doc_data['pages'].text
+    # Lazy table loading reads the spilled bytes back
+    doc_data['tables_pending'] = [1]
+    assert extraction.ensure_all_tables(doc_data) and doc_data['tables_pending'] == []
+
+    cached = extraction.ingest_document('fund.pdf', data)
+    assert cached['pages'] == doc_data['pages'] and cached['tables'] == doc_data['tables']
+
+    # Callers holding the bytes anyway (the app's blob store) share them instead
+    assert extraction.ingest_document('fund.pdf', data, spill=False)['file_bytes'] is data
+
+
+def test_pending_tables_load_serially_inside_parallel_work(tmp_path, monkeypatch):
+    requested = []
+
+    def load(doc_data, workers=None):
+        requested.append(workers)
+        doc_data['tables_pending'] = []
+    monkeypatch.setattr(extraction, 'load_pending_tables', load)
+    monkeypatch.setattr(extraction, 'parse_cache', ParseCache(str(tmp_path)))
+    monkeypatch.setattr(extraction, 'document_store', DocumentStore(max_bytes=0))
+    doc_data = extraction.ingest_document('fund.pdf', generate_prospectus(pages=4, seed=3).data, parse_workers=1)
+
+    doc_data['tables_pending'] = [1]
+    extraction.ensure_all_tables(doc_data)
+    # Batch workers and prefetch threads already run in parallel
+    doc_data['tables_pending'] = [1]
+    with extraction.parsing_with_workers(1):
+        extraction.ensure_all_tables(doc_data)
+    assert requested == [None, 1]
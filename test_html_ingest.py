@@ -0,0 +1,42 @@
+"""
+Test script for the SmartAlly lxml HTML ingest
+"""
+
+from bs4 import BeautifulSoup
+
+from html_ingest import decode_html, detect_encoding, parse_html_bytes
+
+FILING = b"""<html><head><title>Fund</title><style>p { margin: 0 }</style></head><body>
+<div id="fees">Annual Fund Operating Expenses
+  <table id="fee-table"><tr><td>Net Expenses</td><td id="net-a">1.10%</td></tr></table>
+  <!-- reviewed --> after the table
+</div>
+<p id="empty"></p><p>Redemption fee &amp; exchanges&nbsp;policy</p>
+</body></html>"""
+
+
+def test_text_matches_get_text_and_anchors_are_offsets():
+    text, anchors = parse_html_bytes(FILING)
+    soup = BeautifulSoup(FILING, 'html.parser')
+    assert text == soup.get_text(separator=' ', strip=True)
+
+    assert set(anchors) == {'fees', 'fee-table', 'net-a', 'empty'}
+    for element_id, (start, end) in anchors.items():
+        assert text[start:end] == soup.find(id=element_id).get_text(separator=' ', strip=True)
+    # Nested ids share the text of their ancestors instead of copying it
+    assert anchors['fees'][0] <= anchors['fee-table'][0] <= anchors['net-a'][0] < anchors['net-a'][1]
+
+
+def test_encoding_is_detected_once_from_bom_or_meta():
+    assert detect_encoding(b'\xef\xbb\xbf<html>') == 'utf-8-sig'
+    assert detect_encoding(b'<meta http-equiv="Content-Type" content="text/html; charset=ISO-8859-1">') == 'iso8859-1'
+    assert detect_encoding(b'<html><body>no declaration') is None
+
+    cp1252 = b'<html><head><meta charset="windows-1252"></head><body id="q">\x93Class A\x94</body></html>'
+    assert parse_html_bytes(cp1252) == ('“Class A”', {'q': (0, 9)})
+    # Undeclared and not UTF-8: Windows-1252
+    assert decode_html(b'caf\xe9') == 'café'
+    # XHTML with an XML declaration, and empty documents
+    assert parse_html_bytes('<?xml version="1.0" encoding="utf-8"?><p id="x">Café</p>'.encode()) == \
+        ('Café', {'x': (0, 4)})
+    assert parse_html_bytes(b'') == ("", {})
@@ -0,0 +1,34 @@
+"""
+Test script for the SmartAlly local intent resolver
+"""
+
+import pandas as pd
+
+from intent import INTENT_CONFIDENCE_THRESHOLD, extract_share_class, resolve_intent
+
+MAPPING_DF = pd.read_csv('datapoint_mapping.csv')
+
+
+def test_common_questions_resolve_confidently():
+    questions = {
+        'What is the total annual fund operating expenses for Class A?': 'TOTAL_ANNUAL_FUND_OPERATING_EXPENSES',
+        'Net expenses for Class C': 'NET_EXPENSES',
+        'Subsequent investment under automatic investment plans for class A shares': 'MINIMUM_SUBSEQUENT_INVESTMENT_AIP',
+        'Initial investment Class C': 'INITIAL_INVESTMENT',
+        'CDSC Class I': 'CDSC',
+        'Redemption Fee for Class Z': 'REDEMPTION_FEE',
+    }
+    for question, datapoint in questions.items():
+        intent = resolve_intent(question, MAPPING_DF)
+        assert intent.datapoint == datapoint, question
+        assert intent.confidence >= INTENT_CONFIDENCE_THRESHOLD, question
+
+
+def test_missing_class_or_vague_question_is_low_confidence():
+    assert resolve_intent('Net expenses', MAPPING_DF).confidence < INTENT_CONFIDENCE_THRESHOLD
+    assert resolve_intent('How much does it cost for Class A?', MAPPING_DF).confidence < INTENT_CONFIDENCE_THRESHOLD
+
+
+def test_share_class_extraction():
+    assert extract_share_class('fees (class r)') == 'Class R'
+    assert extract_share_class('no class here') is None
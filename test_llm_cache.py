@@ -0,0 +1,51 @@
+"""
+Test script for the SmartAlly LLM response cache
+"""
+
+from llm_cache import LLMCache, make_cache_key
+
+
+def test_key_changes_with_model_and_prompt_version():
+    base = make_cache_key('doc', 'CDSC', 'Class C', 'gpt-4', '1')
+    assert base == make_cache_key('doc', 'CDSC', 'Class C', 'gpt-4', '1')
+    assert base != make_cache_key('doc', 'CDSC', 'Class C', 'gpt-4o', '1')
+    assert base != make_cache_key('doc', 'CDSC', 'Class C', 'gpt-4', '2')
+    assert base != make_cache_key('other-doc', 'CDSC', 'Class C', 'gpt-4', '1')
+
+
+def test_memory_then_disk_tier(tmp_path):
+    db_path = str(tmp_path / 'llm.sqlite3')
+    key = make_cache_key('doc', 'NET_EXPENSES', 'Class A', 'gpt-4', '1')
+    result = {'value': '1.10%', 'location': 'fee table', 'page': 3}
+
+    cache = LLMCache(db_path)
+    assert cache.get(key) is None
+    cache.put(key, result, 'gpt-4', '1')
+    assert cache.get(key) == result
+    assert cache.stats() == {'hits': 1, 'memory_hits': 1, 'disk_hits': 0, 'misses': 1}
+
+    # Callers modifying an answer do not change the cached entry
+    cache.get(key)['page'] = 7
+    result['location'] = 'elsewhere'
+    assert cache.get(key) == {'value': '1.10%', 'location': 'fee table', 'page': 3}
+
+    # A fresh process only has the SQLite tier
+    restarted = LLMCache(db_path)
+    assert restarted.get(key) == {'value': '1.10%', 'location': 'fee table', 'page': 3}
+    assert restarted.stats()['disk_hits'] == 1
+
+
+def test_ttl_expiry(tmp_path):
+    cache = LLMCache(str(tmp_path / 'llm.sqlite3'), ttl_seconds=-1)
+    cache.put('key', {'value': '0'}, 'gpt-4', '1')
+    assert cache.get('key') is None
+
+
+def test_invalidate_stale_drops_other_models(tmp_path):
+    cache = LLMCache(str(tmp_path / 'llm.sqlite3'))
+    cache.put('old', {'value': '1%'}, 'gpt-3.5-turbo', '1')
+    cache.put('current', {'value': '2%'}, 'gpt-4', '1')
+
+    assert cache.invalidate_stale('gpt-4', '1') == 1
+    assert cache.get('old') is None
+    assert cache.get('current') == {'value': '2%'}
@@ -0,0 +1,326 @@
+"""
+Test script for SmartAlly LLM extraction using a canned chat completion client
+"""
+
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import batch
+import extraction
+import smartally
+from llm_cache import LLMCache
+from parse_cache import ParseCache
+
+MAPPING_DF = pd.read_csv('datapoint_mapping.csv')
+
+
+class FakeCompletions:
+    """Returns queued JSON payloads (or a responder's payload) and records every request."""
+
+    def __init__(self, payloads, responder=None):
+        self.payloads = list(payloads)
+        self.responder = responder
+        self.requests = []
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        payload = self.responder(kwargs) if self.responder else self.payloads.pop(0)
+        content = json.dumps(payload)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class FakeAsyncCompletions:
+    """Async facade over FakeCompletions with a simulated network latency."""
+
+    def __init__(self, completions, delay=0.0):
+        self.completions = completions
+        self.delay = delay
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.delay)
+        return self.completions.create(**kwargs)
+
+
+class FakeAsyncClient:
+    def __init__(self, completions, delay=0.0):
+        self.chat = SimpleNamespace(completions=FakeAsyncCompletions(completions, delay))
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_llm(monkeypatch, tmp_path):
+    def install(*payloads, responder=None, delay=0.0):
+        completions = FakeCompletions(payloads, responder)
+        monkeypatch.setattr(extraction, 'client', SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        monkeypatch.setattr(extraction, '_make_async_client', lambda: FakeAsyncClient(completions, delay))
+        # Drop the shared client an earlier test left on the LLM loop
+        monkeypatch.setattr(extraction, '_async_client', None)
+        monkeypatch.setattr(extraction, 'llm_cache', LLMCache(str(tmp_path / 'llm.sqlite3')))
+        monkeypatch.setenv('OPENAI_API_KEY', 'test-key')
+        return completions
+    return install
+
+
+GRID_RESPONSE = {
+    'classes': ['Class A', 'Class C'],
+    'datapoints': {
+        'NET_EXPENSES': {
+            'Class A': {'value': '1.10%', 'location': 'fee table', 'context': 'net expenses waiver'},
+            'Class C': {'value': '1.85%', 'location': 'fee table', 'context': 'net expenses waiver'},
+        },
+    },
+}
+
+PAGES = {1: 'Cover page', 2: 'Net Expenses after fee waiver 1.10% 1.85%'}
+
+
+def test_single_extraction_is_memoized(fake_llm):
+    completions = fake_llm({'value': '1.19%', 'location': 'fee table', 'context': 'total annual fund'})
+
+    first = smartally.extract_datapoint_with_llm('text', [], 'TOTAL_ANNUAL_FUND_OPERATING_EXPENSES',
+                                                 'Class A', 'percentage', doc_hash='doc-1')
+    second = smartally.extract_datapoint_with_llm('text', [], 'TOTAL_ANNUAL_FUND_OPERATING_EXPENSES',
+                                                  'Class A', 'percentage', doc_hash='doc-1')
+
+    assert first == second == ('1.19%', 'fee table', None)
+    assert len(completions.requests) == 1
+
+
+def test_batch_grid_answers_follow_up_questions(fake_llm):
+    completions = fake_llm(GRID_RESPONSE)
+    grid = smartally.extract_all_datapoints_with_llm('text', [], MAPPING_DF, PAGES, doc_hash='doc-1')
+
+    assert len(completions.requests) == 1
+    assert smartally.lookup_extraction_grid(grid, 'NET_EXPENSES', 'Class C') == ('1.85%', 'fee table', 2)
+    # Class not offered by the document: answered without another call
+    assert smartally.lookup_extraction_grid(grid, 'NET_EXPENSES', 'Class Z') == ('0', None, None)
+    # Offered class but missing cell: caller falls back to a single extraction
+    assert smartally.lookup_extraction_grid(grid, 'CDSC', 'Class A') is None
+
+
+def test_grid_is_cached_per_share_class_list(fake_llm):
+    completions = fake_llm(responder=lambda request: GRID_RESPONSE)
+    for share_classes in (['Class A', 'Class C'], ['Class C', 'Class A'], ['Class A', 'Class C', 'Class I']):
+        smartally.extract_all_datapoints_with_llm('text', [], MAPPING_DF, PAGES, doc_hash='doc-1',
+                                                  share_classes=share_classes)
+    # A class list grown by lazily loaded tables asks again
+    assert len(completions.requests) == 2
+
+
+def test_chatbot_response_uses_one_call_per_document(fake_llm):
+    completions = fake_llm(GRID_RESPONSE)
+    parsed_docs = {'fund.pdf': {'type': 'pdf', 'pages': PAGES, 'tables': {}, 'sha256': 'doc-1'}}
+
+    first = smartally.chatbot_response('Net expenses for Class A', parsed_docs, MAPPING_DF, batch_mode=True)
+    second = smartally.chatbot_response('Net expenses for Class C', parsed_docs, MAPPING_DF, batch_mode=True)
+
+    assert '1.10%' in first
+    assert '1.85%' in second
+    # Both questions are resolved locally; one extraction call for the document
+    assert len(completions.requests) == 1
+
+
+def test_unclear_question_falls_back_to_llm_prompt_parsing(fake_llm):
+    completions = fake_llm({'datapoint': 'NET_EXPENSES', 'class': 'Class A'}, GRID_RESPONSE)
+    parsed_docs = {'fund.pdf': {'type': 'pdf', 'pages': PAGES, 'tables': {}, 'sha256': 'doc-1'}}
+
+    answer = smartally.chatbot_response('What do A shares cost me each year after waivers?',
+                                        parsed_docs, MAPPING_DF, batch_mode=True)
+
+    assert '1.10%' in answer
+    # Prompt-parsing call plus the extraction call
+    assert len(completions.requests) == 2
+
+
+def test_documents_are_extracted_concurrently_in_order(fake_llm, monkeypatch):
+    def responder(request):
+        prompt = request['messages'][1]['content']
+        fund = next(name for name in ('Alpha', 'Beta', 'Gamma') if name in prompt)
+        return {'value': f'{fund} 1.00%', 'location': 'fee table', 'context': ''}
+
+    completions = fake_llm(responder=responder, delay=0.3)
+    parsed_docs = {
+        f'{fund}.pdf': {'type': 'pdf', 'pages': {1: f'{fund} Fund net expenses'}, 'tables': {}, 'sha256': fund}
+        for fund in ('Gamma', 'Alpha', 'Beta')
+    }
+
+    started = time.perf_counter()
+    results = smartally.extract_documents_with_llm(parsed_docs, 'NET_EXPENSES', 'Class A', 'percentage', MAPPING_DF)
+    elapsed = time.perf_counter() - started
+
+    assert list(results) == ['Gamma.pdf', 'Alpha.pdf', 'Beta.pdf']
+    assert [value for value, _, _ in results.values()] == ['Gamma 1.00%', 'Alpha 1.00%', 'Beta 1.00%']
+    assert len(completions.requests) == 3
+    # Roughly the latency of one call, not three
+    assert elapsed < 0.8
+
+
+def test_questions_share_one_async_client(fake_llm, monkeypatch):
+    completions = fake_llm(responder=lambda request: {'value': '1.10%', 'location': 'fee table', 'context': ''})
+    created = []
+    monkeypatch.setattr(extraction, '_make_async_client',
+                        lambda: created.append(FakeAsyncClient(completions)) or created[-1])
+    parsed_docs = {'fund.pdf': {'type': 'pdf', 'pages': {1: 'net expenses'}, 'tables': {}, 'sha256': 'doc-1'}}
+
+    for class_name in ('Class A', 'Class C'):
+        smartally.extract_documents_with_llm(parsed_docs, 'NET_EXPENSES', class_name, 'percentage', MAPPING_DF)
+    assert len(completions.requests) == 2 and len(created) == 1
+
+    # Callbacks and error reports run on the asking thread, not the loop's
+    callers = []
+
+    async def work(on_partial):
+        extraction.report_error('failed')
+        on_partial('fund.pdf', {})
+        return threading.current_thread()
+
+    with extraction.reporting_errors_to(lambda message: callers.append(threading.current_thread())):
+        loop_thread = extraction._run_on_llm_loop(
+            lambda in_caller: work(in_caller(lambda *args: callers.append(threading.current_thread()))))
+    assert loop_thread is not threading.current_thread()
+    assert callers == [threading.current_thread()] * 2
+
+
+def test_timed_out_document_reports_not_found(fake_llm, monkeypatch):
+    fake_llm(responder=lambda request: {'value': '1%', 'location': 'x', 'context': ''}, delay=0.5)
+    monkeypatch.setattr(extraction, 'LLM_CALL_TIMEOUT', 0.05)
+    parsed_docs = {'slow.pdf': {'type': 'pdf', 'pages': {1: 'net expenses'}, 'tables': {}, 'sha256': 'slow'}}
+
+    results = smartally.extract_documents_with_llm(parsed_docs, 'NET_EXPENSES', 'Class A', 'percentage', MAPPING_DF)
+    assert results == {'slow.pdf': ('0', None, None)}
+
+
+def test_failed_grid_is_not_kept_on_the_shared_document(fake_llm, monkeypatch):
+    reported = []
+    monkeypatch.setattr(extraction, '_error_reporter', reported.append)
+    grid_failures = [RuntimeError('rate limited')]
+
+    def responder(request):
+        if 'DATAPOINTS TO EXTRACT' not in request['messages'][1]['content']:
+            return {'value': '1.10%', 'location': 'fee table', 'context': ''}
+        if grid_failures:
+            raise grid_failures.pop()
+        return GRID_RESPONSE
+
+    fake_llm(responder=responder)
+    doc_data = {'type': 'pdf', 'pages': PAGES, 'tables': {}, 'sha256': 'doc-1'}
+    parsed_docs = {'fund.pdf': doc_data}
+
+    # The failed grid falls back to a single extraction for this question only
+    first = extraction.extract_documents_with_llm(parsed_docs, 'NET_EXPENSES', 'Class A', 'percentage',
+                                                  MAPPING_DF, batch_mode=True)
+    assert first == {'fund.pdf': ('1.10%', 'fee table', 2)}
+    assert 'extraction_grid' not in doc_data and len(reported) == 1
+
+    second = extraction.extract_documents_with_llm(parsed_docs, 'NET_EXPENSES', 'Class C', 'percentage',
+                                                   MAPPING_DF, batch_mode=True)
+    assert second == {'fund.pdf': ('1.85%', 'fee table', 2)}
+    assert doc_data['extraction_grid']['classes'] == ['Class A', 'Class C']
+
+
+def test_html_passages_are_labelled_as_passages(fake_llm):
+    completions = fake_llm(responder=lambda request: {'value': '1.10%', 'location': 'fees', 'context': ''})
+    passages = {1: 'Fees and Expenses', 2: 'Net Expenses Class A 1.10%'}
+    parsed_docs = {'fund.html': {'type': 'html', 'text': '\n'.join(passages.values()), 'passages': passages,
+                                 'sha256': 'doc-html'}}
+
+    smartally.extract_documents_with_llm(parsed_docs, 'NET_EXPENSES', 'Class A', 'percentage', MAPPING_DF)
+    prompt = completions.requests[0]['messages'][1]['content']
+    assert '[Passage 2]' in prompt and '[Page ' not in prompt
+
+
+def test_fee_table_on_a_page_without_trigger_phrase_is_loaded_on_a_miss(fake_llm, monkeypatch, tmp_path):
+    def responder(request):
+        prompt = request['messages'][1]['content']
+        if '1.10%' not in prompt:
+            return {'classes': ['Class A'], 'datapoints': {}} if 'DATAPOINTS TO EXTRACT' in prompt \
+                else {'value': '0', 'location': 'not found', 'context': ''}
+        if 'DATAPOINTS TO EXTRACT' in prompt:
+            return {'classes': ['Class A'], 'datapoints': {'NET_EXPENSES': {
+                'Class A': {'value': '1.10%', 'location': 'fee table', 'context': ''}}}}
+        return {'value': '1.10%', 'location': 'fee table', 'context': ''}
+
+    fake_llm(responder=responder)
+    monkeypatch.setattr(extraction, 'parse_cache', ParseCache(str(tmp_path / 'parse')))
+
+    def load_pending_tables(doc_data, workers=None):
+        # The fee table sits on page 3, which has no trigger phrase
+        doc_data['tables'] = {3: [[['', 'Class A'], ['Net Expenses', '1.10%']]]}
+        doc_data['tables_pending'] = []
+    monkeypatch.setattr(extraction, 'load_pending_tables', load_pending_tables)
+
+    def make_document(sha256):
+        doc_data = {'type': 'pdf', 'pages': {1: 'Class A Shares', 2: 'Summary', 3: 'Expense summary'},
+                    'tables': {}, 'tables_pending': [3], 'sha256': sha256}
+        extraction.compact_document(doc_data)
+        extraction.build_document_indexes(doc_data)
+        return doc_data
+
+    for batch_mode in (False, True):
+        doc_data = make_document(f'doc-lazy-{batch_mode}')
+        results = smartally.extract_documents_with_llm({'fund.pdf': doc_data}, 'NET_EXPENSES', 'Class A',
+                                                       'percentage', MAPPING_DF, batch_mode)
+        assert results['fund.pdf'][0] == '1.10%' and doc_data['tables_pending'] == []
+
+    # Batch and prefetch runs retry the same way
+    _, answers = batch.extract_document_answers(make_document('doc-lazy-batch'), MAPPING_DF, ['Class A'],
+                                                use_llm=True)
+    assert answers[('NET_EXPENSES', 'Class A')][0] == '1.10%'
+
+
+def test_class_named_only_in_a_pending_table_is_not_ruled_out(fake_llm, monkeypatch, tmp_path):
+    completions = fake_llm(responder=lambda request: {'value': '0.85%', 'location': 'fee table', 'context': ''})
+    monkeypatch.setattr(extraction, 'parse_cache', ParseCache(str(tmp_path / 'parse')))
+
+    def load_pending_tables(doc_data, workers=None):
+        doc_data['tables'] = {3: [[['Share Class', 'A', 'C', 'I'], ['Net Expenses', '1.10%', '1.85%', '0.85%']]]}
+        doc_data['tables_pending'] = []
+    monkeypatch.setattr(extraction, 'load_pending_tables', load_pending_tables)
+
+    def make_document(sha256):
+        # The text names Class A only; Class I appears in the skipped table
+        doc_data = {'type': 'pdf', 'pages': {1: 'Class A Shares', 2: 'Summary', 3: 'Expense summary'},
+                    'tables': {}, 'tables_pending': [3], 'sha256': sha256}
+        extraction.compact_document(doc_data)
+        extraction.build_document_indexes(doc_data)
+        return doc_data
+
+    doc_data = make_document('doc-class-rules')
+    assert extraction.extract_document_datapoint(doc_data, 'NET_EXPENSES', 'Class I', 'percentage')[0] == '0.85%'
+
+    doc_data = make_document('doc-class-llm')
+    results = smartally.extract_documents_with_llm({'fund.pdf': doc_data}, 'NET_EXPENSES', 'Class I',
+                                                   'percentage', MAPPING_DF)
+    assert results['fund.pdf'][0] == '0.85%' and len(completions.requests) == 1
+    # Still ruled out once every table is loaded
+    assert smartally.extract_documents_with_llm({'fund.pdf': doc_data}, 'NET_EXPENSES', 'Class R6',
+                                                'percentage', MAPPING_DF) == {'fund.pdf': ('0', None, None)}
+    assert len(completions.requests) == 1
+
+
+def test_batch_fallback_skips_requested_classes_the_document_does_not_offer(fake_llm, monkeypatch):
+    monkeypatch.setattr(extraction, '_error_reporter', lambda message: None)
+
+    def responder(request):
+        if 'DATAPOINTS TO EXTRACT' in request['messages'][1]['content']:
+            raise RuntimeError('rate limited')
+        return {'value': '1.10%', 'location': 'fee table', 'context': ''}
+
+    completions = fake_llm(responder=responder)
+    pages = {1: 'Class A Shares and Class C Shares', 2: 'Net Expenses Class A 1.10% Class C 1.85%'}
+    doc_data = {'type': 'pdf', 'pages': pages, 'tables': {}, 'sha256': 'doc-classes'}
+    extraction.build_document_indexes(doc_data)
+
+    # The failed grid falls back to single calls for the offered class only
+    _, answers = batch.extract_document_answers(doc_data, MAPPING_DF.head(1), ['Class A', 'Class Z'], use_llm=True)
+    datapoint = MAPPING_DF['Datapoint'].iloc[0]
+    assert answers[(datapoint, 'Class Z')] == ('0', None, None)
+    assert len(completions.requests) == 2
@@ -0,0 +1,150 @@
+"""
+Test script for the SmartAlly LLM request scheduler, against a local stub
+OpenAI server that simulates rate limits and latency
+"""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+from llm_scheduler import DeadlineExceeded, LLMScheduler, TokenBucket, async_openai_client, openai_client
+
+
+class StubServer(ThreadingHTTPServer):
+    """Chat completions endpoint: answers 429 to the first `rate_limited` requests, then after `latency`."""
+
+    daemon_threads = True
+
+    def __init__(self, rate_limited=0, latency=0.0, status=429):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.rate_limited = rate_limited
+        self.latency = latency
+        self.status = status
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, payload, headers=()):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            limited = server.requests <= server.rate_limited
+        if limited:
+            self._reply(server.status, {'error': {'message': 'Rate limit reached', 'type': 'requests'}},
+                        headers=[('retry-after-ms', '20')])
+            return
+        time.sleep(server.latency)
+        self._reply(200, {
+            'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': 0, 'model': 'gpt-4',
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': '{"value": "1.10%"}'}}],
+        })
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(**kwargs):
+        server = StubServer(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _complete(client, timeout):
+    return client.chat.completions.create(model='gpt-4', messages=[{'role': 'user', 'content': 'Net?'}],
+                                          timeout=timeout)
+
+
+def test_token_bucket_queues_bursts():
+    now = [0.0]
+    bucket = TokenBucket(per_minute=60, clock=lambda: now[0])
+    assert bucket.reserve(60) == 0
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    assert bucket.reserve(1) == pytest.approx(2.0)
+    now[0] = 2.0
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    # A 429 holds back every caller
+    bucket.pause(5)
+    assert bucket.reserve(1) == pytest.approx(6.0)
+    assert TokenBucket(per_minute=0).reserve(10 ** 6) == 0
+
+
+def test_rate_limited_calls_are_retried_with_pooled_client(stub_server):
+    server = stub_server(rate_limited=2)
+    scheduler = LLMScheduler(backoff_base=0.01, deadline=10)
+    client = openai_client('test-key', base_url=server.base_url)
+
+    response = scheduler.call(lambda timeout: _complete(client, timeout), tokens=100)
+    assert response.choices[0].message.content == '{"value": "1.10%"}'
+    assert server.requests == 3 and scheduler.retries == 2
+
+    # Errors that cannot succeed on a retry are raised at once
+    server = stub_server(rate_limited=1, status=400)
+    client = openai_client('test-key', base_url=server.base_url)
+    with pytest.raises(openai.BadRequestError):
+        scheduler.call(lambda timeout: _complete(client, timeout))
+    assert server.requests == 1
+
+
+def test_deadline_bounds_slow_calls_and_queueing(stub_server):
+    server = stub_server(latency=1.0)
+    client = openai_client('test-key', base_url=server.base_url)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        LLMScheduler(backoff_base=0.01, deadline=0.2).call(lambda timeout: _complete(client, timeout))
+    assert time.monotonic() - started < 0.9
+
+    # A request that would queue past its deadline is rejected without a call
+    scheduler = LLMScheduler(rpm=60, deadline=0.5)
+    scheduler.call(lambda timeout: None)
+    scheduler.requests.pause(30)
+    with pytest.raises(DeadlineExceeded):
+        scheduler.call(lambda timeout: pytest.fail('called'))
+
+
+def test_concurrent_async_calls_share_the_backoff(stub_server):
+    server = stub_server(rate_limited=3, latency=0.05)
+    scheduler = LLMScheduler(backoff_base=0.01, deadline=10)
+
+    async def run():
+        client = async_openai_client('test-key', base_url=server.base_url)
+        try:
+            return await asyncio.gather(*[
+                scheduler.acall(lambda timeout: _complete(client, timeout), tokens=50) for _ in range(6)
+            ])
+        finally:
+            await client.close()
+
+    responses = asyncio.run(run())
+    assert [r.choices[0].message.content for r in responses] == ['{"value": "1.10%"}'] * 6
+    assert server.requests == 9 and scheduler.retries == 3
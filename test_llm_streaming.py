@@ -0,0 +1,47 @@
+"""
+Test script for SmartAlly streaming LLM response parsing
+"""
+
+from types import SimpleNamespace
+
+from llm_streaming import StreamingFieldParser, consume_stream
+
+
+def make_chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+def test_partial_values_grow_as_chunks_arrive():
+    parser = StreamingFieldParser(['value', 'location'])
+
+    assert parser.feed('{"val') is False
+    assert parser.feed('ue": "1.2') is True
+    assert parser.values == {'value': '1.2'}
+    assert parser.feed('5%", "location": "Fees') is True
+    assert parser.values == {'value': '1.25%', 'location': 'Fees'}
+
+
+def test_escapes_split_across_chunks():
+    parser = StreamingFieldParser(['value'])
+    parser.feed('{"value": "say \\')
+    assert parser.values['value'] == 'say '
+    parser.feed('"hi\\" \\u00e9"}')
+    assert parser.values['value'] == 'say "hi" é'
+
+
+def test_null_and_numeric_fields():
+    parser = StreamingFieldParser(['value', 'confidence'])
+    parser.feed('{"value": null, "confidence": 0.9}')
+    assert parser.values == {'value': '', 'confidence': '0.9'}
+
+
+def test_consume_stream_reports_updates_and_returns_full_text():
+    chunks = ['{"value": "$1', ',000"', ', "location": "p. 3"}']
+    stream = [make_chunk(c) for c in chunks] + [SimpleNamespace(choices=[])]
+    updates = []
+
+    text = consume_stream(stream, StreamingFieldParser(['value', 'location']), updates.append)
+
+    assert text == ''.join(chunks)
+    assert updates[-1] == {'value': '$1,000', 'location': 'p. 3'}
+    assert len(updates) == 3
@@ -0,0 +1,65 @@
+"""
+Test script for the SmartAlly persistent parse cache
+"""
+
+import os
+
+from parse_cache import ParseCache, content_hash
+
+
+def make_doc(page_text: str):
+    return {
+        'type': 'pdf',
+        'pages': {1: page_text, 2: 'Annual Fund Operating Expenses'},
+        'tables': {2: [[['', 'Class A'], ['Total Annual Fund Operating Expenses', '1.19%'], [None, '']]]},
+        'file_bytes': b'%PDF-raw-bytes',
+    }
+
+
+def test_round_trip_survives_new_instance(tmp_path):
+    key = ParseCache(str(tmp_path)).make_key(content_hash(b'doc-1'), 'pdf')
+    ParseCache(str(tmp_path)).put(key, make_doc('cover page'))
+
+    cached = ParseCache(str(tmp_path)).get(key)
+    assert cached['pages'] == {1: 'cover page', 2: 'Annual Fund Operating Expenses'}
+    assert cached['tables'][2][0][2] == [None, '']
+    # Raw bytes are never written to disk
+    assert 'file_bytes' not in cached
+
+
+def test_same_name_different_content_does_not_collide(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    key_a = cache.make_key(content_hash(b'prospectus A'), 'pdf')
+    key_b = cache.make_key(content_hash(b'prospectus B'), 'pdf')
+    cache.put(key_a, make_doc('fund A'))
+
+    assert key_a != key_b
+    assert cache.get(key_b) is None
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    key = cache.make_key(content_hash(b'doc'), 'pdf')
+    cache.put(key, make_doc('text'))
+    with open(cache._path(key), 'wb') as f:
+        f.write(b'garbage')
+
+    assert cache.get(key) is None
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    cache = ParseCache(str(tmp_path), max_bytes=10 ** 9)
+    keys = [cache.make_key(content_hash(str(i).encode()), 'pdf') for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, make_doc(os.urandom(2000).hex()))
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+
+    # Touch the oldest entry, then shrink the bound so only two entries fit
+    assert cache.get(keys[0]) is not None
+    entry_size = os.path.getsize(cache._path(keys[0]))
+    cache.max_bytes = entry_size * 2 + entry_size // 2
+    cache.evict()
+
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
@@ -0,0 +1,86 @@
+"""
+Test script for the SmartAlly parallel PDF parsing engine
+"""
+
+import io
+
+import fitz  # PyMuPDF
+
+from pdf_ingest import parse_pdf_bytes, shard_pages, resolve_worker_count, read_upload, ingest_pdf, load_pending_tables
+
+
+def build_pdf(page_count: int, table_pages=(3,)) -> bytes:
+    """Build a PDF with one line of text per page and ruled tables on some pages."""
+    doc = fitz.open()
+    for page_num in range(1, page_count + 1):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Prospectus page {page_num}")
+        if page_num in table_pages:
+            # 2 x 3 grid of ruled cells so pdfplumber detects a table
+            x0, y0, w, h = 72, 120, 120, 30
+            for row in range(3):
+                for col in range(2):
+                    rect = fitz.Rect(x0 + col * w, y0 + row * h, x0 + (col + 1) * w, y0 + (row + 1) * h)
+                    page.draw_rect(rect, color=(0, 0, 0), width=1)
+                    page.insert_text((rect.x0 + 4, rect.y0 + 20), f"r{row}c{col}")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_shard_pages_covers_every_page_in_order():
+    shards = shard_pages(100, 4)
+    assert shards[0][0] == 0
+    assert shards[-1][1] == 100
+    for (_, end), (start, _) in zip(shards, shards[1:]):
+        assert end == start
+
+
+def test_small_documents_parse_serially():
+    assert resolve_worker_count(3, workers=16) == 1
+
+
+def test_parallel_matches_serial():
+    pdf_bytes = build_pdf(40, table_pages=(3, 25, 40))
+
+    serial_pages, serial_tables = parse_pdf_bytes(pdf_bytes, workers=1)
+    parallel_pages, parallel_tables = parse_pdf_bytes(pdf_bytes, workers=4)
+
+    assert list(parallel_pages) == list(range(1, 41))
+    assert parallel_pages == serial_pages
+    assert parallel_tables == serial_tables
+    assert sorted(parallel_tables) == [3, 25, 40]
+    assert parallel_tables[25][0][0] == ['r0c0', 'r0c1']
+
+
+def test_ingest_pdf_single_pass():
+    pdf_bytes = build_pdf(5, table_pages=(2,))
+    upload = io.BytesIO(pdf_bytes)
+
+    file_bytes = read_upload(upload)
+    doc_data = ingest_pdf(file_bytes, workers=1)
+
+    # The upload buffer is shared, not copied
+    assert file_bytes is pdf_bytes
+    assert doc_data['file_bytes'] is pdf_bytes
+    assert doc_data['page_count'] == 5
+    assert sorted(doc_data['pages']) == [1, 2, 3, 4, 5]
+    assert list(doc_data['tables']) == [2]
+    assert doc_data['page_meta'][1]['width'] > 0
+
+
+def test_keyword_gated_tables_and_lazy_loading():
+    pdf_bytes = build_pdf(40, table_pages=(3, 25, 40))
+    eager = ingest_pdf(pdf_bytes, workers=1)
+
+    # Only page 25 (and the page after it) is a candidate for table extraction
+    for workers in (1, 4):
+        doc_data = ingest_pdf(pdf_bytes, workers=workers, table_triggers=('prospectus PAGE 25',))
+        assert list(doc_data['tables']) == [25]
+        assert len(doc_data['tables_pending']) == 38
+        assert 26 not in doc_data['tables_pending']
+        assert doc_data['pages'] == eager['pages']
+
+        assert sorted(load_pending_tables(doc_data, workers=workers)) == [3, 40]
+        assert doc_data['tables'] == eager['tables'] and list(doc_data['tables']) == [3, 25, 40]
+        assert doc_data['tables_pending'] == []
@@ -0,0 +1,43 @@
+"""
+Test script for the SmartAlly positional token index
+"""
+
+import marshal
+
+from position_index import PositionIndex, Span
+
+PAGES = {
+    1: 'Table of contents. Fees and expenses section. Shareholder information section.',
+    2: 'Minimum Investment. Class A Shares: Initial Investment: $2,500. Subsequent Investment: $50.',
+    3: 'Annual report. The Fund paid $50 in postage. Net Expenses 1.10 % for Class A.',
+    4: 'Automatic Investment Plans: Subsequent Investment: $50 per month.',
+}
+
+
+def test_value_is_located_next_to_its_context():
+    index = PositionIndex.build(PAGES)
+
+    span = index.locate('$50', 'Automatic Investment Plans subsequent')
+    assert span.page == 4
+    assert PAGES[4][span.start:span.end] == '$50'
+
+    # Thousands separators, currency and percent signs are normalized away
+    assert index.locate('$2500', 'initial investment').page == 2
+    span = index.locate('1.10%', 'net expenses')
+    assert PAGES[3][span.start:span.end] == '1.10'
+
+
+def test_multi_word_values_and_context_only_matches():
+    index = PositionIndex.build(PAGES)
+
+    span = index.locate('Subsequent Investment', 'Minimum Investment Class A')
+    assert span.page == 2
+    # Paraphrased value: fall back to the densest cluster of context words
+    assert index.locate('fifty dollars a month', 'automatic investment plans').page == 4
+    assert index.locate('1 year, 1.00% then 0%', 'contingent deferred sales charge') is None
+
+
+def test_state_round_trips_through_marshal():
+    state = marshal.loads(marshal.dumps(PositionIndex.build(PAGES).to_state()))
+    start = PAGES[2].index('$2,500')
+    assert PositionIndex.from_state(state).locate('$2,500', 'initial') == Span(2, start, start + 6)
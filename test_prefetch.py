@@ -0,0 +1,55 @@
+"""
+Test script for the SmartAlly background prefetch of every datapoint
+"""
+
+import pandas as pd
+
+import extraction
+import prefetch
+import smartally
+from benchmark import isolated_parse_cache, is_correct
+from synthetic_prospectus import generate_prospectus
+
+MAPPING_DF = pd.read_csv('datapoint_mapping.csv')
+
+
+def test_every_datapoint_is_precomputed_and_answers_questions(monkeypatch):
+    prospectus = generate_prospectus(pages=8, classes=3, table_density=0.25, doc_type='pdf', seed=24)
+    with isolated_parse_cache():
+        doc_data = extraction.ingest_document('fund.pdf', prospectus.data, parse_workers=1)
+
+    assert prefetch.get_prefetch(doc_data, use_llm=False) is None
+    job = prefetch.start_prefetch(doc_data, MAPPING_DF, use_llm=False)
+    assert prefetch.start_prefetch(doc_data, MAPPING_DF, use_llm=False) is job
+    job.future.result(timeout=30)
+
+    assert job.state == 'done' and job.progress == 1.0
+    assert set(prospectus.classes) <= set(job.classes)
+    assert len(job.answers) == job.total == len(job.classes) * MAPPING_DF['Datapoint'].nunique()
+    value, _, _ = job.answer('NET_EXPENSES', 'Class C')
+    assert is_correct(value, prospectus.truth[('NET_EXPENSES', 'Class C')])
+
+    # Questions are answered from the precomputed results without extracting again
+    def no_extraction(*args):
+        raise AssertionError('extracted again')
+    monkeypatch.setattr(smartally, 'extract_document_datapoint', no_extraction)
+    response = smartally.chatbot_response('Net expenses for Class C', {'fund.pdf': doc_data},
+                                          MAPPING_DF, use_llm=False)
+    assert value in response
+
+
+def test_background_errors_stay_on_the_job(monkeypatch):
+    reported = []
+    monkeypatch.setattr(extraction, '_error_reporter', reported.append)
+
+    def failing_extraction(doc_data, datapoint_name, class_name, output_rule):
+        extraction.report_error(f"cannot read {datapoint_name}")
+        return "0", None, None
+    monkeypatch.setattr(extraction, 'extract_document_datapoint', failing_extraction)
+
+    doc_data = {'type': 'html', 'text': 'Class A Shares', 'passages': {1: 'Class A Shares'}, 'sha256': 'doc-errors'}
+    job = prefetch.start_prefetch(doc_data, MAPPING_DF, use_llm=False)
+    job.future.result(timeout=30)
+
+    assert job.state == 'done' and job.classes == ['Class A']
+    assert 'cannot read CDSC' in job.errors and reported == []
@@ -0,0 +1,55 @@
+"""
+Test script for the SmartAlly prompt table packing
+"""
+
+import prompt_packing
+from prompt_packing import count_tokens, pack_tables, score_tables
+from table_index import TableIndex
+
+COVER_TABLE = [['Ticker', 'Class A', 'Class C'], ['Symbol', 'SGFAX', 'SGFCX']]
+PERFORMANCE_TABLE = [['Average Annual Total Returns', '1 Year', '5 Years'], ['Return Before Taxes', '8.1%', '6.2%']]
+FEE_TABLE = [
+    ['', 'Class A', 'Class C', 'Class I'],
+    ['Management Fees', '0.65%', '0.65%', '0.65%'],
+    ['Total Annual Fund Operating Expenses', '1.19%', '1.94%', '0.92%'],
+    ['Fee Waiver and/or\nExpense Reimbursement', '(0.09)%', '(0.09)%', '(0.07)%'],
+    ['Net Expenses', '1.10%', '1.85%', '0.85%'],
+]
+# The fee table comes after a dozen cover-page and performance tables
+TABLES = [COVER_TABLE] + [PERFORMANCE_TABLE] * 11 + [FEE_TABLE]
+INDEX = TableIndex.build(TABLES, pages=list(range(1, 14)))
+
+
+def test_fee_table_is_ranked_first_and_cut_to_the_class_column():
+    assert score_tables(INDEX, ['NET_EXPENSES'], 'Class C')[0][1] == 12
+
+    blocks = pack_tables(TABLES, INDEX, ['NET_EXPENSES'], 'Class C')
+    # Performance tables matching only "total" are left out
+    assert len(blocks) == 1
+    assert blocks[0].splitlines() == [
+        'Table 1 (page 13):',
+        '\tClass C',
+        'Management Fees\t0.65%',
+        'Total Annual Fund Operating Expenses\t1.94%',
+        'Fee Waiver and/or Expense Reimbursement\t(0.09)%',
+        'Net Expenses\t1.85%',
+    ]
+    # Whole-document extraction keeps every class column
+    assert '1.10%\t1.85%\t0.85%' in pack_tables(TABLES, INDEX, ['NET_EXPENSES'])[0]
+
+
+def test_tables_fill_the_token_budget(monkeypatch):
+    monkeypatch.setattr(prompt_packing, '_encoding', lambda: None)
+    assert count_tokens('x' * 10) == 3
+
+    blocks = pack_tables(TABLES, INDEX, ['TOTAL_ANNUAL_FUND_OPERATING_EXPENSES'], 'Class A', token_budget=40)
+    assert count_tokens('\n'.join(blocks)) <= 40
+    assert len(blocks) == 1 and 'Total Annual Fund Operating Expenses\t1.19%' in blocks[0]
+    # A table that does not fit keeps its class header and datapoint rows
+    assert pack_tables(TABLES, INDEX, ['TOTAL_ANNUAL_FUND_OPERATING_EXPENSES'], 'Class A',
+                       token_budget=20)[0].splitlines() == [
+        'Table 1 (page 13):', '\tClass A', 'Total Annual Fund Operating Expenses\t1.19%']
+
+    # Without datapoints every table is eligible, fee tables first
+    assert pack_tables(TABLES, INDEX)[0].startswith('Table 1 (page 13):')
+    assert pack_tables(TABLES, INDEX, ['NET_EXPENSES'], token_budget=2) == []
@@ -0,0 +1,57 @@
+"""
+Test script for SmartAlly BM25 page retrieval
+"""
+
+from retrieval import PageIndex, build_context, query_terms_for, split_passages, tokenize
+
+
+def make_pages():
+    pages = {n: f"Page {n}. Investment objective and principal risks of the fund. " * 20 for n in range(1, 61)}
+    pages[40] = ("Annual Fund Operating Expenses\n"
+                 "Class A Class C\nManagement Fees 0.65% 0.65%\n"
+                 "Total Annual Fund Operating Expenses 1.19% 1.94%")
+    pages[52] = "Minimum Investment\nClass A Shares\nAutomatic Investment Plans\nSubsequent Investment: $50"
+    return pages
+
+
+def test_tokenize_emits_class_tokens():
+    tokens = tokenize("Fees for Class A and class c shares")
+    assert 'class_a' in tokens
+    assert 'class_c' in tokens
+    assert 'and' not in tokens
+
+
+def test_fee_table_page_ranks_first():
+    pages = make_pages()
+    index = PageIndex.build(pages)
+
+    ranked = index.score(query_terms_for('TOTAL_ANNUAL_FUND_OPERATING_EXPENSES', 'Class A'))
+    assert ranked[0][0] == 40
+
+    ranked = index.score(query_terms_for('MINIMUM_SUBSEQUENT_INVESTMENT_AIP', 'Class A'))
+    assert ranked[0][0] == 52
+
+
+def test_context_respects_token_budget_and_marks_pages():
+    pages = make_pages()
+    index = PageIndex.build(pages)
+
+    context = build_context(pages, index, query_terms_for('NET_EXPENSES', 'Class C'), token_budget=300)
+    assert len(context) <= 300 * 4 + 100
+    assert context.startswith('[Page ')
+    assert '[Page 40]' in context
+
+
+def test_index_state_round_trip():
+    pages = make_pages()
+    index = PageIndex.build(pages)
+    restored = PageIndex.from_state(index.to_state())
+    terms = query_terms_for('CDSC', 'Class C')
+    assert restored.score(terms) == index.score(terms)
+
+
+def test_split_passages_covers_text():
+    text = "word " * 2000
+    passages = split_passages(text, passage_chars=1000)
+    assert ''.join(passages.values()) == text
+    assert all(len(p) <= 1000 for p in passages.values())
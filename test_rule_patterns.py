@@ -0,0 +1,60 @@
+"""
+Test script for the SmartAlly rule-based pattern registry
+"""
+
+import time
+
+import rule_patterns
+from smartally import extract_datapoint, extract_minimum_investment_aip
+
+FILLER = ("The Fund seeks long-term capital appreciation. Investments in a class of securities may decline. "
+          "Shares are offered through financial intermediaries.\n") * 4500
+
+SECTION = """
+MINIMUM INVESTMENT
+
+Class A Shares
+  Initial Investment: $2,500
+  Subsequent Investment: $100
+  Automatic Investment Plans
+    Subsequent Investment: $50
+
+Class I Shares
+  Initial Investment: $1,000,000
+  Subsequent Investment: $100
+  Automatic Investment Plans
+    Subsequent Investment: $100
+
+CONTINGENT DEFERRED SALES CHARGE (CDSC)
+
+Class C: 1 year at 1.00%, 0% after first year
+"""
+
+
+def test_anchor_hits_respect_word_boundaries_and_limit():
+    assert rule_patterns.anchor_hits('Taipei AIP plan', 'aip') == [(7, 10)]
+    assert len(rule_patterns.anchor_hits('CDSC ' * 1000, 'cdsc')) == rule_patterns.MAX_ANCHOR_HITS
+
+
+def test_class_block_is_the_nearest_heading():
+    assert extract_minimum_investment_aip(SECTION, ['Class I'], 'currency') == ('$100', 'minimum investment section')
+    assert extract_minimum_investment_aip(SECTION, ['Class A'], 'currency') == ('$50', 'minimum investment section')
+
+
+def test_rule_based_lookups_stay_fast_on_long_filings():
+    text = FILLER + SECTION + FILLER
+    assert len(text) > 1_000_000
+    datapoints = ['TOTAL_ANNUAL_FUND_OPERATING_EXPENSES', 'NET_EXPENSES', 'MINIMUM_SUBSEQUENT_INVESTMENT_AIP',
+                  'INITIAL_INVESTMENT', 'CDSC', 'REDEMPTION_FEE']
+
+    # Warm the per-class pattern cache
+    for datapoint in datapoints:
+        extract_datapoint(text, [], datapoint, 'Class Q', 'text')
+
+    for datapoint in datapoints:
+        started = time.perf_counter()
+        extract_datapoint(text, [], datapoint, 'Class Q', 'text')
+        # Generous bound for slow CI machines; typically a few milliseconds
+        assert time.perf_counter() - started < 0.1, datapoint
+
+    assert extract_datapoint(text, [], 'CDSC', 'Class C', 'cdsc_special')[0] == '1 year, 1.00% then 0%'
@@ -0,0 +1,107 @@
+"""
+Test script for the SmartAlly shared document store and request coalescing
+"""
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import extraction
+from llm_cache import LLMCache
+from parse_cache import ParseCache
+from shared_store import DocumentStore, SingleFlight
+
+FILING = b"""<html><body><h2 id="fees">Fees and Expenses</h2>
+<p>Net Expenses Class A 1.10% Class C 1.85%</p></body></html>"""
+
+
+def test_concurrent_callers_share_one_computation():
+    flights = SingleFlight()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(lambda _: flights.do('doc', compute), range(6)))
+    assert len(calls) == 1 and all(result is results[0] for result in results)
+    assert flights.coalesced == 5
+
+    # Failures reach every waiter; the next call computes again
+    def fail():
+        time.sleep(0.05)
+        raise ValueError('parse failed')
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(flights.do, 'bad', fail) for _ in range(3)]
+    assert all(isinstance(future.exception(), ValueError) for future in futures)
+    assert flights.do('bad', lambda: 'ok') == 'ok'
+
+
+def test_async_callers_on_separate_event_loops_are_coalesced():
+    flights = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return 'grid'
+
+    async def session():
+        return await asyncio.gather(*[flights.ado('doc', compute) for _ in range(3)])
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = list(pool.map(lambda _: asyncio.run(session()), range(2)))
+    assert results == [['grid'] * 3] * 2 and len(calls) == 1
+
+
+def test_sessions_share_parsed_documents_within_a_memory_bound(tmp_path, monkeypatch):
+    store = DocumentStore()
+    monkeypatch.setattr(extraction, 'document_store', store)
+    monkeypatch.setattr(extraction, 'parse_cache', ParseCache(str(tmp_path)))
+    parses = []
+    parse_html = extraction.parse_html
+
+    def slow_parse(data):
+        parses.append(1)
+        time.sleep(0.1)
+        return parse_html(data)
+    monkeypatch.setattr(extraction, 'parse_html', slow_parse)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        docs = list(pool.map(lambda _: extraction.ingest_document('fund.html', FILING), range(4)))
+    assert len(parses) == 1 and all(doc is docs[0] for doc in docs)
+    assert extraction.ingest_document('copy.html', bytes(FILING)) is docs[0]
+
+    # Least recently used documents are evicted past the bound
+    small = DocumentStore(max_bytes=1000)
+    small.put('a', {'type': 'html', 'text': 'x' * 100})
+    small.put('b', {'type': 'html', 'text': 'y' * 100})
+    assert small.get('a') is None and small.get('b') is not None and len(small) == 1
+
+
+def test_identical_llm_extractions_are_made_once(tmp_path, monkeypatch):
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        time.sleep(0.1)
+        content = json.dumps({'value': '1.10%', 'location': 'fee table', 'context': 'net expenses'})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    monkeypatch.setattr(extraction, 'client', SimpleNamespace(chat=SimpleNamespace(
+        completions=SimpleNamespace(create=create))))
+    monkeypatch.setattr(extraction, 'llm_cache', LLMCache(str(tmp_path / 'llm.sqlite3')))
+
+    def ask(_):
+        return extraction.extract_datapoint_with_llm('Net Expenses 1.10%', [], 'NET_EXPENSES', 'Class A',
+                                                     'percentage', doc_hash='doc-1')
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        answers = list(pool.map(ask, range(5)))
+    assert answers == [('1.10%', 'fee table', None)] * 5
+    assert len(requests) == 1
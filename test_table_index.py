@@ -0,0 +1,52 @@
+"""
+Test script for the SmartAlly table index
+"""
+
+import marshal
+
+from table_index import TableIndex, class_key
+from smartally import _format_tables_for_prompt, extract_annual_expenses, extract_net_expenses
+
+OTHER_TABLE = [['Year', 'Return'], ['2022', '-12.1%']]
+FEE_TABLE = [
+    ['', 'A Shares', 'Class C', 'I', 'Class F'],
+    ['Management Fees', '0.65%', '0.65%', '0.65%', '0.65%'],
+    ['Total Annual Fund Operating Expenses', '1.19%', '1.94%', '0.92%', '0.83%'],
+    ['Net Expenses', '1.10%', '1.85%', '0.85%', '0.75%'],
+]
+TABLES_BY_PAGE = {2: [OTHER_TABLE], 7: [FEE_TABLE]}
+TABLES = [OTHER_TABLE, FEE_TABLE]
+
+
+def test_class_key_forms():
+    for label in ('Class A', 'A', 'A Shares', 'Shares A', 'class a shares'):
+        assert class_key(label) == 'A'
+    assert class_key('Class R6') == 'R6'
+    assert class_key('Management Fees') is None
+    assert class_key('0.65%') is None
+
+
+def test_cells_carry_page_provenance():
+    index = TableIndex.from_document_tables(TABLES_BY_PAGE)
+
+    assert list(index.cells(TABLES, 'NET_EXPENSES', ['Class A', 'A'])) == [('1.10%', 7)]
+    assert list(index.cells(TABLES, 'TOTAL_ANNUAL_FUND_OPERATING_EXPENSES', ['Class I'])) == [('0.92%', 7)]
+    assert list(index.cells(TABLES, 'NET_EXPENSES', ['Class Z'])) == []
+    assert index.row(TABLES, 'management  fees') == (FEE_TABLE[1], 7)
+
+
+def test_extractors_use_the_index():
+    index = TableIndex.from_document_tables(TABLES_BY_PAGE)
+    assert extract_annual_expenses('', TABLES, ['Class F'], 'percentage', index) == ('0.83%', 'expenses table')
+    assert extract_net_expenses('', TABLES, ['Class C'], 'percentage', index) == ('1.85%', 'net expenses table')
+    # Without a prebuilt index the same answer is found
+    assert extract_net_expenses('', TABLES, ['Class C'], 'percentage') == ('1.85%', 'net expenses table')
+
+
+def test_state_round_trips_through_marshal_and_orders_prompt_tables():
+    state = TableIndex.from_document_tables(TABLES_BY_PAGE).to_state()
+    index = TableIndex.from_state(marshal.loads(marshal.dumps(state)))
+
+    assert index.priority_order() == [1, 0]
+    prompt = _format_tables_for_prompt(TABLES, index)
+    assert prompt.index('Table 1 (page 7)') < prompt.index('Net Expenses') < prompt.index('Table 2 (page 2)')
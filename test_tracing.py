@@ -0,0 +1,97 @@
+"""
+Test script for the SmartAlly tracing layer
+"""
+
+import json
+import threading
+import tracemalloc
+
+import pandas as pd
+
+import extraction
+import smartally
+import tracing
+from parse_cache import ParseCache
+from shared_store import DocumentStore
+
+FILING = b"""<html><body><pre>
+Net Expenses (after fee waiver/expense reimbursement)
+  Class A: 1.10%
+  Class C: 1.85%
+</pre></body></html>"""
+
+MAPPING_DF = pd.DataFrame({
+    'Instruction': ['Net expenses for {class}'],
+    'Datapoint': ['NET_EXPENSES'],
+    'Class': ['{class}'],
+    'OutputRule': ['percentage'],
+})
+
+
+def test_spans_nest_and_are_no_ops_without_a_trace(tmp_path):
+    log_path = tmp_path / 'traces.jsonl'
+    assert tracing.span('idle') is tracing.span('other')
+
+    with tracing.start_trace('request', log_path=str(log_path), user='test') as trace:
+        with tracing.span('outer', doc='a.pdf') as outer:
+            with tracing.span('inner', memory=True):
+                bytearray(256 * 1024)
+            outer.set(hit=False)
+
+    assert [(s['name'], s['depth']) for s in trace.spans] == [('outer', 0), ('inner', 1)]
+    assert trace.spans[0]['attrs'] == {'doc': 'a.pdf', 'hit': False}
+    assert trace.spans[1]['peak_kib'] >= 256
+    assert trace.total_ms >= trace.spans[0]['duration_ms']
+
+    logged = [json.loads(line) for line in log_path.read_text().splitlines()]
+    assert logged == [trace.to_dict()]
+    assert [row['stage'] for row in tracing.summarize(logged[0])] == ['outer', '· inner']
+
+    with tracing.start_trace('disabled', enabled=False) as disabled:
+        assert disabled is None and tracing.span('x') is tracing.span('y')
+
+
+def test_overlapping_memory_spans_share_one_tracing_session():
+    first_open, second_done = threading.Event(), threading.Event()
+    traces = {}
+
+    def other_session():
+        with tracing.start_trace('ingest', log_path=None) as trace, tracing.span('parse', memory=True):
+            held = bytearray(512 * 1024)
+            first_open.set()
+            second_done.wait(5)
+            del held
+        traces['other'] = trace
+
+    worker = threading.Thread(target=other_session)
+    worker.start()
+    first_open.wait(5)
+    with tracing.start_trace('ingest', log_path=None) as trace, tracing.span('parse', memory=True):
+        bytearray(64 * 1024)
+    second_done.set()
+    worker.join()
+
+    # Tracing stops with the last memory span, and neither reading was zeroed
+    assert not tracemalloc.is_tracing()
+    # The peak covers the whole process: the other session's allocation is included
+    assert trace.spans[0]['peak_kib'] >= 512 and traces['other'].spans[0]['peak_kib'] >= 512
+
+
+def test_ingest_and_answer_are_traced_per_stage(tmp_path, monkeypatch):
+    monkeypatch.setattr(extraction, 'parse_cache', ParseCache(str(tmp_path / 'cache')))
+    monkeypatch.setattr(extraction, 'document_store', DocumentStore())
+    log_path = str(tmp_path / 'traces.jsonl')
+
+    with tracing.start_trace('ingest', log_path=log_path) as ingest:
+        doc_data = extraction.ingest_document('fund.html', FILING)
+    stages = {s['name']: s for s in ingest.spans}
+    assert list(stages) == ['parse_cache_lookup', 'parse', 'build_indexes']
+    assert stages['parse_cache_lookup']['attrs']['hit'] is False
+    assert 'peak_kib' in stages['parse']
+
+    with tracing.start_trace('answer', log_path=log_path) as answer:
+        response = smartally.chatbot_response('Net expenses for Class A', {'fund.html': doc_data},
+                                              MAPPING_DF, use_llm=False)
+    assert '1.10%' in response
+    assert [s['name'] for s in answer.spans] == ['intent', 'extraction', 'render', 'attribution']
+    assert answer.spans[0]['attrs']['datapoint'] == 'NET_EXPENSES'
@@ -0,0 +1,226 @@
+"""
+SmartAlly - Tracing
+Lightweight per-request timing spans. A trace is started around one unit of
+work (answering a question, ingesting a document); code anywhere below it opens
+named spans, which attach to the active trace through a context variable, so
+no trace object has to be passed around. Finished traces are appended to a
+JSON-lines log for offline analysis and can be rendered as a timing breakdown.
+
+When no trace is active, span() returns a shared no-op object, so instrumented
+code costs one context variable lookup per span.
+"""
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+# Whether answers and document ingests are traced by default
+TRACING_ENABLED = os.getenv("SMARTALLY_TRACING", "0") == "1"
+
+# JSON-lines log of finished traces (empty to disable the log)
+TRACE_LOG_PATH = os.getenv("SMARTALLY_TRACE_LOG", os.path.join(".smartally_cache", "traces.jsonl"))
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar('smartally_trace', default=None)
+# Nesting depth of the open spans (per thread / asyncio task)
+_span_depth: ContextVar[int] = ContextVar('smartally_span_depth', default=0)
+_log_lock = threading.Lock()
+
+# tracemalloc is process-wide: concurrent memory spans (other sessions, prefetch
+# threads) share one tracing session, started by the first and stopped by the last
+_memory_lock = threading.Lock()
+_memory_spans = 0
+_memory_owned = False
+
+
+def _start_memory() -> None:
+    global _memory_spans, _memory_owned
+    with _memory_lock:
+        if _memory_spans == 0:
+            # Tracing started elsewhere (e.g. the benchmark) is left running
+            _memory_owned = not tracemalloc.is_tracing()
+            if _memory_owned:
+                tracemalloc.start()
+        _memory_spans += 1
+
+
+def _stop_memory() -> int:
+    """Peak traced bytes of the whole process since tracing started."""
+    global _memory_spans
+    with _memory_lock:
+        _, peak = tracemalloc.get_traced_memory()
+        _memory_spans -= 1
+        if _memory_spans == 0 and _memory_owned:
+            tracemalloc.stop()
+        return peak
+
+
+class Trace:
+    """Spans recorded for one unit of work."""
+
+    def __init__(self, name: str, **attrs: Any):
+        self.name = name
+        self.attrs = attrs
+        self.timestamp = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+        self.spans: List[Dict[str, Any]] = []
+        self.total_ms: Optional[float] = None
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def _elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._started) * 1000
+
+    def finish(self) -> None:
+        self.total_ms = round(self._elapsed_ms(), 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'trace': self.name, 'timestamp': self.timestamp, 'total_ms': self.total_ms,
+                'attrs': self.attrs, 'spans': self.spans}
+
+
+class _Span:
+    """An open span; records itself on the trace when it exits."""
+
+    __slots__ = ('trace', 'record', 'memory', 'token', '_started')
+
+    def __init__(self, trace: Trace, name: str, memory: bool, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.record = {'name': name, 'start_ms': None, 'duration_ms': None, 'depth': 0, 'attrs': attrs}
+        self.memory = memory
+
+    def set(self, **attrs: Any) -> None:
+        """Attach attributes discovered while the span is open (e.g. a cache hit)."""
+        self.record['attrs'].update(attrs)
+
+    def __enter__(self) -> "_Span":
+        depth = _span_depth.get()
+        self.record['depth'] = depth
+        self.token = _span_depth.set(depth + 1)
+        if self.memory:
+            _start_memory()
+        self._started = time.perf_counter()
+        self.record['start_ms'] = round(self.trace._elapsed_ms(), 3)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.record['duration_ms'] = round((time.perf_counter() - self._started) * 1000, 3)
+        if self.memory:
+            self.record['peak_kib'] = round(_stop_memory() / 1024, 1)
+        if exc_type is not None:
+            self.record['error'] = exc_type.__name__
+        _span_depth.reset(self.token)
+        with self.trace._lock:
+            self.trace.spans.append(self.record)
+
+
+class _NullSpan:
+    """Stand-in returned when tracing is off."""
+
+    __slots__ = ()
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, memory: bool = False, **attrs: Any):
+    """
+    Time a block of code within the active trace.
+
+    Args:
+        name: Stage name (e.g. "parse", "llm_call")
+        memory: Also record the tracemalloc peak of the block (parsing). The
+            peak covers the whole process: allocations of work running at the
+            same time (other sessions) are included
+        **attrs: Attributes stored with the span (document name, cache hit, ...)
+
+    Returns:
+        Context manager; a no-op when no trace is active
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name, memory, attrs)
+
+
+@contextmanager
+def start_trace(name: str, enabled: bool = True, log_path: Optional[str] = TRACE_LOG_PATH,
+                **attrs: Any) -> Iterator[Optional[Trace]]:
+    """
+    Record the spans of a unit of work.
+
+    Args:
+        name: Trace name (e.g. "answer", "ingest")
+        enabled: When False, nothing is recorded and None is yielded
+        log_path: JSON-lines file the finished trace is appended to (None: no log)
+        **attrs: Attributes stored with the trace
+
+    Yields:
+        The Trace (its spans are complete once the block exits), or None
+    """
+    if not enabled:
+        yield None
+        return
+
+    trace = Trace(name, **attrs)
+    token = _current_trace.set(trace)
+    depth_token = _span_depth.set(0)
+    try:
+        yield trace
+    finally:
+        _span_depth.reset(depth_token)
+        _current_trace.reset(token)
+        trace.finish()
+        trace.spans.sort(key=lambda record: record['start_ms'])
+        if log_path:
+            write_trace(trace, log_path)
+
+
+def write_trace(trace: Trace, log_path: str = TRACE_LOG_PATH) -> None:
+    """Append a finished trace to the JSON-lines log; logging never fails the request."""
+    line = json.dumps(trace.to_dict(), default=str) + '\n'
+    try:
+        directory = os.path.dirname(log_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with _log_lock, open(log_path, 'a', encoding='utf-8') as f:
+            f.write(line)
+    except OSError:
+        pass
+
+
+def summarize(trace: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Rows of a timing breakdown for display.
+
+    Args:
+        trace: Trace dictionary (Trace.to_dict())
+
+    Returns:
+        One row per span, in start order, with the stage name indented by depth
+    """
+    rows = []
+    for record in trace['spans']:
+        attrs = ', '.join(f"{key}={value}" for key, value in record['attrs'].items())
+        rows.append({
+            'stage': '· ' * record['depth'] + record['name'],
+            'start (ms)': record['start_ms'],
+            'duration (ms)': record['duration_ms'],
+            # tracemalloc peak of the whole process while the span was open
+            'peak (KiB, process)': record.get('peak_kib'),
+            'details': attrs,
+        })
+    return rows